@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Delivery of the email messages produced by the actions. The messages are
+sent in batches over a small pool of SMTP connections (one per thread) that
+are reused for all the batches, respecting a maximum rate of messages per
+server, and retrying each message with an exponential backoff. The result
+is a delivery status per message.
+"""
+from __future__ import unicode_literals, print_function
+
+import itertools
+import smtplib
+import threading
+import time
+
+from django.core import mail
+from django.utils.six.moves import queue
+
+from . import settings
+
+# Rate limiters shared by all the deliveries, one per (host, port)
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+
+class RateLimiter(object):
+    """
+    Spaces the calls to wait so that at most rate of them are allowed per
+    second (a rate of zero means no limit). It can be shared by several
+    threads.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + 1.0 / self.rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_rate_limiter(connection):
+    """
+    Get the rate limiter for the server used by a mail connection. The
+    rate is taken from the setting EMAIL_ACTION_RATE_LIMITS (by host name)
+    or EMAIL_ACTION_RATE_LIMIT.
+
+    :param connection: Mail backend object
+    :return: RateLimiter object
+    """
+    host = getattr(connection, 'host', None)
+    port = getattr(connection, 'port', None)
+    with rate_limiters_lock:
+        limiter = rate_limiters.get((host, port))
+        if limiter is None:
+            limiter = RateLimiter(
+                settings.EMAIL_RATE_LIMITS.get(host, settings.EMAIL_RATE_LIMIT)
+            )
+            rate_limiters[(host, port)] = limiter
+    return limiter
+
+
+def is_permanent_error(error):
+    """
+    :param error: Exception raised when sending a message
+    :return: Boolean stating if sending the message again is pointless
+    """
+    if isinstance(error, (smtplib.SMTPRecipientsRefused,
+                          smtplib.SMTPSenderRefused)):
+        return True
+
+    # 5XX replies are permanent failures
+    return isinstance(error, smtplib.SMTPResponseException) and \
+        error.smtp_code >= 500
+
+
+class DeliveryEngine(object):
+    """
+    Send messages through a pool of connections. Usage:
+
+        engine = DeliveryEngine()
+        for batch in engine.deliver(messages):
+            for msg, error in batch:
+                # error is None if the message was sent
+
+    Each thread opens its connection once and keeps it for all the
+    messages. The messages are consumed (in the calling thread) in batches
+    of batch_size, so the iterable may be a generator using the database.
+    """
+
+    def __init__(self,
+                 num_connections=None,
+                 batch_size=None,
+                 max_retries=None,
+                 retry_delay=None):
+        """
+        :param num_connections: Number of connections (and threads)
+        :param batch_size: Number of messages handed to the pool at once
+        :param max_retries: Number of times a message is sent again
+        :param retry_delay: Seconds before the first retry (then doubled)
+        """
+        self.num_connections = max(
+            1,
+            num_connections or settings.EMAIL_CONNECTIONS)
+        self.batch_size = batch_size or settings.SEND_BATCH_SIZE
+        self.max_retries = settings.EMAIL_MAX_RETRIES \
+            if max_retries is None else max_retries
+        self.retry_delay = settings.EMAIL_RETRY_DELAY \
+            if retry_delay is None else retry_delay
+
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.threads = []
+
+    def send_message(self, connection, limiter, msg):
+        """
+        Send one message over the connection with the retries.
+
+        :param connection: Mail backend object (open)
+        :param limiter: RateLimiter for the server
+        :param msg: EmailMessage object
+        :return: None if sent, or the exception raised in the last attempt
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+            limiter.wait()
+            try:
+                if connection.send_messages([msg]):
+                    return None
+                error = Exception('Message without recipients')
+            except Exception as e:
+                error = e
+
+            if is_permanent_error(error):
+                break
+
+            # The session may be broken, start a new one
+            try:
+                connection.close()
+                connection.open()
+            except Exception as e:
+                error = e
+
+        return error
+
+    def work(self):
+        """
+        Body of each thread: send the messages in the task queue until
+        receiving None.
+        """
+        connection = mail.get_connection()
+        limiter = get_rate_limiter(connection)
+        try:
+            connection.open()
+        except Exception:
+            # Sending the message will try again
+            pass
+
+        try:
+            while True:
+                item = self.tasks.get()
+                if item is None:
+                    break
+                idx, msg = item
+                self.results.put((idx, msg, self.send_message(connection,
+                                                               limiter,
+                                                               msg)))
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def start(self):
+        for __ in range(self.num_connections):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        for __ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def deliver(self, messages):
+        """
+        Generator sending the messages.
+
+        :param messages: Iterable of EmailMessage objects
+        :return: Generator of lists of pairs (message, error) (one list per
+        batch and in the order of the messages). Error is None if the message
+        was sent, or the exception raised otherwise.
+        """
+        messages = iter(messages)
+        self.start()
+        try:
+            while True:
+                batch = list(itertools.islice(messages, self.batch_size))
+                if not batch:
+                    break
+
+                for item in enumerate(batch):
+                    self.tasks.put(item)
+
+                result = [None] * len(batch)
+                for __ in range(len(batch)):
+                    idx, msg, error = self.results.get()
+                    result[idx] = (msg, error)
+
+                yield result
+        finally:
+            self.stop()
@@ -3,10 +3,15 @@
 """
 from __future__ import unicode_literals, print_function
 
+import itertools
+import multiprocessing
 import re
 import string
+from collections import OrderedDict, deque
 
+import pandas as pd
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, connections
 from django.template import Context, Template, TemplateSyntaxError
 from django.template.loader import render_to_string
 from django.utils.html import escape
@@ -14,7 +19,8 @@ from validate_email import validate_email
 
 import dataops.formula_evaluation
 from action.forms import EnterActionIn
-from action.models import Condition
+from action import settings
+from action.models import Action, Condition
 from dataops import pandas_db, ops
 from ontask import OntaskException
 from workflow.models import Workflow
@@ -24,6 +30,17 @@ from workflow.models import Workflow
 action_context_var = 'ONTASK_ACTION_CONTEXT_VARIABLE___'
 viz_number_context_var = 'ONTASK_VIZ_NUMBER_CONTEXT_VARIABLE___'
 
+# Regular expressions detecting the use of a variable, or the
+# presence of a "{% MACRONAME variable %} construct in a string (template)
+var_use_res = [
+    re.compile('(?P<mup_pre>{{\s+)(?P<vname>.+?)(?P<mup_post>\s+\}\})'),
+    re.compile('(?P<mup_pre>{%\s+if\s+)(?P<vname>.+?)(?P<mup_post>\s+%\})')
+]
+
+# Regular expression detecting the blocks of a template ({{ }} and {% %})
+template_block_re = re.compile('{{.*?}}|{%.*?%}', re.DOTALL)
+
+
 def make_xlat(*args, **kwds):
     """
     Auxuliary function to define a translator that applies multiple character
@@ -141,15 +158,25 @@ def render_template(template_text, context_dict, action=None):
     :return: The rendered template
     """
 
-    # Regular expressions detecting the use of a variable, or the
-    # presence of a "{% MACRONAME variable %} construct in a string (template)
-    var_use_res = [
-        re.compile('(?P<mup_pre>{{\s+)(?P<vname>.+?)(?P<mup_post>\s+\}\})'),
-        re.compile('(?P<mup_pre>{%\s+if\s+)(?P<vname>.+?)(?P<mup_post>\s+%\})')
-    ]
-
     # Steps 1 and 2. Apply the tranlation process to all variables that
     # appear in the the template text
+    new_template_text = translate_template_text(template_text)
+
+    # Step 3. Apply the translation process to the context keys
+    new_context = translate_context(context_dict, action)
+
+    # Step 4. Return the redering of the new elements
+    return Template(new_template_text).render(Context(new_context))
+
+
+def translate_template_text(template_text):
+    """
+    Apply the translation process to all the variables that appear in the
+    template text (see render_template).
+
+    :param template_text: Text in the template
+    :return: Template text with the translated names
+    """
     new_template_text = template_text
     for rexpr in var_use_res:
         new_template_text = rexpr.sub(
@@ -157,11 +184,102 @@ def render_template(template_text, context_dict, action=None):
                       translate(m.group('vname')) + \
                       m.group('mup_post'),
             new_template_text)
-    new_template_text = '{% load vis_include %}' + new_template_text
+    return '{% load vis_include %}' + new_template_text
 
-    # Step 3. Apply the translation process to the context keys
-    new_context = dict([(translate(escape(x)), y)
-                        for x, y in context_dict.items()])
+
+def get_template_variables(template_text):
+    """
+    Static analysis of a template to obtain the variables that determine its
+    rendering. The variables are those detected by var_use_res (the same
+    ones translated by translate_template_text). If the template contains
+    any other construct (a tag other than if/else/endif, or a variable not
+    detected by the regular expressions) its result may depend on other
+    elements, and None is returned.
+
+    :param template_text: Text in the template
+    :return: List of (translated) variable names or None
+    """
+    if not template_text:
+        return []
+
+    # Variables used in {{ }} and {% if %}
+    matches = [list(rexpr.finditer(template_text)) for rexpr in var_use_res]
+
+    # Any other use of {{ or tag makes the analysis inconclusive
+    if template_text.count('{{') != len(matches[0]):
+        return None
+    tags = re.findall('{%\s*(\w*)', template_text)
+    if tags.count('if') != len(matches[1]) or \
+            any(x not in ('if', 'else', 'endif') for x in tags):
+        return None
+
+    return list(OrderedDict.fromkeys(
+        translate(m.group('vname')) for m in itertools.chain(*matches)
+    ))
+
+
+def get_action_columns(action, extra_string=None, column_name=None):
+    """
+    Obtain the columns needed to evaluate an action: those used in the
+    action content and the extra string, in the conditions (the filter is
+    evaluated in the database), the optional column_name, and for an action
+    in, its active columns. A column is considered used in a template if its
+    name (as given, escaped or translated) appears in any of its {{ }} or
+    {% %} blocks, so the detection errs on the side of including columns.
+
+    :param action: Action object
+    :param extra_string: Optional extra template (e.g. email subject)
+    :param column_name: Optional column to include (e.g. email)
+    :return: List of column names in the order of the workflow
+    """
+    used = set(itertools.chain.from_iterable(
+        dataops.formula_evaluation.get_variables(x['formula'])
+        for x in Condition.objects.filter(
+            action__id=action.id,
+            is_filter=False
+        ).values('formula')
+    ))
+
+    if column_name:
+        used.add(column_name)
+
+    if not action.is_out:
+        used.update([c.name for c in action.columns.all() if c.is_active])
+
+    blocks = list(itertools.chain.from_iterable(
+        template_block_re.findall(x)
+        for x in [action.content, extra_string] if x
+    ))
+
+    def in_blocks(col_name):
+        names = set([col_name, escape(col_name), translate(escape(col_name))])
+        return any(x in block for x in names for block in blocks)
+
+    return [x for x in action.workflow.get_column_names()
+            if x in used or in_blocks(x)]
+
+
+def translate_context(context_dict, action=None, key_map=None):
+    """
+    Apply the translation process to the keys of a context (see
+    render_template) and add the variables used by the OnTask tags.
+
+    :param context_dict: Dictionary used by Jinja to evaluate the template
+    :param action: Action object to insert in the context
+    :param key_map: Optional dictionary to reuse the translated names. The
+    missing ones are added.
+    :return: New dictionary
+    """
+    if key_map is None:
+        key_map = {}
+
+    new_context = {}
+    for key, value in context_dict.items():
+        new_key = key_map.get(key)
+        if new_key is None:
+            new_key = translate(escape(key))
+            key_map[key] = new_key
+        new_context[new_key] = value
 
     # If the number of elements in the two dictionaries is different, we have
     #  a case of collision in the translation. Need to stop immediately.
@@ -175,8 +293,380 @@ def render_template(template_text, context_dict, action=None):
         raise Exception('Name {0} is reserved.'.format(viz_number_context_var))
     new_context[viz_number_context_var] = 0
 
-    # Step 4. Return the redering of the new elements
-    return Template(new_template_text).render(Context(new_context))
+    return new_context
+
+
+class ActionRenderPlan(object):
+    """
+    Elements needed to render the content of an action (and an optional
+    extra string such as the email subject) for many rows. They are
+    calculated only once: the list of conditions, the attributes, the
+    translated and compiled templates, and the translation of the names of
+    the columns, conditions and attributes used as keys in the context.
+    """
+
+    def __init__(self, action, extra_string=None):
+        """
+        :param action: Action object
+        :param extra_string: Optional extra template (e.g. email subject)
+        """
+        self.action = action
+        self.workflow = action.workflow
+        self.extra_string = extra_string
+
+        # Conditions (the filter is not needed to render)
+        self.conditions = list(Condition.objects.filter(
+            action__id=action.id,
+            is_filter=False
+        ).values('name', 'formula'))
+        self.condition_names = [x['name'] for x in self.conditions]
+
+        self.attributes = self.workflow.attributes
+
+        # Translation of the known names
+        self.key_map = dict([
+            (x, translate(escape(x)))
+            for x in itertools.chain(self.workflow.get_column_names(),
+                                     self.condition_names,
+                                     self.attributes.keys())
+        ])
+
+        # Compiled templates (see get_template)
+        self.template = None
+        self.extra_template = None
+
+        # Variables determining the result of each template (None if the
+        # result cannot be memoized) and rendered text for each tuple of
+        # their values (see render_memo).
+        self.variables = get_template_variables(action.content)
+        self.extra_variables = get_template_variables(extra_string)
+        self.memo = {}
+        self.extra_memo = {}
+
+    def get_template(self):
+        """
+        :return: Compiled template for the action content (created once)
+        """
+        if self.template is None:
+            self.template = Template(
+                translate_template_text(self.action.content)
+            )
+        return self.template
+
+    def get_extra_template(self):
+        """
+        :return: Compiled template for the extra string (created once)
+        """
+        if self.extra_template is None:
+            self.extra_template = Template(
+                translate_template_text(self.extra_string)
+            )
+        return self.extra_template
+
+    def get_context(self, row_values, condition_values):
+        """
+        Create the context (with the translated keys) for a row
+
+        :param row_values: Dictionary with the pairs column name, value
+        :param condition_values: List of Booleans with the result of the
+        conditions (in the order of self.conditions)
+        :return: Dictionary to render the templates
+        """
+        context = dict(row_values)
+        context.update(zip(self.condition_names, condition_values))
+        context.update(self.attributes)
+
+        return translate_context(context, self.action, self.key_map)
+
+    @staticmethod
+    def render_memo(template, context, variables, memo):
+        """
+        Render a template reusing the result obtained for a previous context
+        with the same values in the given variables.
+
+        :param template: Compiled template
+        :param context: Dictionary to render the template
+        :param variables: Variables determining the result (or None)
+        :param memo: Dictionary (tuple of values, text) with the results
+        :return: Rendering of the template
+        """
+        if variables is None:
+            return template.render(Context(context))
+
+        # The type is included so that, for example, 1 and True differ
+        key = tuple((type(context.get(x)), context.get(x)) for x in variables)
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Values that cannot be hashed
+            return template.render(Context(context))
+
+        result = template.render(Context(context))
+        if len(memo) < settings.RENDER_MEMO_SIZE:
+            memo[key] = result
+        return result
+
+    def render(self, context):
+        """
+        :param context: Context obtained with get_context
+        :return: Rendering of the action content
+        """
+        return self.render_memo(self.get_template(),
+                                dict(context),
+                                self.variables,
+                                self.memo)
+
+    def render_extra(self, context):
+        """
+        :param context: Context obtained with get_context
+        :return: Rendering of the extra string
+        """
+        # The action is not available for the extra string
+        context = dict(context)
+        context[action_context_var] = None
+        return self.render_memo(self.get_extra_template(),
+                                context,
+                                self.extra_variables,
+                                self.extra_memo)
+
+
+def evaluate_conditions(data_frame, conditions):
+    """
+    Evaluate a set of conditions for all the rows in a data frame.
+
+    :param data_frame: Data frame with the values of the variables
+    :param conditions: List of dictionaries with the formula and name of the
+    conditions
+    :return: List with one row per row in data_frame with the Boolean results
+    of the conditions (in the order given)
+    """
+    if not conditions:
+        return [[]] * data_frame.shape[0]
+
+    return pd.DataFrame(
+        OrderedDict([
+            (str(idx),
+             dataops.formula_evaluation.evaluate_node_df(x['formula'],
+                                                         data_frame).values)
+            for idx, x in enumerate(conditions)
+        ])
+    ).values.tolist()
+
+
+def render_rows(plan, rows):
+    """
+    Render the action content (and the extra string if present in the
+    plan) for a list of rows.
+
+    :param plan: ActionRenderPlan object
+    :param rows: List of pairs (dictionary of row values, list of condition
+    values)
+    :return: List of lists [content, extra string] (one per row) or a string
+    with an error message
+    """
+    result = []
+    for row_values, condition_values in rows:
+        # Create the context with the attributes, the evaluation of the
+        # conditions and the values of the columns.
+        context = plan.get_context(row_values, condition_values)
+
+        # Run the template with the given context
+        try:
+            partial_result = [plan.render(context)]
+        except Exception as e:
+            return 'Syntax error detected in the action text. ' + e.message
+
+        # If there is extra message, render with context
+        if plan.extra_string:
+            try:
+                partial_result.append(plan.render_extra(context))
+            except Exception as e:
+                return 'Syntax error detected in the subject. ' + e.message
+
+        result.append(partial_result)
+
+    return result
+
+
+# Render plan used by each process in the pool (see init_render_worker)
+worker_plan = None
+
+
+def init_render_worker(action_id, extra_string):
+    """
+    Initialise a process of the rendering pool creating its render plan.
+
+    :param action_id: Primary key of the action being rendered
+    :param extra_string: Optional extra template (e.g. email subject)
+    :return: Nothing
+    """
+    global worker_plan
+    worker_plan = ActionRenderPlan(Action.objects.get(pk=action_id),
+                                   extra_string)
+
+
+def render_rows_worker(rows):
+    """
+    Render a chunk of rows in a process of the rendering pool.
+
+    :param rows: See render_rows
+    :return: See render_rows
+    """
+    return render_rows(worker_plan, rows)
+
+
+def render_action_chunks(plan, chunks):
+    """
+    Generator rendering chunks of rows (see render_rows) in the order given.
+    If RENDER_POOL_SIZE is larger than one, the chunks are distributed
+    among a pool of processes (each one with its own render plan).
+    Otherwise (or within a transaction, as the processes cannot see its
+    changes) they are rendered in this process.
+
+    :param plan: ActionRenderPlan object
+    :param chunks: Iterable of lists of rows
+    :return: Generator with the result of render_rows for each chunk
+    """
+    pool_size = settings.RENDER_POOL_SIZE
+    if pool_size <= 1 or connection.in_atomic_block:
+        for chunk in chunks:
+            yield render_rows(plan, chunk)
+        return
+
+    # The processes cannot share the DB connection of this one
+    connections.close_all()
+    pool = multiprocessing.Pool(pool_size,
+                                init_render_worker,
+                                (plan.action.id, plan.extra_string))
+    try:
+        # The chunks are taken from the iterable in windows (instead of
+        # handing it to imap) so that only a bounded number of them is
+        # fetched ahead of the consumer, and always from this thread.
+        chunks = iter(chunks)
+        while True:
+            window = list(itertools.islice(chunks, 2 * pool_size))
+            if not window:
+                break
+            for result in pool.imap(render_rows_worker, window):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def check_email_column(workflow_id, cond_filter, column_name):
+    """
+    Verify that all the values in the given column (for the rows selected by
+    the filter) are correct email addresses. Only that column is fetched
+    from the database, and it is traversed in chunks.
+
+    :param workflow_id: Primary key of the workflow storing the data
+    :param cond_filter: Condition object to filter the data (or None)
+    :param column_name: Column with the email addresses
+    :return: Boolean stating if all the addresses are correct
+    """
+    for data_frame in pandas_db.get_table_chunks(workflow_id,
+                                                 cond_filter,
+                                                 [column_name]):
+        try:
+            if not all(validate_email(x) for x in data_frame[column_name]):
+                return False
+        except TypeError:
+            return False
+
+    return True
+
+
+def evaluate_action_iter(action, extra_string, column_name):
+    """
+    Generator version of evaluate_action. The pipeline is made of the
+    following stages, each of them consuming the previous one lazily:
+
+    1) Fetch the rows selected by the action filter from a server side
+       cursor in data frames of at most pandas_db.stream_chunk_size rows
+    2) Evaluate the conditions over each data frame and split it in chunks
+       of RENDER_CHUNK_SIZE rows
+    3) Render the chunks (possibly in a pool of processes)
+    4) Produce the lists [body, extra string, column name value]
+
+    Only a bounded number of chunks is in memory at any point in time. The
+    email addresses are verified before any message is produced, so the
+    consumer either receives no elements or the messages for all the rows
+    that could be rendered.
+
+    :param action: Action object with pointers to conditions, filter,
+                   workflow, etc.
+    :param extra_string: An extra string to process (something like the email
+           subject line) with the same dictionary as the text in the action.
+    :param column_name: Column from where to extract the special value (
+           typically the email address) and include it in the result.
+    :return: Generator of lists. If the action cannot be evaluated, an
+             OntaskException is raised with the message as value.
+    """
+
+    # Step 1: Get the workflow to access the data and prepare data
+    workflow = Workflow.objects.get(pk=action.workflow.id)
+    if column_name and column_name not in workflow.get_column_names():
+        column_name = None
+
+    try:
+        cond_filter = Condition.objects.get(action__id=action.id,
+                                            is_filter=True)
+    except ObjectDoesNotExist:
+        cond_filter = None
+
+    # Check if the values in the email column are correct emails
+    if column_name and \
+            not check_email_column(workflow.id, cond_filter, column_name):
+        msg = 'The column with email addresses has incorrect values.'
+        raise OntaskException(msg, msg)
+
+    # Create the plan to render the rows (the filter is skipped)
+    plan = ActionRenderPlan(action, extra_string)
+
+    # Values of column_name for the chunks that are being rendered
+    pending_values = deque()
+
+    # Only the columns used by the action are fetched
+    column_names = get_action_columns(action, extra_string, column_name)
+
+    def row_chunks():
+        # Stages 1 and 2: fetch the data frames and evaluate the conditions
+        for data_frame in pandas_db.get_table_chunks(workflow.id,
+                                                     cond_filter,
+                                                     column_names):
+            condition_matrix = evaluate_conditions(data_frame,
+                                                   plan.conditions)
+            # The tuples keep the type of each column (the rows obtained
+            # with iterrows turn integers into floats if all the columns are
+            # numeric)
+            rows = [(dict(zip(data_frame.columns, row)), condition_values)
+                    for row, condition_values in
+                    zip(data_frame.itertuples(index=False, name=None),
+                        condition_matrix)]
+
+            for idx in range(0, len(rows), settings.RENDER_CHUNK_SIZE):
+                chunk = rows[idx:idx + settings.RENDER_CHUNK_SIZE]
+                pending_values.append(
+                    [row_values.get(column_name)
+                     for row_values, _ in chunk])
+                yield chunk
+
+    # Stages 3 and 4: Render the chunks and attach the column values
+    for rendered in render_action_chunks(plan, row_chunks()):
+        if not isinstance(rendered, list):
+            # Something went wrong, the chunk has the message
+            raise OntaskException(rendered, rendered)
+
+        for partial_result, value in zip(rendered,
+                                         pending_values.popleft()):
+            # If column_name was given (and it exists), create a tuple with
+            # that element as the third component
+            if column_name:
+                partial_result.append(value)
+            yield partial_result
 
 
 def evaluate_action(action, extra_string, column_name):
@@ -195,6 +685,9 @@ def evaluate_action(action, extra_string, column_name):
        List of (HTMLs body, extra string, column name value)
         or an error message
 
+    The evaluation is done by evaluate_action_iter. Use the generator
+    directly to avoid having all the messages in memory.
+
     :param action: Action object with pointers to conditions, filter,
                    workflow, etc.
     :param extra_string: An extra string to process (something like the email
@@ -203,86 +696,10 @@ def evaluate_action(action, extra_string, column_name):
            typically the email address) and include it in the result.
     :return: list of lists resulting from the evaluation of the action
     """
-
-    # Step 1: Get the workflow to access the data and prepare data
-    workflow = Workflow.objects.get(pk=action.workflow.id)
-    col_names = workflow.get_column_names()
-    col_idx = -1
-    if column_name and column_name in col_names:
-        col_idx = col_names.index(column_name)
-
-    # Step 2: Get the row of data from the DB
     try:
-        cond_filter = Condition.objects.get(action__id=action.id,
-                                            is_filter=True)
-    except ObjectDoesNotExist:
-        cond_filter = None
-
-    # Step 3: Get the table data
-    result = []
-    data_frame = pandas_db.get_subframe(workflow.id, cond_filter)
-
-    # Check if the values in the email column are correct emails
-    try:
-        correct_emails = all([validate_email(x)
-                              for x in data_frame[column_name]])
-        if not correct_emails:
-            # column has incorrect email addresses
-            return 'The column with email addresses has incorrect values.'
-    except TypeError:
-        return 'The column with email addresses has incorrect values'
-
-    for _, row in data_frame.iterrows():
-
-        # Get the dict(col_name, value)
-        row_values = dict(zip(col_names, row))
-
-        # Step 3: Evaluate all the conditions
-        condition_eval = {}
-        for condition in Condition.objects.filter(
-                action__id=action.id
-        ).values('is_filter', 'formula', 'name'):
-            if condition['is_filter']:
-                # Filter can be skipped in this stage
-                continue
-
-            # Evaluate the condition
-            condition_eval[condition['name']] = \
-                dataops.formula_evaluation.evaluate_top_node(
-                    condition['formula'],
-                    row_values
-                )
-
-        # Step 4: Create the context with the attributes, the evaluation of the
-        # conditions and the values of the columns.
-        attributes = workflow.attributes
-        context = dict(dict(row_values, **condition_eval), **attributes)
-
-        # Step 5: run the template with the given context
-        # Render the text and append to result
-        try:
-            partial_result = [render_template(action.content,
-                                              context,
-                                              action)]
-        except Exception as e:
-            return 'Syntax error detected in the action text. ' + e.message
-
-        # If there is extra message, render with context and create tuple
-        if extra_string:
-            try:
-                partial_result.append(render_template(extra_string, context))
-            except Exception as e:
-                return 'Syntax error detected in the subject. ' + e.message
-
-        # If column_name was given (and it exists), create a tuple with that
-        # element as the third component
-        if col_idx != -1:
-            partial_result.append(row_values[col_names[col_idx]])
-
-        # Append result
-        result.append(partial_result)
-
-    return result
+        return list(evaluate_action_iter(action, extra_string, column_name))
+    except OntaskException as e:
+        return e.value
 
 
 def evaluate_row(action, row_idx):
@@ -311,15 +728,20 @@ def evaluate_row(action, row_idx):
     except ObjectDoesNotExist:
         cond_filter = None
 
+    # Only the columns used by the action are fetched
+    column_names = get_action_columns(action)
+
     # If row_idx is an integer, get the data by index, otherwise, by key
     if isinstance(row_idx, int):
         row_values = ops.get_table_row_by_index(workflow,
                                                 cond_filter,
-                                                row_idx)
+                                                row_idx,
+                                                column_names)
     else:
         row_values = pandas_db.get_table_row_by_key(workflow,
                                                     cond_filter,
-                                                    row_idx)
+                                                    row_idx,
+                                                    column_names)
     if row_values is None:
         # No rows satisfy the given condition
         return None
@@ -351,18 +773,18 @@ def evaluate_row_out(action, row_values):
     condition_anomalies = []
     for condition in Condition.objects.filter(
             action__id=action.id
-    ).values('name', 'is_filter', 'formula'):
+    ).values('id', 'name', 'is_filter', 'formula', 'modified'):
         if condition['is_filter']:
             # Filter can be skipped in this stage
             continue
 
-        # Evaluate the condition
+        # Evaluate the condition (compiled once for every modification)
         try:
             condition_eval[condition['name']] = \
-                dataops.formula_evaluation.evaluate_top_node(
+                dataops.formula_evaluation.compile_formula(
                     condition['formula'],
-                    row_values
-                )
+                    ('condition', condition['id'], condition['modified'])
+                )(row_values)
         except OntaskException as e:
             condition_anomalies.append(e.value)
 
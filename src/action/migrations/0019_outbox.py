@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('action', '0018_remove_action_filter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Outbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=2048)),
+                ('email_column', models.CharField(max_length=512)),
+                ('from_email', models.CharField(max_length=2048)),
+                ('send_confirmation', models.BooleanField(default=False)),
+                ('track_read', models.BooleanField(default=False)),
+                ('track_column', models.CharField(blank=True, default='', max_length=512)),
+                ('status', models.IntegerField(choices=[(0, 'pending'), (1, 'rendering'), (2, 'sending'), (3, 'done'), (4, 'done_error')], default=0, verbose_name='Execution Status')),
+                ('message', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outboxes', to='action.Action')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('created',),
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.CharField(max_length=2048)),
+                ('subject', models.TextField(blank=True, default='')),
+                ('text', models.TextField(blank=True, default='')),
+                ('html', models.TextField(blank=True, default='')),
+                ('status', models.IntegerField(choices=[(0, 'pending'), (1, 'sending'), (2, 'sent'), (3, 'failed')], db_index=True, default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+                ('outbox', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='action.Outbox')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0023_workflow_data_version'),
+        ('action', '0019_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailTrack',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_name', models.CharField(max_length=512)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('action', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='email_tracks', to='action.Action')),
+                ('column', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='email_track', to='workflow.Column')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EmailRead',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.CharField(max_length=2048)),
+                ('count', models.IntegerField(default=0)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(auto_now=True)),
+                ('track', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reads', to='action.EmailTrack')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='emailread',
+            unique_together=set([('track', 'recipient')]),
+        ),
+    ]
@@ -256,7 +256,9 @@ class Condition(models.Model):
         :return: Nothing. Effect recorded in DB objects
         """
 
-        if column and column not in self.columns.all():
+        if column and (not self.formula or
+                       not formula_evaluation.has_variable(self.formula,
+                                                           column.name)):
             # The column is not part of this condition. Nothing to do
             return
 
@@ -303,3 +305,190 @@ class Condition(models.Model):
         """
         unique_together = ('action', 'name', 'is_filter')
         ordering = ('created',)
+
+
+class Outbox(models.Model):
+    """
+    Request to send the emails of an action. The messages are rendered and
+    stored in the table of OutboxMessage, and then sent, by the script
+    outbox_script (see action.outbox).
+
+    @DynamicAttrs
+    """
+
+    PENDING = 0
+    RENDERING = 1
+    SENDING = 2
+    DONE = 3
+    DONE_ERROR = 4
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             db_index=True,
+                             on_delete=models.CASCADE,
+                             null=False,
+                             blank=False)
+
+    action = models.ForeignKey(Action,
+                               db_index=True,
+                               on_delete=models.CASCADE,
+                               null=False,
+                               blank=False,
+                               related_name='outboxes')
+
+    subject = models.CharField(max_length=2048, blank=False, null=False)
+
+    email_column = models.CharField(max_length=512, blank=False, null=False)
+
+    from_email = models.CharField(max_length=2048, blank=False, null=False)
+
+    send_confirmation = models.BooleanField(default=False, null=False)
+
+    track_read = models.BooleanField(default=False, null=False)
+
+    # Name of the column created to track the emails read (if any)
+    track_column = models.CharField(max_length=512, default='', blank=True)
+
+    # Status of the request
+    status = models.IntegerField(verbose_name="Execution Status",
+                                 choices=[(PENDING, 'pending'),
+                                          (RENDERING, 'rendering'),
+                                          (SENDING, 'sending'),
+                                          (DONE, 'done'),
+                                          (DONE_ERROR, 'done_error')],
+                                 default=PENDING,
+                                 null=False,
+                                 blank=False)
+
+    # Message resulting from the execution
+    message = models.TextField(default='', null=False, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True, null=False, blank=False)
+
+    modified = models.DateTimeField(auto_now=True, null=False)
+
+    def get_progress(self):
+        """
+        :return: Dictionary with the status of the request and the number of
+        messages in each state
+        """
+        counts = dict(
+            (x['status'], x['count'])
+            for x in self.messages.values('status').annotate(
+                count=models.Count('id')).order_by()
+        )
+
+        return {
+            'status': self.get_status_display(),
+            'total': sum(counts.values()),
+            'pending': counts.get(OutboxMessage.PENDING, 0),
+            'sending': counts.get(OutboxMessage.SENDING, 0),
+            'sent': counts.get(OutboxMessage.SENT, 0),
+            'failed': counts.get(OutboxMessage.FAILED, 0),
+            'message': self.message,
+        }
+
+    class Meta:
+        ordering = ('created',)
+
+
+class OutboxMessage(models.Model):
+    """
+    Message rendered for one of the rows of an action and waiting to be
+    sent. A message is marked as SENDING before it is handed to the mail
+    server, so that it is never sent twice.
+    """
+
+    PENDING = 0
+    SENDING = 1
+    SENT = 2
+    FAILED = 3
+
+    outbox = models.ForeignKey(Outbox,
+                               db_index=True,
+                               on_delete=models.CASCADE,
+                               null=False,
+                               blank=False,
+                               related_name='messages')
+
+    recipient = models.CharField(max_length=2048, blank=False, null=False)
+
+    subject = models.TextField(default='', null=False, blank=True)
+
+    # Plain text and HTML versions of the message
+    text = models.TextField(default='', null=False, blank=True)
+
+    html = models.TextField(default='', null=False, blank=True)
+
+    status = models.IntegerField(choices=[(PENDING, 'pending'),
+                                          (SENDING, 'sending'),
+                                          (SENT, 'sent'),
+                                          (FAILED, 'failed')],
+                                 default=PENDING,
+                                 db_index=True,
+                                 null=False,
+                                 blank=False)
+
+    attempts = models.IntegerField(default=0, null=False)
+
+    # Reason of the failure (if any)
+    error = models.TextField(default='', null=False, blank=True)
+
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('id',)
+
+
+class EmailTrack(models.Model):
+    """
+    Send of the emails of an action with read tracking. The number of reads
+    of each recipient is stored in the table of EmailRead and shown in the
+    workflow as a virtual column: its values are not stored in the table of
+    the workflow but joined when a query references the column (see
+    dataops.pandas_db.get_virtual_columns).
+    """
+
+    # Virtual column in the workflow
+    column = models.OneToOneField(Column,
+                                  db_index=True,
+                                  on_delete=models.CASCADE,
+                                  null=False,
+                                  blank=False,
+                                  related_name='email_track')
+
+    action = models.ForeignKey(Action,
+                               db_index=True,
+                               on_delete=models.SET_NULL,
+                               null=True,
+                               blank=True,
+                               related_name='email_tracks')
+
+    # Column with the email addresses of the recipients
+    key_name = models.CharField(max_length=512, blank=False, null=False)
+
+    created = models.DateTimeField(auto_now_add=True, null=False, blank=False)
+
+
+class EmailRead(models.Model):
+    """
+    Number of times that a recipient read an email of a tracked send
+    """
+
+    track = models.ForeignKey(EmailTrack,
+                              db_index=False,
+                              on_delete=models.CASCADE,
+                              null=False,
+                              blank=False,
+                              related_name='reads')
+
+    recipient = models.CharField(max_length=2048, blank=False, null=False)
+
+    count = models.IntegerField(default=0, null=False)
+
+    first_seen = models.DateTimeField(auto_now_add=True, null=False)
+
+    last_seen = models.DateTimeField(auto_now=True, null=False)
+
+    class Meta:
+        # Also the index to join the reads with the table of the workflow
+        unique_together = ('track', 'recipient')
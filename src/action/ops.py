@@ -14,7 +14,7 @@ import pytz
 from django.conf import settings as ontask_settings
 from django.contrib import messages
 from django.contrib.sites.models import Site
-from django.core import signing, mail
+from django.core import signing
 from django.core.mail import send_mail, EmailMultiAlternatives
 from django.http import HttpResponse
 from django.shortcuts import render, redirect
@@ -27,10 +27,12 @@ from rest_framework.parsers import JSONParser
 from rest_framework.renderers import JSONRenderer
 
 import logs.ops
-from action.evaluate import evaluate_row, evaluate_action
+from action.delivery import DeliveryEngine
+from action.evaluate import evaluate_row, evaluate_action_iter
 from action.forms import EnterActionIn, field_prefix
-from action.models import Action
+from action.models import Action, EmailTrack
 from dataops import pandas_db, ops
+from ontask import OntaskException
 from workflow.models import Column
 from workflow.serializers import ActionSelfcontainedSerializer
 from . import settings
@@ -124,9 +126,8 @@ def serve_action_in(request, action, user_attribute_name, is_inst):
                          [where_field],
                          [where_value])
 
-    # Recompute all the values of the conditions in each of the actions
-    for act in action.workflow.actions.all():
-        act.update_n_rows_selected()
+    # Recompute the values of the conditions that use the modified columns
+    ops.enqueue_n_rows_selected(action.workflow.id, set_fields)
 
     # Log the event
     logs.ops.put(request.user,
@@ -167,8 +168,8 @@ def serve_action_out(user, action, user_attribute_name):
         response = render_to_string('action/action_unavailable.html', {})
         payload['error'] = 'Action not enabled for user ' + user.email
 
-    # Log the event
-    logs.ops.put(
+    # Log the event (written at the end of the request)
+    logs.ops.put_buffered(
         user,
         'action_served_execute',
         workflow=action.workflow,
@@ -272,63 +273,28 @@ def clone_actions(actions, new_workflow):
         clone_action(action, new_workflow)
 
 
-def send_messages(user,
-                  action,
-                  subject,
-                  email_column,
-                  from_email,
-                  send_confirmation,
-                  track_read):
+def create_messages(result,
+                    user,
+                    action,
+                    email_column,
+                    from_email,
+                    track_col_name):
     """
-    Performs the submission of the emails for the given action and with the
-    given subject. The subject will be evaluated also with respect to the
-    rows, attributes, and conditions.
+    Generator creating the email messages for the lists [body, subject, to]
+    produced by the evaluation of an action.
+
+    :param result: Iterable with the result of evaluating the action
     :param user: User object that executed the action
     :param action: Action from where to take the messages
-    :param subject: Email subject
     :param email_column: Name of the column from which to extract emails
     :param from_email: Email of the sender
-    :param send_confirmation: Boolean to send confirmation to sender
-    :param track_read: Should read tracking be included?
-    :return: Send the emails
+    :param track_col_name: Column to store the read tracking (or empty)
+    :return: Generator of EmailMultiAlternatives objects
     """
-
-    # Evaluate the action string, evaluate the subject, and get the value of
-    # the email colummn.
-    result = evaluate_action(action,
-                             extra_string=subject,
-                             column_name=email_column)
-
-    # Check the type of the result to see if it was successful
-    if not isinstance(result, list):
-        # Something went wrong. The result contains a message
-        return result
-
-    track_col_name = ''
-    data_frame = None
-    if track_read:
-        data_frame = pandas_db.load_from_db(action.workflow.id)
-        # Make sure the column name does not collide with an existing one
-        i = 0  # Suffix to rename
-        while True:
-            i += 1
-            track_col_name = 'EmailRead_{0}'.format(i)
-            if track_col_name not in data_frame.columns:
-                break
-
-    # Update the number of filtered rows if the action has a filter (table
-    # might have changed)
-    filter = action.conditions.filter(is_filter=True).first()
-    if filter and filter.n_rows_selected != len(result):
-        filter.n_rows_selected = len(result)
-        filter.save()
-
-    # Everything seemed to work to create the messages.
-    msgs = []
     for msg_body, msg_subject, msg_to in result:
 
         # If read tracking is on, add suffix for message (or empty)
-        if track_read:
+        if track_col_name:
             # The track id must identify: action & user
             track_id = {
                 'action': action.id,
@@ -358,49 +324,100 @@ def send_messages(user,
             from_email,
             [msg_to])
         msg.attach_alternative(msg_body + track_str, "text/html")
-        msgs.append(msg)
+        yield msg
 
-    # Mass mail!
-    try:
-        connection = mail.get_connection()
-        connection.send_messages(msgs)
-    except Exception as e:
-        # Something went wrong, notify above
-        return str(e)
 
-    # Add the column if needed
-    if track_read:
-        # Create the new column and store
-        column = Column(
-            name=track_col_name,
-            workflow=action.workflow,
-            data_type='integer',
-            is_key=False,
-            position=action.workflow.ncols + 1
-        )
-        column.save()
+def get_track_column_name(workflow):
+    """
+    :param workflow: Workflow object
+    :return: Name for the column to track the emails read (EmailRead_N)
+    that does not collide with an existing one
+    """
+    column_names = workflow.get_column_names()
+    i = 0  # Suffix to rename
+    while True:
+        i += 1
+        track_col_name = 'EmailRead_{0}'.format(i)
+        if track_col_name not in column_names:
+            return track_col_name
 
-        # Increase the number of columns in the workflow
-        action.workflow.ncols += 1
-        action.workflow.save()
 
-        # Initial value in the data frame and store the table
-        data_frame[track_col_name] = 0
-        ops.store_dataframe_in_db(data_frame, action.workflow.id)
+def add_track_column(action, track_col_name, email_column):
+    """
+    Add the column to track the emails read to the workflow of the action.
+    The column is virtual: the reads are stored in the EmailRead table
+    (indexed by the values in the email column) and joined with the table
+    of the workflow only when the column is used.
+
+    :param action: Action object
+    :param track_col_name: Name of the new column
+    :param email_column: Name of the column with the recipients
+    :return: Nothing. The column is created with initial value zero
+    """
+    # Create the new column and store
+    column = Column(
+        name=track_col_name,
+        workflow=action.workflow,
+        data_type='integer',
+        is_key=False,
+        position=action.workflow.ncols + 1
+    )
+    column.save()
 
-    # Log the events (one per email)
-    now = datetime.datetime.now(pytz.timezone(ontask_settings.TIME_ZONE))
-    context = {
-        'user': user.id,
-        'action': action.id,
-        'email_sent_datetime': str(now),
-    }
-    for msg in msgs:
-        context['subject'] = msg.subject
-        context['body'] = msg.body
-        context['from_email'] = msg.from_email
-        context['to_email'] = msg.to[0]
-        logs.ops.put(user, 'action_email_sent', action.workflow, context)
+    EmailTrack.objects.create(column=column,
+                              action=action,
+                              key_name=email_column)
+
+    # Increase the number of columns in the workflow
+    action.workflow.ncols += 1
+    action.workflow.set_query_builder_ops()
+    action.workflow.save()
+
+
+def log_message_sent(user, action, msg, now):
+    """
+    Log the event of one email sent. The event is buffered, the caller
+    writes the events of each batch with logs.ops.flush.
+
+    :param user: User object that executed the action
+    :param action: Action from where the message was taken
+    :param msg: Email message
+    :param now: Datetime of the execution of the action
+    :return: Nothing
+    """
+    logs.ops.put_buffered(user,
+                          'action_email_sent',
+                          action.workflow,
+                          {'user': user.id,
+                           'action': action.id,
+                           'email_sent_datetime': str(now),
+                           'subject': msg.subject,
+                           'body': msg.body,
+                           'from_email': msg.from_email,
+                           'to_email': msg.to[0]})
+
+
+def finish_send_messages(user,
+                         action,
+                         subject,
+                         num_messages,
+                         num_failed,
+                         now,
+                         send_confirmation):
+    """
+    Log the summary of the messages sent for an action and send the
+    confirmation email (if requested).
+
+    :param user: User object that executed the action
+    :param action: Action from where to take the messages
+    :param subject: Email subject
+    :param num_messages: Number of messages sent
+    :param num_failed: Number of messages that could not be delivered
+    :param now: Datetime of the execution of the action
+    :param send_confirmation: Boolean to send confirmation to sender
+    :return: None or an error message
+    """
+    filter = action.conditions.filter(is_filter=True).first()
 
     # Log the event
     logs.ops.put(
@@ -409,7 +426,8 @@ def send_messages(user,
         action.workflow,
         {'user': user.id,
          'action': action.name,
-         'num_messages': len(msgs),
+         'num_messages': num_messages,
+         'num_failed': num_failed,
          'email_sent_datetime': str(now),
          'filter_present': filter is not None,
          'num_rows': action.workflow.nrows,
@@ -424,7 +442,7 @@ def send_messages(user,
     context = {
         'user': user,
         'action': action,
-        'num_messages': len(msgs),
+        'num_messages': num_messages,
         'email_sent_datetime': now,
         'filter_present': filter is not None,
         'num_rows': action.workflow.nrows,
@@ -446,7 +464,7 @@ def send_messages(user,
         'action_email_notify', action.workflow,
         {'user': user.id,
          'action': action.id,
-         'num_messages': len(msgs),
+         'num_messages': num_messages,
          'email_sent_datetime': str(now),
          'filter_present': filter is not None,
          'num_rows': action.workflow.nrows,
@@ -469,6 +487,124 @@ def send_messages(user,
     return None
 
 
+def update_filter_count(action, num_selected):
+    """
+    Update the number of filtered rows if the action has a filter (table
+    might have changed)
+
+    :param action: Action object
+    :param num_selected: Number of rows selected by the filter
+    :return: Nothing
+    """
+    filter = action.conditions.filter(is_filter=True).first()
+    if filter and filter.n_rows_selected != num_selected:
+        filter.n_rows_selected = num_selected
+        filter.save()
+
+
+def send_messages(user,
+                  action,
+                  subject,
+                  email_column,
+                  from_email,
+                  send_confirmation,
+                  track_read):
+    """
+    Performs the submission of the emails for the given action and with the
+    given subject. The subject will be evaluated also with respect to the
+    rows, attributes, and conditions.
+    :param user: User object that executed the action
+    :param action: Action from where to take the messages
+    :param subject: Email subject
+    :param email_column: Name of the column from which to extract emails
+    :param from_email: Email of the sender
+    :param send_confirmation: Boolean to send confirmation to sender
+    :param track_read: Should read tracking be included?
+    :return: Send the emails
+    """
+
+    # Make sure the column name does not collide with an existing one
+    track_col_name = ''
+    if track_read:
+        track_col_name = get_track_column_name(action.workflow)
+
+    # Evaluate the action string, evaluate the subject, and get the value of
+    # the email colummn. The messages are produced, sent (see
+    # action.delivery) and logged in batches of SEND_BATCH_SIZE, so they are
+    # never all in memory.
+    result = evaluate_action_iter(action,
+                                  extra_string=subject,
+                                  column_name=email_column)
+    msgs = create_messages(result,
+                           user,
+                           action,
+                           email_column,
+                           from_email,
+                           track_col_name)
+
+    now = datetime.datetime.now(pytz.timezone(ontask_settings.TIME_ZONE))
+    num_messages = 0
+    failed = []
+    error_msg = None
+    try:
+        # Mass mail!
+        for batch in DeliveryEngine().deliver(msgs):
+            # Log the events (one per email sent)
+            for msg, error in batch:
+                if error is not None:
+                    failed.append(msg.to[0])
+                    continue
+
+                num_messages += 1
+                log_message_sent(user, action, msg, now)
+
+            # One insert for the events of the batch
+            logs.ops.flush()
+    except OntaskException as e:
+        # The messages could not be created
+        error_msg = e.value
+    except Exception as e:
+        # Something went wrong, notify above
+        error_msg = str(e)
+
+    if error_msg and not num_messages:
+        # Nothing was sent, nothing else to do
+        return error_msg
+
+    if not error_msg:
+        update_filter_count(action, num_messages + len(failed))
+
+    if failed and not error_msg:
+        # Report the recipients of the messages that were not delivered
+        error_msg = '{0} message(s) could not be delivered: {1}'.format(
+            len(failed),
+            ', '.join(failed)
+        )
+
+    # Add the column if needed
+    if track_read:
+        add_track_column(action, track_col_name, email_column)
+
+    if error_msg:
+        # Some messages were not sent. Log the event and notify above
+        finish_send_messages(user,
+                             action,
+                             subject,
+                             num_messages,
+                             len(failed),
+                             now,
+                             False)
+        return error_msg
+
+    return finish_send_messages(user,
+                                action,
+                                subject,
+                                num_messages,
+                                len(failed),
+                                now,
+                                send_confirmation)
+
+
 def do_export_action(action):
     """
     Proceed with the action export.
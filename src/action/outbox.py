@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to send the emails of an action outside of the HTTP request. The
+request creates an Outbox object, and the script outbox_script renders its
+messages (stored as OutboxMessage objects) and sends them. The status of
+the messages is stored before and after handing them to the mail server, so
+the process can be resumed after a crash without sending a message twice.
+"""
+from __future__ import unicode_literals, print_function
+
+import datetime
+import itertools
+import logging
+
+import pytz
+from django.conf import settings as ontask_settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import connection
+from django.db.models import F
+
+import logs.ops
+from action.delivery import DeliveryEngine
+from action.evaluate import evaluate_action_iter
+from action.models import Outbox, OutboxMessage
+from action.ops import (
+    add_track_column,
+    create_messages,
+    finish_send_messages,
+    get_track_column_name,
+    log_message_sent,
+    update_filter_count,
+)
+from ontask import OntaskException
+from . import settings
+
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock taken by the worker processing the outbox
+OUTBOX_LOCK_ID = 7130001
+
+
+def enqueue_messages(user,
+                     action,
+                     subject,
+                     email_column,
+                     from_email,
+                     send_confirmation,
+                     track_read):
+    """
+    Create the request to send the emails of an action (same parameters as
+    action.ops.send_messages).
+
+    :return: Outbox object
+    """
+    return Outbox.objects.create(user=user,
+                                 action=action,
+                                 subject=subject,
+                                 email_column=email_column,
+                                 from_email=from_email,
+                                 send_confirmation=send_confirmation,
+                                 track_read=track_read)
+
+
+def lock_outboxes():
+    """
+    Take the (PostgreSQL session) advisory lock that allows to process the
+    outbox, so that only one worker sends the messages and recovers the
+    interrupted requests. The lock is released when the connection to the
+    DB is closed.
+
+    :return: Boolean stating if the lock was taken
+    """
+    if connection.vendor != 'postgresql':
+        return True
+
+    cursor = connection.cursor()
+    cursor.execute('SELECT pg_try_advisory_lock(%s)', [OUTBOX_LOCK_ID])
+    return cursor.fetchone()[0]
+
+
+def recover_outboxes():
+    """
+    Restore the state after an interruption of the script (the caller must
+    hold the lock, see lock_outboxes). The requests
+    being rendered start again (none of their messages was sent). The
+    messages that were being sent may have been delivered, so they are
+    marked as failed instead of being sent again.
+
+    :return: Nothing
+    """
+    for outbox in Outbox.objects.filter(status=Outbox.RENDERING):
+        outbox.messages.all().delete()
+        outbox.status = Outbox.PENDING
+        outbox.save()
+
+    OutboxMessage.objects.filter(status=OutboxMessage.SENDING).update(
+        status=OutboxMessage.FAILED,
+        error='Interrupted while sending, the message may have been sent'
+    )
+
+
+def render_outbox(outbox):
+    """
+    Render and store the messages of the request in batches of
+    SEND_BATCH_SIZE.
+
+    :param outbox: Outbox object in state PENDING
+    :return: Boolean stating if the messages were rendered
+    """
+    outbox.status = Outbox.RENDERING
+    if outbox.track_read and not outbox.track_column:
+        # The name is kept if the rendering is started again
+        outbox.track_column = get_track_column_name(outbox.action.workflow)
+    outbox.save()
+
+    result = evaluate_action_iter(outbox.action,
+                                  extra_string=outbox.subject,
+                                  column_name=outbox.email_column)
+    msgs = create_messages(result,
+                           outbox.user,
+                           outbox.action,
+                           outbox.email_column,
+                           outbox.from_email,
+                           outbox.track_column)
+    num_messages = 0
+    try:
+        while True:
+            batch = list(itertools.islice(msgs, settings.SEND_BATCH_SIZE))
+            if not batch:
+                break
+
+            OutboxMessage.objects.bulk_create([
+                OutboxMessage(outbox=outbox,
+                              recipient=msg.to[0],
+                              subject=msg.subject,
+                              text=msg.body,
+                              html=msg.alternatives[0][0])
+                for msg in batch
+            ])
+            num_messages += len(batch)
+    except OntaskException as e:
+        outbox.messages.all().delete()
+        outbox.status = Outbox.DONE_ERROR
+        outbox.message = e.value
+        outbox.save()
+        return False
+
+    update_filter_count(outbox.action, num_messages)
+
+    # The column must exist before the messages are read (it may have been
+    # created before an interruption)
+    if outbox.track_read and outbox.track_column not in \
+            outbox.action.workflow.get_column_names():
+        add_track_column(outbox.action,
+                         outbox.track_column,
+                         outbox.email_column)
+
+    outbox.status = Outbox.SENDING
+    outbox.save()
+    return True
+
+
+def pending_messages(outbox):
+    """
+    Generator with the messages of the request that have not been sent yet.
+    They are marked as SENDING (and their attempts increased) in batches of
+    SEND_BATCH_SIZE right before being handed over.
+
+    :param outbox: Outbox object
+    :return: Generator of EmailMultiAlternatives objects with an additional
+    field outbox_message
+    """
+    while True:
+        batch = list(outbox.messages.filter(
+            status=OutboxMessage.PENDING
+        )[:settings.SEND_BATCH_SIZE])
+        if not batch:
+            return
+
+        OutboxMessage.objects.filter(id__in=[x.id for x in batch]).update(
+            status=OutboxMessage.SENDING,
+            attempts=F('attempts') + 1
+        )
+
+        for item in batch:
+            msg = EmailMultiAlternatives(item.subject,
+                                         item.text,
+                                         outbox.from_email,
+                                         [item.recipient])
+            msg.attach_alternative(item.html, "text/html")
+            msg.outbox_message = item
+            yield msg
+
+
+def send_outbox(outbox):
+    """
+    Send the pending messages of the request and record their status.
+
+    :param outbox: Outbox object in state SENDING
+    :return: Nothing
+    """
+    user = outbox.user
+    action = outbox.action
+    now = datetime.datetime.now(pytz.timezone(ontask_settings.TIME_ZONE))
+
+    for batch in DeliveryEngine().deliver(pending_messages(outbox)):
+        sent = []
+        for msg, error in batch:
+            if error is not None:
+                OutboxMessage.objects.filter(
+                    id=msg.outbox_message.id
+                ).update(status=OutboxMessage.FAILED, error=str(error))
+                continue
+
+            sent.append(msg.outbox_message.id)
+            log_message_sent(user, action, msg, now)
+
+        OutboxMessage.objects.filter(id__in=sent).update(
+            status=OutboxMessage.SENT,
+            sent=now)
+        logs.ops.flush()
+
+    progress = outbox.get_progress()
+    outbox.message = finish_send_messages(user,
+                                          action,
+                                          outbox.subject,
+                                          progress['sent'],
+                                          progress['failed'],
+                                          now,
+                                          outbox.send_confirmation) or ''
+    if progress['failed']:
+        outbox.status = Outbox.DONE_ERROR
+        outbox.message = \
+            '{0} message(s) could not be delivered. '.format(
+                progress['failed']
+            ) + outbox.message
+    else:
+        outbox.status = Outbox.DONE
+    outbox.save()
+
+
+def process_outboxes():
+    """
+    Render and send the messages of all the pending requests (in order of
+    creation).
+
+    :return: Number of requests processed
+    """
+    processed = 0
+    for outbox in Outbox.objects.filter(
+            status__in=[Outbox.PENDING, Outbox.SENDING]
+    ).select_related('action', 'user'):
+        try:
+            if outbox.status == Outbox.PENDING and not render_outbox(outbox):
+                processed += 1
+                continue
+
+            send_outbox(outbox)
+        except Exception as e:
+            logger.error('Error while sending the messages of outbox ' +
+                         str(outbox.id) + ': ' + str(e))
+            outbox.status = Outbox.DONE_ERROR
+            outbox.message = str(e)
+            outbox.save()
+
+        processed += 1
+
+    return processed
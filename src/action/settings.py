@@ -38,6 +38,38 @@ NOTIFICATION_SENDER = getattr(settings,
 
 PIXEL = getattr(settings, 'EMAIL_ACTION_PIXEL', None)
 
+# Number of processes used to render the messages of an action (0 or 1 to
+# render them in the process serving the request) and number of rows
+# rendered in each step
+RENDER_POOL_SIZE = getattr(settings, 'ACTION_RENDER_POOL_SIZE', 0)
+
+RENDER_CHUNK_SIZE = getattr(settings, 'ACTION_RENDER_CHUNK_SIZE', 250)
+
+# Maximum number of different renderings of a template kept to be reused by
+# the rows with the same values in the variables used in the template
+RENDER_MEMO_SIZE = getattr(settings, 'ACTION_RENDER_MEMO_SIZE', 1000)
+
+# Number of email messages created and handed to the mail backend at once
+SEND_BATCH_SIZE = getattr(settings, 'ACTION_SEND_BATCH_SIZE', 100)
+
+# Store the messages in the outbox to be sent by the script outbox_script
+# instead of sending them while processing the request (see action.outbox)
+EMAIL_OUTBOX = getattr(settings, 'EMAIL_ACTION_OUTBOX', False)
+
+# Delivery of the messages (see action.delivery): number of connections
+# used in parallel, maximum number of messages per second sent to a server
+# (0 for no limit, EMAIL_ACTION_RATE_LIMITS may contain a value per host),
+# number of retries per message and delay (in seconds) before the first one.
+EMAIL_CONNECTIONS = getattr(settings, 'EMAIL_ACTION_CONNECTIONS', 1)
+
+EMAIL_RATE_LIMIT = getattr(settings, 'EMAIL_ACTION_RATE_LIMIT', 0)
+
+EMAIL_RATE_LIMITS = getattr(settings, 'EMAIL_ACTION_RATE_LIMITS', {})
+
+EMAIL_MAX_RETRIES = getattr(settings, 'EMAIL_ACTION_MAX_RETRIES', 2)
+
+EMAIL_RETRY_DELAY = getattr(settings, 'EMAIL_ACTION_RETRY_DELAY', 1.0)
+
 if 'siteprefs' in settings.INSTALLED_APPS:
     # Respect those users who don't have siteprefs installed.
     from siteprefs.toolbox import patch_locals, register_prefs, pref, \
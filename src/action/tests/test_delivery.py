@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+import asyncore
+import smtpd
+import threading
+
+from django.core.mail import EmailMessage
+from django.test import override_settings
+
+import test
+from action.delivery import DeliveryEngine
+
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    """
+    SMTP stand-in storing the recipients of the messages received. The
+    addresses starting with "temporary" fail the first time, and those
+    starting with "rejected" always fail.
+    """
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.received = []
+        self.failed_once = set()
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        rcpt = rcpttos[0]
+        if rcpt.startswith('rejected'):
+            return '550 No such user'
+
+        if rcpt.startswith('temporary') and rcpt not in self.failed_once:
+            self.failed_once.add(rcpt)
+            return '451 Try again later'
+
+        self.received.append(rcpt)
+        return None
+
+
+class ActionDelivery(test.OntaskTestCase):
+
+    def setUp(self):
+        super(ActionDelivery, self).setUp()
+        self.server = LocalSMTPServer()
+        self.thread = threading.Thread(target=asyncore.loop,
+                                       kwargs={'timeout': 0.1})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.close()
+        self.thread.join()
+        super(ActionDelivery, self).tearDown()
+
+    # Test the status of each message sent over several connections
+    def test_deliver(self):
+        recipients = ['student{0}@bogus.com'.format(idx) for idx in range(20)]
+        recipients += ['temporary@bogus.com', 'rejected@bogus.com']
+        msgs = [EmailMessage('Subject', 'Body', 'sender@bogus.com', [x])
+                for x in recipients]
+
+        with override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                EMAIL_HOST='127.0.0.1',
+                EMAIL_PORT=self.server.port):
+            engine = DeliveryEngine(num_connections=3,
+                                    batch_size=8,
+                                    max_retries=1,
+                                    retry_delay=0)
+            batches = list(engine.deliver(msgs))
+
+        self.assertEqual([len(x) for x in batches], [8, 8, 6])
+        result = sum(batches, [])
+
+        # Results in the order of the messages
+        self.assertEqual([msg.to[0] for msg, __ in result], recipients)
+
+        # Only the rejected one failed (the temporary one was retried)
+        self.assertEqual(
+            [msg.to[0] for msg, error in result if error is not None],
+            ['rejected@bogus.com'])
+        self.assertEqual(sorted(self.server.received),
+                         sorted(recipients[:-1]))
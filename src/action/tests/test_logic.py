@@ -4,11 +4,34 @@ from __future__ import unicode_literals, print_function
 import os
 
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
 from django.shortcuts import reverse
+from django.test import override_settings
 from django.core.management import call_command
+from django.db import connection
 
+import logs.ops
 import test
+from action.evaluate import (
+    ActionRenderPlan,
+    evaluate_action,
+    evaluate_action_iter,
+    evaluate_row_out,
+    get_action_columns,
+    get_template_variables,
+    render_action_chunks,
+    render_rows,
+    render_template)
+from action.models import Action, Outbox, OutboxMessage
+from action.ops import add_track_column, send_messages
+from action.outbox import OUTBOX_LOCK_ID, enqueue_messages, lock_outboxes, \
+    process_outboxes, recover_outboxes
 from dataops import pandas_db
+from dataops.formula_evaluation import get_variables
+from dataops.models import PendingIncrement
+from dataops.ops import increase_column, process_pending_increments
+from logs.models import Log
 from workflow.models import Workflow
 
 
@@ -31,10 +54,9 @@ class EmailActionTracking(test.OntaskTestCase):
     wflow_desc = 'description text for workflow 1'
     wflow_empty = 'The workflow does not have data'
 
-    @classmethod
-    def setUpClass(cls):
-        super(EmailActionTracking, cls).setUpClass()
-        pandas_db.pg_restore_table(cls.filename)
+    def setUp(self):
+        super(EmailActionTracking, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
 
     def tearDown(self):
         pandas_db.delete_all_tables()
@@ -59,3 +81,352 @@ class EmailActionTracking(test.OntaskTestCase):
                     int(df.loc[df['email'] == uemail, 'EmailRead_1'].values[0]),
                     idx
                 )
+
+
+    # Test that the deferred tracking hits are applied in bulk
+    def test_deferred_tracking(self):
+        with override_settings(DATAOPS_DEFERRED_INCREMENT=True):
+            for trck in self.trck_tokens * 2:
+                self.client.get(reverse('trck') + '?v=' + trck)
+
+        workflow = Workflow.objects.get(name=self.wflow_name)
+        df = pandas_db.load_from_db(workflow.id)
+        self.assertTrue(all(df['EmailRead_1'].fillna(0) == 0))
+
+        self.assertEqual(process_pending_increments(),
+                         2 * len(self.trck_tokens))
+        self.assertEqual(process_pending_increments(), 0)
+
+        df = pandas_db.load_from_db(workflow.id)
+        for uemail in [x[1] for x in test.user_info
+                       if x[1].startswith('student')]:
+            self.assertEqual(
+                int(df.loc[df['email'] == uemail, 'EmailRead_1'].values[0]),
+                2
+            )
+
+    # Test that the increments that cannot be applied stay in the queue
+    def test_failed_increments(self):
+        workflow = Workflow.objects.get(name=self.wflow_name)
+        uemail = 'student1@bogus.com'
+        PendingIncrement.objects.create(workflow=workflow,
+                                        column_name='EmailRead_1',
+                                        key_name='email',
+                                        key_value=uemail)
+        PendingIncrement.objects.create(workflow=workflow,
+                                        column_name='NotAColumn',
+                                        key_name='email',
+                                        key_value=uemail)
+
+        self.assertEqual(process_pending_increments(), 1)
+        failed = PendingIncrement.objects.get()
+        self.assertEqual(failed.column_name, 'NotAColumn')
+        self.assertEqual(failed.attempts, 1)
+        self.assertNotEqual(failed.error, '')
+
+        # Not tried again after the maximum number of attempts
+        with override_settings(DATAOPS_INCREMENT_MAX_ATTEMPTS=1):
+            self.assertEqual(process_pending_increments(), 0)
+        self.assertEqual(PendingIncrement.objects.get().attempts, 1)
+
+
+    # Test that the reads of a new send are stored outside the data table
+    def test_virtual_tracking_column(self):
+        action = Action.objects.get(name='simple action')
+        user = get_user_model().objects.get(email='idesigner1@bogus.com')
+        send_messages(user,
+                      action,
+                      'Hi {{ name }}',
+                      'email',
+                      user.email,
+                      False,
+                      True)
+
+        workflow = Workflow.objects.get(pk=action.workflow.id)
+        self.assertIn('EmailRead_2',
+                      pandas_db.get_virtual_column_names(workflow.id))
+        self.assertNotIn(
+            'EmailRead_2',
+            pandas_db.load_table(pandas_db.create_table_name(workflow.id))
+        )
+
+        uemail = 'student1@bogus.com'
+        increase_column(workflow.id, 'EmailRead_2', 'email', [(uemail, 1)])
+        increase_column(workflow.id, 'EmailRead_2', 'email', [(uemail, 2)])
+
+        df = pandas_db.load_from_db(workflow.id)
+        self.assertEqual(
+            int(df.loc[df['email'] == uemail, 'EmailRead_2'].values[0]),
+            3)
+        self.assertEqual(
+            int(df.loc[df['email'] != uemail, 'EmailRead_2'].sum()),
+            0)
+
+        # Filters use the values of the virtual column
+        cond_filter = {
+            'condition': 'AND',
+            'not': False,
+            'rules': [{'id': 'EmailRead_2',
+                       'field': 'EmailRead_2',
+                       'type': 'integer',
+                       'input': 'number',
+                       'operator': 'greater',
+                       'value': '0'}],
+            'valid': True
+        }
+        self.assertEqual(pandas_db.num_rows(workflow.id, cond_filter), 1)
+
+        # The searches in the virtual columns do not use the search index
+        pandas_db.create_search_index(workflow.id)
+        qs = pandas_db.search_table_rows(workflow.id,
+                                         [('EmailRead_2', '3', 'integer')],
+                                         column_names=['email'])
+        self.assertEqual([x[0] for x in qs], [uemail])
+        self.assertEqual(
+            pandas_db.search_table_rows_count(
+                workflow.id,
+                [('EmailRead_2', '3', 'integer')]),
+            1)
+
+        # Dropping the key column keeps the values in a regular column
+        pandas_db.df_drop_column(workflow.id, 'email')
+        self.assertNotIn('EmailRead_2',
+                         pandas_db.get_virtual_column_names(workflow.id))
+        df = pandas_db.load_table(pandas_db.create_table_name(workflow.id))
+        self.assertEqual(int(df['EmailRead_2'].sum()), 3)
+
+
+class ActionEvaluate(test.OntaskTestCase):
+    fixtures = ['simple_email_action']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'action',
+        'fixtures',
+        'simple_email_action_df.sql'
+    )
+
+    def setUp(self):
+        super(ActionEvaluate, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(ActionEvaluate, self).tearDown()
+
+    # Test that the evaluation of all rows matches the one of each row
+    def test_evaluate_action(self):
+        action = Action.objects.get(name='simple action')
+
+        # A row with a NULL value in the variable of the conditions
+        df = pandas_db.load_from_db(action.workflow.id)
+        pandas_db.update_row(action.workflow.id,
+                             ['age'],
+                             [None],
+                             ['email'],
+                             [df['email'][0]])
+
+        result = evaluate_action(action, 'Hi {{ name }}', 'email')
+        self.assertTrue(isinstance(result, list))
+
+        df = pandas_db.load_from_db(action.workflow.id)
+        self.assertEqual(len(result), df.shape[0])
+        for msg_body, msg_subject, msg_to in result:
+            row_values = pandas_db.get_table_row_by_key(
+                action.workflow,
+                None,
+                ('email', msg_to)
+            )
+            self.assertEqual(msg_body, evaluate_row_out(action, row_values))
+            self.assertEqual(msg_subject,
+                             render_template('Hi {{ name }}', row_values))
+
+    # Test that the rendering by chunks keeps the order
+    def test_render_action_chunks(self):
+        action = Action.objects.get(name='simple action')
+        plan = ActionRenderPlan(action, 'Hi {{ name }}')
+        rows = [({'name': 'n{0}'.format(idx)}, [idx % 2 == 0, idx % 2 == 1])
+                for idx in range(10)]
+
+        result = sum(
+            list(render_action_chunks(
+                plan,
+                [rows[idx:idx + 3] for idx in range(0, len(rows), 3)])),
+            [])
+
+        self.assertEqual(len(result), 10)
+        for idx, (msg_body, msg_subject) in enumerate(result):
+            self.assertEqual(msg_subject, 'Hi n{0}'.format(idx))
+            self.assertIn('Low' if idx % 2 == 0 else 'High', msg_body)
+
+    # Test that the generator produces the same messages as the list
+    def test_evaluate_action_iter(self):
+        action = Action.objects.get(name='simple action')
+        result = evaluate_action(action, 'Hi {{ name }}', 'email')
+
+        self.assertEqual(
+            list(evaluate_action_iter(action, 'Hi {{ name }}', 'email')),
+            result)
+
+    # Test that the messages are sent (in batches) and logged
+    def test_send_messages(self):
+        action = Action.objects.get(name='simple action')
+        user = get_user_model().objects.get(email='idesigner1@bogus.com')
+        df = pandas_db.load_from_db(action.workflow.id)
+        num_logs = Log.objects.filter(name='action_email_sent').count()
+
+        result = send_messages(user,
+                               action,
+                               'Hi {{ name }}',
+                               'email',
+                               user.email,
+                               False,
+                               True)
+
+        self.assertIsNone(result)
+        self.assertEqual(len(mail.outbox), df.shape[0])
+        self.assertEqual(sorted(msg.to[0] for msg in mail.outbox),
+                         sorted(df['email']))
+        workflow = Workflow.objects.get(pk=action.workflow.id)
+        self.assertIn('EmailRead_2', workflow.get_column_names())
+
+        # One event per message plus the summary, nothing left in the buffer
+        self.assertEqual(
+            Log.objects.filter(name='action_email_sent').count(),
+            num_logs + df.shape[0] + 1)
+        self.assertEqual(logs.ops.flush(), 0)
+
+    # Test the detection of the variables and the reuse of the renderings
+    def test_render_memo(self):
+        self.assertEqual(
+            get_template_variables(
+                '{% if c1 %}{{ name }}{% else %}{{ one }}{% endif %}'),
+            ['name', 'one', 'c1'])
+        self.assertIsNone(get_template_variables('{{name}}'))
+        self.assertIsNone(get_template_variables('{% visualization "one" %}'))
+
+        action = Action.objects.get(name='simple action')
+        plan = ActionRenderPlan(action, 'Hi {{ name }}')
+        self.assertEqual(plan.variables, ['c1', 'c2'])
+
+        rows = [({'name': 'n{0}'.format(idx % 3)},
+                 [idx % 2 == 0, idx % 2 == 1])
+                for idx in range(10)]
+        result = render_rows(plan, rows)
+
+        # Two different bodies and three different subjects
+        self.assertEqual(len(plan.memo), 2)
+        self.assertEqual(len(plan.extra_memo), 3)
+        for idx, (msg_body, msg_subject) in enumerate(result):
+            self.assertEqual(msg_subject, 'Hi n{0}'.format(idx % 3))
+            self.assertIn('Low' if idx % 2 == 0 else 'High', msg_body)
+
+    # Test the detection of the columns used by an action
+    def test_action_columns(self):
+        action = Action.objects.get(name='simple action')
+        columns = set(get_action_columns(action, 'Hi {{ name }}', 'email'))
+
+        # The condition variables, the subject and the email column
+        self.assertIn('name', columns)
+        self.assertIn('email', columns)
+        for condition in action.conditions.filter(is_filter=False):
+            self.assertTrue(
+                columns.issuperset(get_variables(condition.formula)))
+        self.assertNotIn('EmailRead_1', columns)
+
+    # Test that the integers are rendered as such with only numeric columns
+    def test_action_numeric_columns(self):
+        action = Action.objects.get(name='simple action')
+        action.content = '{{ sid }}'
+        action.save()
+
+        self.assertTrue(
+            set(get_action_columns(action, '{{ sid }}')).issubset(
+                set(['sid', 'age'])))
+
+        df = pandas_db.load_from_db(action.workflow.id)
+        sids = set([str(x) for x in df['sid']])
+        for body, subject in evaluate_action_iter(action, '{{ sid }}', None):
+            self.assertIn(subject, sids)
+            self.assertIn(body.strip(), sids)
+
+    # Test the messages sent through the outbox
+    def test_outbox(self):
+        action = Action.objects.get(name='simple action')
+        user = get_user_model().objects.get(email='idesigner1@bogus.com')
+        df = pandas_db.load_from_db(action.workflow.id)
+
+        outbox = enqueue_messages(user,
+                                  action,
+                                  'Hi {{ name }}',
+                                  'email',
+                                  user.email,
+                                  False,
+                                  True)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(process_outboxes(), 1)
+        outbox = Outbox.objects.get(pk=outbox.id)
+        self.assertEqual(outbox.status, Outbox.DONE)
+        self.assertEqual(outbox.track_column, 'EmailRead_2')
+        progress = outbox.get_progress()
+        self.assertEqual(progress['total'], df.shape[0])
+        self.assertEqual(progress['sent'], df.shape[0])
+        self.assertEqual(len(mail.outbox), df.shape[0])
+
+        # Nothing else is sent when executed again
+        recover_outboxes()
+        self.assertEqual(process_outboxes(), 0)
+        self.assertEqual(len(mail.outbox), df.shape[0])
+
+        # A message interrupted while being sent is not sent again
+        outbox.status = Outbox.SENDING
+        outbox.save()
+        outbox.messages.filter(
+            id=outbox.messages.first().id
+        ).update(status=OutboxMessage.SENDING)
+        recover_outboxes()
+        self.assertEqual(process_outboxes(), 1)
+        self.assertEqual(len(mail.outbox), df.shape[0])
+        self.assertEqual(Outbox.objects.get(pk=outbox.id).status,
+                         Outbox.DONE_ERROR)
+
+    # Test that a rendering started again reuses the tracking column
+    def test_outbox_rerender(self):
+        action = Action.objects.get(name='simple action')
+        user = get_user_model().objects.get(email='idesigner1@bogus.com')
+        outbox = enqueue_messages(user,
+                                  action,
+                                  'Hi {{ name }}',
+                                  'email',
+                                  user.email,
+                                  False,
+                                  True)
+
+        # Interrupted after creating the column
+        add_track_column(action, 'EmailRead_2', 'email')
+        outbox.track_column = 'EmailRead_2'
+        outbox.status = Outbox.RENDERING
+        outbox.save()
+
+        recover_outboxes()
+        self.assertEqual(process_outboxes(), 1)
+        outbox = Outbox.objects.get(pk=outbox.id)
+        self.assertEqual(outbox.status, Outbox.DONE)
+        self.assertEqual(outbox.track_column, 'EmailRead_2')
+        column_names = Workflow.objects.get(
+            pk=action.workflow.id
+        ).get_column_names()
+        self.assertEqual(column_names.count('EmailRead_2'), 1)
+        self.assertNotIn('EmailRead_3', column_names)
+
+    # Test that only one worker processes the outbox
+    def test_outbox_lock(self):
+        self.assertTrue(lock_outboxes())
+        try:
+            with pandas_db.engine.connect() as other_connection:
+                self.assertFalse(other_connection.execute(
+                    'SELECT pg_try_advisory_lock({0})'.format(OUTBOX_LOCK_ID)
+                ).scalar())
+        finally:
+            cursor = connection.cursor()
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [OUTBOX_LOCK_ID])
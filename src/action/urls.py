@@ -153,6 +153,11 @@ urlpatterns = [
         views_email.request_data,
         name="send_email"),
 
+    # Progress of the emails queued in the outbox
+    url(r'^(?P<pk>\d+)/outbox_progress/$',
+        views_email.outbox_progress,
+        name='outbox_progress'),
+
     # Preview emails
     url(r'^(?P<pk>\d+)/(?P<idx>\d+)/email_preview/$',
         views_email.preview,
@@ -1162,15 +1162,25 @@ def run_ss(request, pk):
         order_col.name,
         order_dir == 'asc',
         column_names,  # Column names in the action
-        filter.formula if filter else None
+        filter.formula if filter else None,
+        start,
+        length if length >= 0 else None
     )
 
+    # Count the rows satisfying the search only if there is one
+    if cv_tuples or filter:
+        records_filtered = pandas_db.search_table_rows_count(
+            workflow.id,
+            cv_tuples,
+            True,
+            filter.formula if filter else None
+        )
+    else:
+        records_filtered = workflow.nrows
+
     # Post processing + adding operations
     final_qs = []
-    items = 0
-    for row in qs[start:start + length]:
-        items += 1
-
+    for row in qs:
         # Render the first element (the key) as the link to the page to update
         # the content.
         dst_url = reverse('action:run_row', kwargs={'pk': action.id})
@@ -1187,14 +1197,10 @@ def run_ss(request, pk):
         # Add the row for rendering
         final_qs.append(row)
 
-        if items == length:
-            # We reached the number or requested elements, abandon loop
-            break
-
     data = {
         'draw': draw,
         'recordsTotal': workflow.nrows,
-        'recordsFiltered': len(qs),
+        'recordsFiltered': records_filtered,
         'data': final_qs
     }
 
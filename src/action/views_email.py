@@ -4,10 +4,13 @@ from __future__ import unicode_literals, print_function
 from django.contrib.auth.decorators import user_passes_test
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
+from django.http import JsonResponse
 from django.shortcuts import redirect, render
 
-from action.models import Action
+from action import settings
+from action.models import Action, Outbox
 from action.ops import send_messages
+from action.outbox import enqueue_messages
 from action.views_action import preview_response
 from ontask.permissions import is_instructor
 from workflow.ops import get_workflow
@@ -42,6 +45,21 @@ def request_data(request, pk):
 
     # Process the POST
     if request.method == 'POST':
+        if form.is_valid() and settings.EMAIL_OUTBOX:
+            # Queue the emails, they are sent by the outbox script
+            outbox = enqueue_messages(request.user,
+                                      action,
+                                      form.cleaned_data['subject'],
+                                      form.cleaned_data['email_column'],
+                                      request.user.email,
+                                      form.cleaned_data['send_confirmation'],
+                                      form.cleaned_data['track_read'])
+
+            return render(request,
+                          'action/email_done.html',
+                          {'outbox': outbox,
+                           'download': form.cleaned_data['export_wf']})
+
         if form.is_valid():
             # Send the emails!
             result = send_messages(request.user,
@@ -83,6 +101,26 @@ def request_data(request, pk):
                    'form': form})
 
 
+@user_passes_test(is_instructor)
+def outbox_progress(request, pk):
+    """
+    JSON response with the progress of the emails queued in an outbox.
+
+    :param request: HTTP request (GET)
+    :param pk: Outbox key
+    :return: JSON with the status and the number of messages (total,
+    pending, sending, sent and failed)
+    """
+    try:
+        outbox = Outbox.objects.filter(
+            Q(action__workflow__user=request.user) |
+            Q(action__workflow__shared=request.user)).distinct().get(pk=pk)
+    except ObjectDoesNotExist:
+        return JsonResponse({}, status=404)
+
+    return JsonResponse(outbox.get_progress())
+
+
 @user_passes_test(is_instructor)
 def preview(request, pk, idx):
     """
@@ -7,3 +7,6 @@ from django.apps import AppConfig
 class DataopsConfig(AppConfig):
     name = 'dataops'
     verbose_name = 'Data Upload/Merge Operations'
+
+    def ready(self):
+        from . import signals  # noqa
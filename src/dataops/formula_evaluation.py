@@ -1,12 +1,71 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import hashlib
 import itertools
+import json
 
+import pandas as pd
 from django.utils.dateparse import parse_datetime
 
 from ontask import OntaskException, fix_pctg_in_name
 
+# Functions obtained by compile_formula indexed by the hash of the formula
+compiled_formulas = {}
+
+# Maximum number of compiled formulas kept (the cache is emptied when full)
+compiled_formulas_max_size = 2048
+
+# Types that can be used with the comparison operators
+comparison_types = ('integer', 'double', 'datetime')
+
+# Pandas string functions (and negation) used for the string operators when
+# evaluating over data frames (see evaluate_node_df)
+string_operators = {
+    'begins_with': (lambda s, c: s.startswith(c), False),
+    'not_begin_with': (lambda s, c: s.startswith(c), True),
+    'not_begins_with': (lambda s, c: s.startswith(c), True),
+    'contains': (lambda s, c: s.contains(c, regex=False), False),
+    'not_contains': (lambda s, c: s.contains(c, regex=False), True),
+    'ends_with': (lambda s, c: s.endswith(c), False),
+    'not_ends_width': (lambda s, c: s.endswith(c), True),
+}
+
+# Comparison functions over series when evaluating over data frames
+comparison_operators = {
+    'less': lambda s, c: s < c,
+    'less_or_equal': lambda s, c: s <= c,
+    'greater': lambda s, c: s > c,
+    'greater_or_equal': lambda s, c: s >= c,
+    'between': lambda s, c: (s >= c[0]) & (s <= c[1]),
+    'not_between': lambda s, c: (s < c[0]) | (s > c[1]),
+}
+
+# Functions to evaluate a terminal node given the (non null) variable value
+# and the constant, result when the variable is null (None for unknown, as
+# in SQL), and types for which the operator can be used (None for any)
+operator_functions = {
+    'equal': (lambda v, c: v == c, False, None),
+    'not_equal': (lambda v, c: v != c, True, None),
+    'begins_with': (lambda v, c: v.startswith(c), False, ('string',)),
+    'not_begin_with': (lambda v, c: not v.startswith(c), True, ('string',)),
+    'not_begins_with': (lambda v, c: not v.startswith(c), True, ('string',)),
+    'contains': (lambda v, c: v.find(c) != -1, False, ('string',)),
+    'not_contains': (lambda v, c: v.find(c) == -1, True, ('string',)),
+    'ends_with': (lambda v, c: v.endswith(c), False, ('string',)),
+    'not_ends_width': (lambda v, c: not v.endswith(c), True, ('string',)),
+    'is_empty': (lambda v, c: v == '', True, ('string',)),
+    'is_not_empty': (lambda v, c: v != '', False, ('string',)),
+    'less': (lambda v, c: v < c, None, comparison_types),
+    'less_or_equal': (lambda v, c: v <= c, None, comparison_types),
+    'greater': (lambda v, c: v > c, None, comparison_types),
+    'greater_or_equal': (lambda v, c: v >= c, None, comparison_types),
+    'between': (lambda v, c: c[0] <= v <= c[1], None, comparison_types),
+    'not_between': (lambda v, c: not (c[0] <= v <= c[1]),
+                    None,
+                    comparison_types),
+}
+
 
 def has_variable(formula, variable):
     """
@@ -85,138 +144,299 @@ def evaluate_top_node(query_obj, given_vars):
     # Pop the "valid" field. It should always be true anyway
     # query_obj.pop('valid')
 
-    return evaluate_node(query_obj, given_vars)
+    return compile_formula(query_obj)(given_vars)
 
 
-def evaluate_node(node, given_variables):
+def get_formula_key(formula):
     """
-    Given a node representing a query, and a dictionary with (name, values),
-    evaluates the expression represented by the node.
+    :param formula: Object produced by jQuery QueryBuilder
+    :return: String with a hash identifying the formula
+    """
+    return hashlib.md5(
+        json.dumps(formula, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def compile_formula(formula, key=None):
+    """
+    Obtain a function that given a dictionary of (varname, varvalue)
+    evaluates the formula (same result as evaluate_node and, for each row,
+    as evaluate_node_df). The functions are
+    kept in a cache shared by all the formulas, so the formula is translated
+    only once. The cache is indexed by the given key or, if there is none,
+    by the hash of the formula (see get_formula_key).
+
+    :param formula: Object produced by jQuery QueryBuilder
+    :param key: Optional value identifying the formula that changes when
+    the formula changes (e.g. id and modification time of a condition), so
+    that the hash is not calculated
+    :return: Function receiving the dictionary with the variables
+    """
+    if key is None:
+        key = get_formula_key(formula)
+    result = compiled_formulas.get(key)
+    if result is None:
+        compiled = compile_node(formula)
+
+        # Unknown values are false (as when filtering in the DB)
+        result = lambda given_variables: compiled(given_variables) is True
+        if len(compiled_formulas) >= compiled_formulas_max_size:
+            compiled_formulas.clear()
+        compiled_formulas[key] = result
+
+    return result
+
+
+def get_node_constant(node):
+    """
+    Calculate the constant in a terminal node depending on its type.
+
+    :param node: Terminal node of a formula
+    :return: The constant value (the pair of values for between operators)
+    """
+    if 'between' in node['operator']:
+        # The value is a pair of constants
+        return node['value']
+
+    if node['type'] == 'integer':
+        return int(node['value'])
+    elif node['type'] == 'double':
+        return float(node['value'])
+    elif node['type'] == 'boolean':
+        return node['value'] == '1'
+    elif node['type'] == 'string':
+        return str(node['value'])
+    elif node['type'] == 'datetime':
+        return parse_datetime(node['value'])
+
+    raise Exception('No function to translate type', node['type'])
+
+
+def compile_node(node):
+    """
+    Translate a node representing an expression into a function receiving
+    the dictionary (name, value) of variables and evaluating the expression.
+    The NULL values (None or NaN) are treated as in SQL (see
+    evaluate_node_df): a comparison with a NULL value is unknown (the
+    function returns None), and unknown values propagate through AND, OR
+    and NOT.
+
     :param node: Node representing the expression
-    :param given_variables: Dictionary (name, value) of variables
-    :return: True/False depending on the evaluation
+    :return: Function returning True/False/None depending on the evaluation
     """
     if 'condition' in node:
-        # Node is a condition, get the values of the sub-clauses
-        sub_clauses = [evaluate_node(x, given_variables)
-                       for x in node['rules']]
+        # Node is a condition, compile the sub-clauses
+        sub_clauses = [compile_node(x) for x in node['rules']]
+        if not sub_clauses:
+            # Empty query, every row satisfies it
+            return lambda given_variables: True
 
         # Now combine
         if node['condition'] == 'AND':
-            result = all(sub_clauses)
+            combine = combine_and
         else:
-            result = any(sub_clauses)
+            combine = combine_or
 
         if node.get('not', False):
-            result = not result
+            def evaluate_not(given_variables):
+                result = combine([x(given_variables) for x in sub_clauses])
+                return None if result is None else not result
 
-        return result
+            return evaluate_not
 
-    # Get the variable name
-    varname = node['field']
-    # Get the variable value if running in boolean mode
-    varvalue = None
-    if given_variables is not None:
-        # If calculating a boolean result and no value in the dictionary, finish
-        if varname not in given_variables:
-            raise OntaskException(
-                'No value found for variable {0}'.format(varname),
-                varname
-            )
-
-        varvalue = given_variables.get(varname, None)
+        return lambda given_variables: combine(
+            [x(given_variables) for x in sub_clauses]
+        )
 
-    # Get the operator
+    # Get the variable name, the operator and the constant
+    varname = node['field']
     operator = node['operator']
+    if 'between' in operator:
+        constant = [get_node_constant(dict(node, operator='', value=x))
+                    for x in node['value']]
+    else:
+        constant = get_node_constant(node)
 
-    # If the operator is between or not_between, there is a special case,
-    # the constant cannot be computed because the node['value'] is a pair
-    constant = None
-    if 'between' not in operator:
-        # Calculate the constant value depending on the type
-        if node['type'] == 'integer':
-            constant = int(node['value'])
-        elif node['type'] == 'double':
-            constant = float(node['value'])
-        elif node['type'] == 'boolean':
-            constant = node['value'] == '1'
-        elif node['type'] == 'string':
-            constant = str(node['value'])
-        elif node['type'] == 'datetime':
-            constant = parse_datetime(node['value'])
-        else:
-            raise Exception('No function to translate type', node['type'])
+    operator_function, null_result, types = \
+        operator_functions.get(operator, (None, None, None))
+    if operator_function is None or \
+            (types is not None and node['type'] not in types):
+        raise Exception('Type, operator, field',
+                        node['type'], operator, varname,
+                        'not supported yet.')
 
-    # Terminal Node
-    if operator == 'equal':
-        result = varvalue == constant
+    if node.get('not', False):
+        raise Exception('Negation found in unexpected location')
 
-    elif operator == 'not_equal':
-        result = varvalue != constant
+    def evaluate(given_variables):
+        # Get the variable value if running in boolean mode
+        varvalue = None
+        if given_variables is not None:
+            # If calculating a boolean result and no value in the
+            # dictionary, finish
+            if varname not in given_variables:
+                raise OntaskException(
+                    'No value found for variable {0}'.format(varname),
+                    varname
+                )
 
-    elif operator == 'begins_with' and node['type'] == 'string':
-        result = (varvalue is not None) and varvalue.startswith(constant)
+            varvalue = given_variables[varname]
 
-    elif operator == 'not_begin_with' and node['type'] == 'string':
-        result = not ((varvalue is not None) and varvalue.startswith(constant))
+        if varvalue is None or pd.isnull(varvalue):
+            return null_result
 
-    elif operator == 'contains' and node['type'] == 'string':
-        result = (varvalue is not None) and varvalue.find(constant) != -1
+        return operator_function(varvalue, constant)
 
-    elif operator == 'not_contains' and node['type'] == 'string':
-        result = (varvalue is None) or varvalue.find(constant) == -1
+    return evaluate
 
-    elif operator == 'ends_with' and node['type'] == 'string':
-        result = (varvalue is not None) and varvalue.endswith(constant)
 
-    elif operator == 'not_ends_width' and node['type'] == 'string':
-        result = (varvalue is None) or (not varvalue.endswith(constant))
+def combine_and(values):
+    """
+    :param values: List of True/False/None (unknown)
+    :return: Conjunction of the values with the SQL rules
+    """
+    if any(x is False for x in values):
+        return False
+    if any(x is None for x in values):
+        return None
+    return True
 
-    elif operator == 'is_empty' and node['type'] == 'string':
-        result = varvalue == '' or varvalue == None
 
-    elif operator == 'is_not_empty' and node['type'] == 'string':
-        result = (varvalue is not None) and varvalue != ''
+def combine_or(values):
+    """
+    :param values: List of True/False/None (unknown)
+    :return: Disjunction of the values with the SQL rules
+    """
+    if any(x is True for x in values):
+        return True
+    if any(x is None for x in values):
+        return None
+    return False
 
-    elif operator == 'less' and \
-            (node['type'] == 'integer' or node['type'] == 'double'
-             or node['type'] == 'datetime'):
-        result = varvalue < constant
 
-    elif operator == 'less_or_equal' and \
-            (node['type'] == 'integer' or node['type'] == 'double'
-             or node['type'] == 'datetime'):
-        result = varvalue <= constant
+def evaluate_node(node, given_variables):
+    """
+    Given a node representing a query, and a dictionary with (name, values),
+    evaluates the expression represented by the node. The NULL values are
+    treated as in SQL (see compile_node).
+    :param node: Node representing the expression
+    :param given_variables: Dictionary (name, value) of variables
+    :return: True/False depending on the evaluation
+    """
+    return compile_node(node)(given_variables) is True
 
-    elif operator == 'greater' and \
-            (node['type'] == 'integer' or node['type'] == 'double'
-             or node['type'] == 'datetime'):
-        result = varvalue > constant
 
-    elif operator == 'greater_or_equal' and \
-            (node['type'] == 'integer' or node['type'] == 'double'
-             or node['type'] == 'datetime'):
-        result = varvalue >= constant
+def evaluate_node_df(node, data_frame):
+    """
+    Given a node representing a query and a data frame, evaluates the
+    expression for all the rows at once. The result is the same as filtering
+    the rows in the DB with the expression obtained by evaluate_node_sql,
+    including the treatment of NULL values (a comparison with a NULL value
+    is unknown, and unknown values propagate through AND, OR and NOT as in
+    SQL).
 
-    elif operator == 'between' and \
-            (node['type'] == 'integer' or node['type'] == 'double'
-             or node['type'] == 'datetime'):
-        result = node['value'][0] <= varvalue <= node['value'][1]
+    :param node: Node representing the expression
+    :param data_frame: Data frame with the variables as columns
+    :return: Boolean series (same index as data_frame) with the rows
+    satisfying the expression
+    """
+    is_true, _ = evaluate_node_df_pair(node, data_frame)
+    return is_true
 
-    elif operator == 'not_between' and \
-            (node['type'] == 'integer' or node['type'] == 'double'
-             or node['type'] == 'datetime'):
-        result = not (node['value'][0] <= varvalue <= node['value'][1])
 
+def evaluate_node_df_pair(node, data_frame):
+    """
+    Evaluate the node as in evaluate_node_df, obtaining two boolean series
+    with the rows for which the expression is true and false (rows in
+    neither of them have an unknown value).
+
+    :param node: Node representing the expression
+    :param data_frame: Data frame with the variables as columns
+    :return: Pair of boolean series (is_true, is_false)
+    """
+    if 'condition' in node:
+        # Node is a condition, get the values of the sub-clauses
+        sub_pairs = [evaluate_node_df_pair(x, data_frame)
+                     for x in node['rules']]
+
+        if not sub_pairs:
+            # Empty query, every row satisfies it
+            is_true = pd.Series(True, index=data_frame.index)
+            return is_true, ~is_true
+
+        # Now combine
+        is_true, is_false = sub_pairs[0]
+        for sub_true, sub_false in sub_pairs[1:]:
+            if node['condition'] == 'AND':
+                is_true = is_true & sub_true
+                is_false = is_false | sub_false
+            else:
+                is_true = is_true | sub_true
+                is_false = is_false & sub_false
+
+        if node.get('not', False):
+            return is_false, is_true
+
+        return is_true, is_false
+
+    # Get the variable name
+    varname = node['field']
+    if varname not in data_frame.columns:
+        raise OntaskException(
+            'No value found for variable {0}'.format(varname),
+            varname
+        )
+    column = data_frame[varname]
+    not_null = column.notnull()
+
+    # Get the operator and the constant
+    operator = node['operator']
+    node_type = node['type']
+    if 'between' in operator:
+        constant = [get_node_constant(dict(node, operator='', value=x))
+                    for x in node['value']]
     else:
-        raise Exception('Type, operator, field',
-                        node['type'], operator, varname,
-                        'not supported yet.')
+        constant = get_node_constant(node)
 
-    if node.get('not', False):
-        raise Exception('Negation found in unexpected location')
+    # Terminal Node. Operators that include the NULL values in their
+    # result (never unknown)
+    if operator == 'equal':
+        is_true = not_null & (column == constant)
+        return is_true, ~is_true
 
-    return result
+    elif operator == 'not_equal':
+        is_true = ~not_null | (column != constant)
+        return is_true, ~is_true
+
+    elif operator == 'is_empty' and node_type == 'string':
+        is_true = ~not_null | (column == '')
+        return is_true, ~is_true
+
+    elif operator == 'is_not_empty' and node_type == 'string':
+        is_true = not_null & (column != '')
+        return is_true, ~is_true
+
+    # String operators (the NULL values are in the negated versions)
+    if node_type == 'string' and operator in string_operators:
+        method, negated = string_operators[operator]
+        if column.dtype == object:
+            matches = method(column.str, constant)
+            matches = not_null & matches.fillna(False).astype(bool)
+        else:
+            # No strings in the column (only NULL values)
+            matches = pd.Series(False, index=data_frame.index)
+        if negated:
+            return ~matches, matches
+        return matches, ~matches
+
+    # Comparison operators (unknown with NULL values)
+    if node_type in comparison_types and operator in comparison_operators:
+        is_true = not_null & comparison_operators[operator](column, constant)
+        return is_true, not_null & ~is_true
+
+    raise Exception('Type, operator, field',
+                    node_type, operator, varname,
+                    'not supported yet.')
 
 
 def evaluate_node_sql(node):
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0023_workflow_data_version'),
+        ('dataops', '0021_auto_20180530_1316'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRecount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('column_names', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=None, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('workflow', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_recount', to='workflow.Workflow')),
+            ],
+            options={
+                'ordering': ('created',),
+            },
+        ),
+    ]
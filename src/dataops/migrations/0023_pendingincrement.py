@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0023_workflow_data_version'),
+        ('dataops', '0022_pendingrecount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingIncrement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('column_name', models.CharField(max_length=512)),
+                ('key_name', models.CharField(max_length=512)),
+                ('key_value', models.CharField(max_length=2048)),
+                ('workflow', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='pending_increments', to='workflow.Workflow')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataops', '0023_pendingincrement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingincrement',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pendingincrement',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+from django.contrib.postgres.fields import JSONField
 from django.db import models
 
 
@@ -140,3 +141,73 @@ class SQLConnection(models.Model):
         Define the criteria for ordering
         """
         ordering = ('name',)
+
+
+class PendingRecount(models.Model):
+    """
+    @DynamicAttrs
+
+    Recount of the conditions of a workflow (field n_rows_selected) waiting
+    to be executed by the background worker. There is at most one per
+    workflow, so all the requests received before the worker runs are
+    coalesced into a single recount (see dataops.ops.enqueue_n_rows_selected)
+    """
+
+    workflow = models.OneToOneField(
+        'workflow.Workflow',
+        db_index=True,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name='pending_recount')
+
+    # Columns that have changed (None when all conditions need a recount)
+    column_names = JSONField(default=None, blank=True, null=True)
+
+    created = models.DateTimeField(auto_now_add=True, null=False, blank=False)
+
+    def __str__(self):
+        return str(self.workflow_id)
+
+    class Meta:
+        """
+        Oldest requests are processed first
+        """
+        ordering = ('created',)
+
+
+class PendingIncrement(models.Model):
+    """
+    @DynamicAttrs
+
+    Increment of an integer column (e.g. email read tracking) in the row of
+    a workflow table with the given key value, waiting to be applied by the
+    background worker. All the increments stored before the worker runs are
+    applied with one statement per column (see
+    dataops.ops.process_pending_increments)
+    """
+
+    workflow = models.ForeignKey(
+        'workflow.Workflow',
+        db_index=False,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name='pending_increments')
+
+    # Column to increase
+    column_name = models.CharField(max_length=512, null=False, blank=False)
+
+    # Column and value to select the row
+    key_name = models.CharField(max_length=512, null=False, blank=False)
+
+    key_value = models.CharField(max_length=2048, null=False, blank=False)
+
+    # Number of times that the increment could not be applied, and last
+    # error (the increment stays in the queue)
+    attempts = models.IntegerField(default=0, null=False, blank=False)
+
+    error = models.TextField(default='', null=False, blank=True)
+
+    class Meta:
+        ordering = ('id',)
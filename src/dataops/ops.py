@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import logging
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
 
 from action.models import Condition, Action
 from dataops import formula_evaluation
@@ -12,13 +17,26 @@ from dataops.pandas_db import (
     create_upload_table_name,
     store_table,
     df_column_types_rename,
+    df_rename_column,
     load_table,
-    get_table_data,
+    get_table_cursor,
     is_table_in_db,
     get_table_queryset,
+    increase_data_version,
+    increase_row_integer,
+    add_email_reads,
+    get_virtual_column_names,
+    get_df_cache,
+    num_rows_by_formulas,
     pandas_datatype_names)
 from table.models import View
 from workflow.models import Workflow, Column
+from .models import PendingIncrement, PendingRecount
+
+logger = logging.getLogger(__name__)
+
+# Key to cache the column dependencies of a workflow
+column_dependencies_prefix = '__ONTASK_COLUMN_DEPENDENCIES_{0}'
 
 
 def is_unique_column(df_column):
@@ -108,15 +126,18 @@ def store_table_in_db(data_frame, pk, table_name, temporary=False):
         )
         column.save()
 
-    # Get now the new set of columns with names
-    wf_columns = Column.objects.filter(
-        workflow__id=pk)
+    # Get now the new set of columns with names (the values of the virtual
+    # columns are not stored in the table)
+    virtual_names = get_virtual_column_names(pk)
+    wf_columns = [x for x in Column.objects.filter(workflow__id=pk)
+                  if x.name not in virtual_names]
 
     # Reorder the columns in the data frame
     data_frame = data_frame[[x.name for x in wf_columns]]
 
     # Store the table in the DB
     store_table(data_frame, table_name)
+    increase_data_version(pk)
 
     # Review the column types because some "objects" are stored as booleans
     # TODO: Review this process to optimise
@@ -130,7 +151,7 @@ def store_table_in_db(data_frame, pk, table_name, temporary=False):
 
     # Update workflow fields and save
     workflow.nrows = data_frame.shape[0]
-    workflow.ncols = data_frame.shape[1]
+    workflow.ncols = data_frame.shape[1] + len(virtual_names)
     workflow.set_query_builder_ops()
     workflow.data_frame_table_name = table_name
     workflow.save()
@@ -170,25 +191,27 @@ def store_upload_dataframe_in_db(data_frame, pk):
                              True)
 
 
-def get_table_row_by_index(workflow, cond_filter, idx):
+def get_table_row_by_index(workflow, cond_filter, idx, column_names=None):
     """
     Select the set of elements in the row with the given index
 
     :param workflow: Workflow object storing the data
     :param cond_filter: Condition object to filter the data (or None)
     :param idx: Row number to get (first row is idx = 1)
+    :param column_names: Optional list of column names to select
     :return: A dictionary with the (column_name, value) data or None if the
      index is out of bounds
     """
 
     # Get the data
-    data = get_table_data(workflow.id, cond_filter)
+    cursor = get_table_cursor(workflow.id, cond_filter, column_names)
+    data = cursor.fetchall()
 
     # If the data is not there, return None
     if idx > len(data):
         return None
 
-    return dict(zip(workflow.get_column_names(), data[idx - 1]))
+    return dict(zip([c.name for c in cursor.description], data[idx - 1]))
 
 
 def workflow_has_table(workflow_item):
@@ -475,13 +498,348 @@ def perform_dataframe_upload_merge(pk, dst_df, src_df, merge_info):
     store_dataframe_in_db(new_df, pk)
 
     # Recompute all the values of the conditions in each of the actions
-    for action in Workflow.objects.get(pk=pk).actions.all():
-        action.update_n_rows_selected()
+    workflow_update_n_rows_selected(pk)
 
     # Operation was correct, no need to flag anything
     return None
 
 
+def get_column_dependencies(workflow_id):
+    """
+    Obtain the map from the column names in a workflow to the conditions,
+    filters and views whose formulas use them (see
+    formula_evaluation.get_variables). The map is kept in the cache used for
+    the data frames and it is discarded whenever a condition or a view is
+    modified (see dataops.signals).
+
+    :param workflow_id: Primary key of the workflow
+    :return: Dictionary column name -> {'conditions': [condition ids],
+    'filters': [condition ids], 'views': [view ids]}
+    """
+    cache = get_df_cache()
+    cache_key = column_dependencies_prefix.format(workflow_id)
+    result = None
+    if cache is not None:
+        try:
+            result = cache.get(cache_key)
+        except Exception:
+            result = None
+
+    if result is not None:
+        return result
+
+    result = {}
+    items = [('filters' if x['is_filter'] else 'conditions', x['id'],
+              x['formula'])
+             for x in Condition.objects.filter(
+                 action__workflow__id=workflow_id
+             ).values('id', 'is_filter', 'formula')]
+    items.extend([('views', x['id'], x['formula'])
+                  for x in View.objects.filter(
+                      workflow__id=workflow_id
+                  ).values('id', 'formula')])
+    for kind, item_id, formula in items:
+        if not formula:
+            continue
+
+        for name in set(formula_evaluation.get_variables(formula)):
+            result.setdefault(
+                name,
+                {'conditions': [], 'filters': [], 'views': []}
+            )[kind].append(item_id)
+
+    if cache is not None:
+        try:
+            cache.set(cache_key,
+                      result,
+                      getattr(settings, 'DATAOPS_DF_CACHE_TIMEOUT', None))
+        except Exception:
+            pass
+
+    return result
+
+
+def invalidate_column_dependencies(workflow_id):
+    """
+    Discard the map of column dependencies of the workflow
+
+    :param workflow_id: Primary key of the workflow
+    :return: Nothing
+    """
+    cache = get_df_cache()
+    if cache is None:
+        return
+
+    try:
+        cache.delete(column_dependencies_prefix.format(workflow_id))
+    except Exception:
+        pass
+
+
+def workflow_update_n_rows_selected(workflow_id, column_names=None):
+    """
+    Recalculate the field n_rows_selected in the conditions of all the
+    actions in a workflow. The numbers are obtained with a single query (the
+    filter of the action is added to each of its conditions) and stored with
+    a single update.
+
+    :param workflow_id: Primary key of the workflow
+    :param column_names: Optional list of column names to process only those
+    conditions that use these columns (or whose filter uses them)
+    :return: All appropriate conditions are updated
+    """
+
+    conditions = Condition.objects.filter(action__workflow__id=workflow_id)
+    affected_ids = None
+    affected_filter_ids = None
+    if column_names is not None:
+        # Use the dependencies to find the affected conditions and filters
+        dependencies = get_column_dependencies(workflow_id)
+        affected_ids = set([])
+        affected_filter_ids = set([])
+        for column_name in column_names:
+            column_deps = dependencies.get(column_name)
+            if column_deps:
+                affected_ids.update(column_deps['conditions'])
+                affected_filter_ids.update(column_deps['filters'])
+
+        if not affected_ids and not affected_filter_ids:
+            # No condition uses these columns. Nothing to do
+            return
+
+        # Fetch only the conditions of the affected actions
+        conditions = conditions.filter(
+            action__conditions__id__in=affected_ids | affected_filter_ids
+        ).distinct()
+
+    conditions = conditions.values('id', 'action_id', 'is_filter', 'formula')
+    filters = dict([(x['action_id'], (x['id'], x['formula']))
+                    for x in conditions if x['is_filter']])
+
+    # Select the conditions (with the formulas to combine) to recalculate
+    selected = []
+    for condition in conditions:
+        formulas = [condition['formula']]
+        filter_id = None
+        if not condition['is_filter'] and condition['action_id'] in filters:
+            filter_id, filter_formula = filters[condition['action_id']]
+            formulas.insert(0, filter_formula)
+
+        if affected_ids is not None \
+                and condition['id'] not in affected_ids \
+                and condition['id'] not in affected_filter_ids \
+                and filter_id not in affected_filter_ids:
+            # The columns are not used. Nothing to do
+            continue
+
+        selected.append((condition['id'], formulas))
+
+    if not selected:
+        return
+
+    counts = num_rows_by_formulas(workflow_id, [x for _, x in selected])
+
+    # Update all the conditions at once
+    Condition.objects.filter(
+        pk__in=[x for x, _ in selected]
+    ).update(
+        n_rows_selected=Case(
+            *[When(pk=cond_id, then=Value(count))
+              for (cond_id, _), count in zip(selected, counts)],
+            output_field=IntegerField()
+        )
+    )
+
+
+def enqueue_n_rows_selected(workflow_id, column_names=None):
+    """
+    Request the recount of the conditions in a workflow (see
+    workflow_update_n_rows_selected). If DATAOPS_DEFERRED_RECOUNT is true,
+    the request is stored and executed later by the background worker
+    (see process_pending_recounts). All the requests for a workflow received
+    before the worker runs are coalesced into one. Otherwise, the recount is
+    executed immediately.
+
+    :param workflow_id: Primary key of the workflow
+    :param column_names: Optional list of column names that changed (None
+    to recount all the conditions)
+    :return: Nothing
+    """
+    if not getattr(settings, 'DATAOPS_DEFERRED_RECOUNT', False):
+        workflow_update_n_rows_selected(workflow_id, column_names)
+        return
+
+    with transaction.atomic():
+        pending, created = \
+            PendingRecount.objects.select_for_update().get_or_create(
+                workflow_id=workflow_id,
+                defaults={'column_names': column_names}
+            )
+        if created or pending.column_names is None:
+            # New request or all the conditions are already included
+            return
+
+        # Merge the columns with those in the pending request
+        if column_names is None:
+            pending.column_names = None
+        else:
+            pending.column_names = sorted(
+                set(pending.column_names) | set(column_names)
+            )
+        pending.save()
+
+
+def process_pending_recounts():
+    """
+    Execute the pending recounts (oldest first). Each request is removed
+    before executing it, so the requests received in the meantime produce a
+    new one. Several workers may run concurrently.
+
+    :return: Number of recounts executed
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            pending = PendingRecount.objects.select_for_update(
+                skip_locked=True
+            ).first()
+            if pending is None:
+                break
+
+            workflow_id = pending.workflow_id
+            column_names = pending.column_names
+            pending.delete()
+
+        try:
+            workflow_update_n_rows_selected(workflow_id, column_names)
+        except Exception as e:
+            logger.error(
+                'Error while recounting workflow {0}: {1}'.format(workflow_id,
+                                                                  e)
+            )
+        processed += 1
+
+    return processed
+
+
+def increase_column(workflow_id, column_name, key_name, increments):
+    """
+    Increase the values of an integer column in the rows selected by the
+    values of another one. If the column is virtual (email read tracking),
+    the reads are recorded instead.
+
+    :param workflow_id: Primary key of the workflow
+    :param column_name: Integer column to increase
+    :param key_name: Column to select the rows
+    :param increments: List of pairs (key_name value, amount)
+    :return: Nothing
+    """
+    if column_name in get_virtual_column_names(workflow_id):
+        add_email_reads(workflow_id, column_name, increments)
+        return
+
+    increase_row_integer(workflow_id, column_name, key_name, increments)
+
+
+def enqueue_increment(workflow_id, column_name, key_name, key_value):
+    """
+    Increase by one the integer column in the row with the given key value
+    (e.g. email read tracking) and recount the conditions that depend on
+    the column. If DATAOPS_DEFERRED_INCREMENT is true, the request is only
+    stored (a single INSERT) and applied later in bulk by the background
+    worker (see process_pending_increments).
+
+    :param workflow_id: Primary key of the workflow
+    :param column_name: Integer column to increase
+    :param key_name: Column to select the row
+    :param key_value: Value to select the row
+    :return: Nothing
+    """
+    if getattr(settings, 'DATAOPS_DEFERRED_INCREMENT', False):
+        PendingIncrement.objects.create(workflow_id=workflow_id,
+                                        column_name=column_name,
+                                        key_name=key_name,
+                                        key_value=key_value)
+        return
+
+    increase_column(workflow_id, column_name, key_name, [(key_value, 1)])
+    enqueue_n_rows_selected(workflow_id, [column_name])
+
+
+def process_pending_increments(batch_size=5000):
+    """
+    Apply the pending increments. They are taken in batches, aggregated by
+    workflow and column, and applied with one statement each (see
+    pandas_db.increase_row_integer). Several workers may run concurrently.
+    The increments of a group that cannot be applied stay in the queue with
+    their attempts and error recorded, and they are no longer tried (but
+    kept for inspection) after DATAOPS_INCREMENT_MAX_ATTEMPTS failures. Each
+    increment is tried at most once per invocation.
+
+    :param batch_size: Maximum number of increments taken at once
+    :return: Number of increments applied
+    """
+    max_attempts = getattr(settings, 'DATAOPS_INCREMENT_MAX_ATTEMPTS', 5)
+    processed = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            pending = list(PendingIncrement.objects.select_for_update(
+                skip_locked=True
+            ).filter(
+                id__gt=last_id,
+                attempts__lt=max_attempts
+            ).values_list('id',
+                          'workflow_id',
+                          'column_name',
+                          'key_name',
+                          'key_value')[:batch_size])
+            if not pending:
+                break
+            last_id = pending[-1][0]
+
+            # Group the increments by workflow, column and key column
+            groups = OrderedDict()
+            for item_id, workflow_id, column_name, key_name, key_value \
+                    in pending:
+                groups.setdefault(
+                    (workflow_id, column_name, key_name), []
+                ).append((item_id, key_value))
+
+            applied = []
+            for (workflow_id, column_name, key_name), items \
+                    in list(groups.items()):
+                item_ids = [x for x, __ in items]
+                try:
+                    with transaction.atomic():
+                        increase_column(workflow_id,
+                                        column_name,
+                                        key_name,
+                                        [(x, 1) for __, x in items])
+                except Exception as e:
+                    logger.error(
+                        'Error while increasing {0} in workflow {1}: '
+                        '{2}'.format(column_name, workflow_id, e)
+                    )
+                    PendingIncrement.objects.filter(id__in=item_ids).update(
+                        attempts=F('attempts') + 1,
+                        error=str(e)
+                    )
+                    del groups[(workflow_id, column_name, key_name)]
+                    continue
+
+                applied.extend(item_ids)
+
+            PendingIncrement.objects.filter(id__in=applied).delete()
+
+        # Recount the conditions using the modified columns
+        for workflow_id, column_name, __ in groups.keys():
+            enqueue_n_rows_selected(workflow_id, [column_name])
+        processed += len(applied)
+
+    return processed
+
+
 def data_frame_add_column(df, column, initial_value):
     """
 
@@ -521,17 +879,20 @@ def data_frame_add_column(df, column, initial_value):
     return df
 
 
-def rename_df_column(df, workflow, old_name, new_name):
+def rename_column(workflow, old_name, new_name):
     """
-    Function to change the name of a column in the dataframe.
+    Function to change the name of a column in the workflow table and in all
+    the conditions, actions and views that refer to it.
 
-    :param df: dataframe
     :param workflow: workflow object that is handling the data frame
     :param old_name: old column name
     :param new_name: new column name
-    :return: Workflow object updated
+    :return: Nothing. The changes are reflected in the DB
     """
 
+    # Rename the column in the table
+    df_rename_column(workflow.id, old_name, new_name)
+
     # Rename the appearances of the variable in all conditions/filters
     conditions = Condition.objects.filter(action__workflow=workflow)
     for cond in conditions:
@@ -552,8 +913,6 @@ def rename_df_column(df, workflow, old_name, new_name):
         )
         view.save()
 
-    return df.rename(columns={old_name: new_name})
-
 
 def detect_datetime_columns(data_frame):
     """
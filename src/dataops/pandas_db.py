@@ -1,19 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import hashlib
+import json
 import logging
 import os.path
 import subprocess
+import uuid
 from collections import OrderedDict
+from io import BytesIO
 from itertools import izip
 
 import numpy as np
 import pandas as pd
 from django.conf import settings
+from django.apps import apps
+from django.core.cache import caches
 from django.db import connection
+from django.db.models import F
 from sqlalchemy import create_engine
 
-from dataops.formula_evaluation import evaluate_node_sql
+from dataops.formula_evaluation import evaluate_node_sql, get_variables
 from ontask import fix_pctg_in_name
 
 SITE_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -21,6 +28,7 @@ SITE_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 table_prefix = '__ONTASK_WORKFLOW_TABLE_'
 df_table_prefix = table_prefix + '{0}'
 upload_table_prefix = table_prefix + 'UPLOAD_{0}'
+staging_table_suffix = '_STAGING_{0}'
 
 # Query to count the number of rows in a table
 query_count_rows = 'SELECT count(*) from "{0}"'
@@ -45,9 +53,40 @@ sql_datatype_names = {
     'timestamp without time zone': 'datetime'
 }
 
+# Translation between data types handled in OnTask and SQL data types
+ontask_sql_types = dict([(y, x) for x, y in sql_datatype_names.items()])
+
+# Translation between the types detected in a data frame column and the SQL
+# types used to create the table (same criteria as DataFrame.to_sql)
+sql_column_types = {
+    'integer': 'bigint',
+    'floating': 'double precision',
+    'boolean': 'boolean',
+    'datetime': 'timestamp without time zone',
+    'datetime64': 'timestamp without time zone',
+    'date': 'date',
+}
+
+# Marker used to transfer NULL values (NaN, NaT, None) with COPY
+copy_null_marker = '\\N'
+
+# Number of rows of the data frame sent to the DB in each COPY operation
+copy_chunk_size = 10000
+
+# Number of rows fetched from the DB in each step when streaming a table
+stream_chunk_size = 5000
+
 # DB Engine to use with Pandas (required by to_sql, from_sql
 engine = None
 
+# Column (and suffix of the index) storing the text of all the columns in
+# the row when the table has a search index (see create_search_index)
+search_column_name = '__ONTASK_SEARCH_TEXT'
+search_index_suffix = '_SEARCH'
+
+# Prefix for the keys used to cache the data frames
+df_cache_prefix = '__ONTASK_DF_CACHE_{0}_{1}'
+
 
 def create_db_connection(dialect, driver, username, password, host, dbname):
     """
@@ -184,45 +223,303 @@ def create_upload_table_name(pk):
     return upload_table_prefix.format(pk)
 
 
-def load_from_db(pk):
+def get_workflow_column_names(pk):
+    """
+    The physical order of the columns in the table storing the data frame
+    is irrelevant. The order is given by the position field in the columns
+    and all the queries select the columns explicitly in that order.
+
+    :param pk: Primary key of a workflow
+    :return: List of column names in the order given by their position
+    """
+    return list(apps.get_model('workflow', 'Column').objects.filter(
+        workflow__id=pk
+    ).order_by('position').values_list('name', flat=True))
+
+
+def get_workflow_key_name(pk):
+    """
+    :param pk: Primary key of a workflow
+    :return: Name of the first key column (by position) or None
+    """
+    return apps.get_model('workflow', 'Column').objects.filter(
+        workflow__id=pk,
+        is_key=True
+    ).order_by('position').values_list('name', flat=True).first()
+
+
+def get_select_clause(pk, column_names=None):
+    """
+    Create the SELECT clause with an explicit list of columns (in the order
+    given) or all the columns of the workflow in position order.
+
+    :param pk: Primary key of a workflow
+    :param column_names: Optional list of columns to select
+    :return: String with the SELECT clause (without the FROM)
+    """
+    if not column_names:
+        column_names = get_workflow_column_names(pk)
+
+    if not column_names:
+        # No column information (table not attached to a workflow)
+        return 'SELECT *'
+
+    return 'SELECT ' + ', '.join(['"{0}"'.format(fix_pctg_in_name(x))
+                                  for x in column_names])
+
+
+def get_virtual_columns(pk, column_names=None, formulas=None):
+    """
+    Virtual columns of a workflow used by a query. Their values are not
+    stored in the table of the workflow, they are the number of times each
+    recipient read the email of a tracked send (see action.models.EmailTrack)
+    and are joined from the (narrow) table of reads only when referenced.
+
+    :param pk: Primary key of a workflow
+    :param column_names: Columns used by the query (None for all of them)
+    :param formulas: Optional list of formulas used by the query
+    :return: List of tuples (column name, track id, key column name)
+    """
+    result = list(apps.get_model('action', 'EmailTrack').objects.filter(
+        column__workflow__id=pk
+    ).order_by('column__position').values_list('column__name',
+                                               'id',
+                                               'key_name'))
+    if not result or column_names is None:
+        return result
+
+    used = set(column_names)
+    for formula in formulas or []:
+        if formula:
+            used.update(get_variables(formula))
+
+    return [x for x in result if x[0] in used]
+
+
+def get_virtual_column_names(pk):
     """
-    Load the data frame stored for the workflow with the pk
+    :param pk: Primary key of a workflow
+    :return: Set with the names of the virtual columns (see
+    get_virtual_columns)
+    """
+    return set([x for x, _, _ in get_virtual_columns(pk)])
+
+
+def get_table_source(pk, column_names=None, formulas=None):
+    """
+    Create the text to use in the FROM clause of a query over the table of
+    a workflow. If the query references virtual columns, the table is
+    replaced by a derived table (with the same name) joining their values.
+
+    :param pk: Primary key of a workflow
+    :param column_names: Columns used by the query (None for all of them)
+    :param formulas: Optional list of formulas used by the query
+    :return: String to use after FROM
+    """
+    table_name = create_table_name(pk)
+    virtual_columns = get_virtual_columns(pk, column_names, formulas)
+    if not virtual_columns:
+        return '"{0}"'.format(table_name)
+
+    reads_table = apps.get_model('action', 'EmailRead')._meta.db_table
+    columns = ['"{0}".*'.format(table_name)]
+    joins = []
+    for idx, (name, track_id, key_name) in enumerate(virtual_columns):
+        alias = 'ONTASK_READS_{0}'.format(idx)
+        columns.append('COALESCE("{0}"."count", 0) AS "{1}"'.format(
+            alias,
+            fix_pctg_in_name(name)))
+        joins.append(
+            ' LEFT JOIN "{0}" AS "{1}" ON "{1}"."track_id" = {2}'
+            ' AND "{1}"."recipient" = CAST("{3}"."{4}" AS TEXT)'.format(
+                reads_table,
+                alias,
+                int(track_id),
+                table_name,
+                fix_pctg_in_name(key_name)))
+
+    return '(SELECT {0} FROM "{1}"{2}) AS "{1}"'.format(', '.join(columns),
+                                                       table_name,
+                                                       ''.join(joins))
+
+
+def load_from_db(pk, column_names=None, filter_formula=None):
+    """
+    Load the data frame stored for the workflow with the pk. The columns
+    are returned in the order given by their position.
     :param pk:
+    :param column_names: Optional list of columns to load
+    :param filter_formula: Optional formula to filter the rows
     :return: data frame
     """
-    return load_table(create_table_name(pk))
+    if column_names:
+        wf_column_names = get_workflow_column_names(pk)
+        column_names = [x for x in wf_column_names if x in column_names] + \
+                       [x for x in column_names if x not in wf_column_names]
+
+    source = get_table_source(pk,
+                              column_names or None,
+                              [filter_formula] if filter_formula else None)
+    if source != '"{0}"'.format(create_table_name(pk)):
+        # Virtual columns are joined, so they must be selected explicitly
+        return load_table(create_table_name(pk),
+                          column_names or get_workflow_column_names(pk),
+                          filter_formula,
+                          source,
+                          get_data_version(pk))
+
+    result = load_table(create_table_name(pk),
+                        column_names,
+                        filter_formula,
+                        version=get_data_version(pk))
+    if result is None or column_names:
+        return result
+
+    # Return the columns in the order given by their position (the layout
+    # of the table may be different)
+    wf_column_names = [x for x in get_workflow_column_names(pk)
+                       if x in result.columns]
+    return result[wf_column_names + [x for x in result.columns
+                                     if x not in wf_column_names]]
+
+
+def get_df_cache():
+    """
+    Get the cache used to store the data frames. The setting
+    DATAOPS_DF_CACHE contains the alias of one of the caches defined in
+    CACHES (the django_redis cache, or a local memory cache when running
+    without Redis). If the setting is empty, no cache is used.
+
+    :return: Cache object or None
+    """
+    cache_alias = getattr(settings, 'DATAOPS_DF_CACHE', None)
+    if not cache_alias:
+        return None
+
+    return caches[cache_alias]
+
+
+def get_data_version(pk):
+    """
+    Get the data version of the workflow with the given pk (see
+    increase_data_version) to use it in the key of the cached data frames.
 
+    :param pk: Primary key of the workflow
+    :return: Version number or None if the workflow does not exist
+    """
+    # The model is obtained through the registry to avoid a circular import
+    return apps.get_model('workflow', 'Workflow').objects.filter(
+        pk=pk
+    ).values_list('data_version', flat=True).first()
+
+
+def increase_data_version(pk):
+    """
+    Atomically increase the data version of the workflow with the given pk.
+    It must be invoked by every operation that modifies the content of the
+    workflow table, as it discards the cached copies of the table (see
+    load_table).
 
-def load_table(table_name):
+    :param pk: Primary key of the workflow
+    :return: Nothing. The counter is increased in the DB
     """
-    Load a data frame from the SQL DB.
+    # The model is obtained through the registry to avoid a circular import
+    apps.get_model('workflow', 'Workflow').objects.filter(pk=pk).update(
+        data_version=F('data_version') + 1
+    )
+
 
-    FUTURE WORK:
-    Consider to store the dataframes in Redis to reduce load/store time.
-    The trick is to use a compressed format:
+def load_table(table_name, column_names=None, filter_formula=None,
+               source=None, version=None):
+    """
+    Load a data frame from the SQL DB. If a list of columns and/or a
+    formula are given, the selection is done in the query, so only the
+    required columns/rows are transferred.
 
-    SET: redisConn.set("key", df.to_msgpack(compress='zlib'))
-    GET: pd.read_msgpack(redisConn.get("key"))
+    If a version is given, the data frames are cached using a compressed
+    format:
 
-    Need to agree on a sensible item name that does not collide with anything
-    else and a policy to detect a cached dataframe and remove it when the data
-    changes (difficult to detect? Perhaps df_new.equals(df_current))
+    SET: cache.set(key, df.to_msgpack(compress='zlib'))
+    GET: pd.read_msgpack(cache.get(key))
 
-    If feasible, a write-through system could be easily implemented.
+    The key contains the table name, the version (the data version of the
+    workflow, increased every time the table is modified, see
+    increase_data_version) and, if given, a hash of the column list and the
+    filter. The cache is not used within a transaction, as its changes (and
+    the version) may still be rolled back.
 
     :param table_name: Table name to read from the db in to data frame
+    :param column_names: Optional list of columns to load
+    :param filter_formula: Optional formula (as produced by QueryBuilder)
+    to select the rows
+    :param source: Optional text for the FROM clause instead of the table
+    (see get_table_source). Requires column_names.
+    :param version: Optional version of the data in the table
     :return: data_frame or None if it does not exist.
     """
+    if get_df_cache() is None or connection.in_atomic_block:
+        version = None
+
+    cache_key = df_cache_prefix.format(table_name, version)
+    if column_names or filter_formula:
+        cache_key += '_' + hashlib.md5(
+            json.dumps([column_names, filter_formula],
+                       sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    if version is not None:
+        try:
+            cached_df = get_df_cache().get(cache_key)
+        except Exception:
+            cached_df = None
+
+        if cached_df is not None:
+            return pd.read_msgpack(cached_df)
+
     if table_name not in connection.introspection.table_names():
         return None
 
     if settings.DEBUG:
         print('Loading table ', table_name)
 
-    result = pd.read_sql(table_name, engine)
+    if column_names or filter_formula:
+        # Build the query with the column projection and the filter
+        if column_names:
+            query = 'SELECT {0}'.format(
+                ', '.join(['"{0}"'.format(fix_pctg_in_name(x))
+                           for x in column_names])
+            )
+        else:
+            query = 'SELECT *'
+        query += ' FROM ' + (source or '"{0}"'.format(table_name))
+
+        fields = []
+        if filter_formula:
+            filter_txt, fields = evaluate_node_sql(filter_formula)
+            if filter_txt:
+                query += ' WHERE ' + filter_txt
+
+        result = pd.read_sql_query(query, engine, params=fields)
+    else:
+        result = pd.read_sql(table_name, engine)
+        if search_column_name in result.columns:
+            # The text used by the search index is not part of the data
+            result.drop(search_column_name, axis=1, inplace=True)
 
     # After reading from the DB, turn all None into NaN
     result.fillna(value=np.nan, inplace=True)
+
+    if version is not None:
+        try:
+            get_df_cache().set(
+                cache_key,
+                result.to_msgpack(compress='zlib'),
+                getattr(settings, 'DATAOPS_DF_CACHE_TIMEOUT', None))
+        except Exception:
+            logger.error('Unable to store table {0} in cache'.format(
+                table_name
+            ))
+
     return result
 
 
@@ -292,19 +589,165 @@ def load_df_from_sqlconnection(conn_item, pwd=None):
     return result
 
 
+def get_df_sql_types(data_frame):
+    """
+    Given a data frame, obtain the SQL types to use to create the table
+    storing its columns. The type is taken from the dtype of the column,
+    except for the columns of type object, which are inspected ignoring the
+    null values, so that columns with booleans (or datetimes) and NaN are
+    stored with the appropriate type.
+
+    :param data_frame: Data frame to inspect
+    :return: List of SQL type names (one per column)
+    """
+    result = []
+    for cname in data_frame.columns:
+        column = data_frame[cname]
+        if pd.api.types.is_datetime64tz_dtype(column):
+            result.append('timestamp with time zone')
+        elif pd.api.types.is_datetime64_dtype(column):
+            result.append(sql_column_types['datetime64'])
+        elif pd.api.types.is_bool_dtype(column):
+            result.append(sql_column_types['boolean'])
+        elif pd.api.types.is_integer_dtype(column):
+            result.append(sql_column_types['integer'])
+        elif pd.api.types.is_float_dtype(column):
+            result.append(sql_column_types['floating'])
+        else:
+            col_type = pd.api.types.infer_dtype(column.dropna())
+            result.append(sql_column_types.get(col_type, 'text'))
+
+    return result
+
+
+def store_table_copy(data_frame, table_name):
+    """
+    Store a data frame in the DB (PostgreSQL) creating the table with
+    explicit types and transferring the rows through COPY FROM STDIN in
+    chunks of copy_chunk_size rows. NaN and NaT values are transferred as
+    NULL. The table must not exist.
+
+    :param data_frame: The data frame to store
+    :param table_name: The name of the table in the DB
+    :return: Nothing. Side effect in the DB
+    """
+    column_list = ', '.join(['"{0}"'.format(x) for x in data_frame.columns])
+    query_create = 'CREATE TABLE "{0}" ({1})'.format(
+        table_name,
+        ', '.join(['"{0}" {1}'.format(cname, ctype)
+                   for cname, ctype in zip(data_frame.columns,
+                                           get_df_sql_types(data_frame))])
+    )
+    query_copy = \
+        "COPY \"{0}\" ({1}) FROM STDIN WITH (FORMAT csv, NULL '{2}')".format(
+            table_name,
+            column_list,
+            copy_null_marker
+        )
+
+    # Use the engine (as in to_sql) so that the table is visible to the
+    # readers as soon as the operation commits.
+    db_connection = engine.raw_connection()
+    try:
+        cursor = db_connection.cursor()
+        cursor.execute(query_create)
+        for idx in range(0, data_frame.shape[0], copy_chunk_size):
+            if data_frame.shape[1] == 0:
+                # Nothing to transfer
+                break
+
+            chunk = data_frame.iloc[idx:idx + copy_chunk_size].to_csv(
+                None,
+                header=False,
+                index=False,
+                na_rep=copy_null_marker,
+                encoding='utf-8'
+            )
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode('utf-8')
+            cursor.copy_expert(query_copy, BytesIO(chunk))
+        db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
+    finally:
+        db_connection.close()
+
+
+def create_staging_table_name(table_name):
+    """
+
+    :param table_name: Table that is going to be rewritten
+    :return: A unique name for the table used to prepare the new content
+    """
+    return table_name + staging_table_suffix.format(uuid.uuid4().hex[:8])
+
+
+def swap_table(staging_table_name, table_name):
+    """
+    Replace a table by the staging table with its new content. The drop
+    and rename are executed in a single short transaction, so concurrent
+    readers either see the old or the new data (never a missing table),
+    and the time the locks are held does not depend on the table size.
+
+    :param staging_table_name: Table with the new content
+    :param table_name: Table to replace
+    :return: Nothing. Side effect in the DB
+    """
+    with engine.begin() as db_connection:
+        db_connection.execute(
+            'DROP TABLE IF EXISTS "{0}"'.format(table_name)
+        )
+        db_connection.execute(
+            'ALTER TABLE "{0}" RENAME TO "{1}"'.format(staging_table_name,
+                                                       table_name)
+        )
+
+
 def store_table(data_frame, table_name):
     """
-    Store a data frame in the DB
+    Store a data frame in the DB. The data is first written in a staging
+    table and then swapped with the existing one (see swap_table). With
+    PostgreSQL the rows are transferred with COPY (see store_table_copy),
+    otherwise, DataFrame.to_sql is used. The search index is created in the
+    staging table if the previous table had one or the table is large.
+
     :param data_frame: The data frame to store
     :param table_name: The name of the table in the DB
     :return: Nothing. Side effect in the DB
     """
 
-    # We ovewrite the content and do not create an index
-    data_frame.to_sql(table_name,
-                      engine,
-                      if_exists='replace',
-                      index=False)
+    # See if the new table needs a search index (it had one or it is a large
+    # workflow table)
+    min_rows = getattr(settings, 'DATAOPS_SEARCH_INDEX_MIN_ROWS', None)
+    with_search_index = has_search_index(table_name)
+    if not with_search_index and min_rows is not None \
+            and data_frame.shape[0] >= min_rows \
+            and not table_name.startswith(upload_table_prefix.format('')):
+        with_search_index = True
+
+    staging_table_name = create_staging_table_name(table_name)
+    try:
+        if engine.dialect.name == 'postgresql':
+            store_table_copy(data_frame, staging_table_name)
+        else:
+            # We do not create an index
+            data_frame.to_sql(staging_table_name,
+                              engine,
+                              if_exists='fail',
+                              index=False)
+
+        if with_search_index:
+            build_search_index(staging_table_name, list(data_frame.columns))
+
+        swap_table(staging_table_name, table_name)
+    except Exception:
+        # Remove the staging table (if created) and propagate the error
+        with engine.begin() as db_connection:
+            db_connection.execute(
+                'DROP TABLE IF EXISTS "{0}"'.format(staging_table_name)
+            )
+        raise
 
     return
 
@@ -318,6 +761,7 @@ def delete_table(pk):
         cursor = connection.cursor()
         cursor.execute('DROP TABLE "{0}";'.format(create_table_name(pk)))
         connection.commit()
+        increase_data_version(pk)
     except Exception:
         logger.error(
             'Error while dropping table {0}'.format(create_table_name(pk))
@@ -341,11 +785,144 @@ def get_table_column_types(table_name):
     """
     cursor = connection.cursor()
     cursor.execute("""select column_name, data_type from 
-    INFORMATION_SCHEMA.COLUMNS where table_name = '{0}'""".format(table_name))
+    INFORMATION_SCHEMA.COLUMNS where table_name = '{0}'
+    and column_name != '{1}'""".format(table_name, search_column_name))
 
     return cursor.fetchall()
 
 
+def has_search_index(table_name):
+    """
+    :param table_name: Table name
+    :return: Boolean stating if the table has a search index
+    """
+    cursor = connection.cursor()
+    cursor.execute("""select count(*) from INFORMATION_SCHEMA.COLUMNS
+    where table_name = %s and column_name = %s""",
+                   [table_name, search_column_name])
+
+    return cursor.fetchone()[0] > 0
+
+
+def get_search_text_expression(column_names):
+    """
+    :param column_names: List of column names (already escaped if needed)
+    :return: SQL expression concatenating the text of the given columns
+    """
+    if not column_names:
+        return "''"
+
+    return "concat_ws(' ', {0})".format(
+        ', '.join(['CAST("{0}" AS TEXT)'.format(x) for x in column_names])
+    )
+
+
+def build_search_index(table_name, column_names):
+    """
+    Add to the table the column with the text of all the columns in each
+    row and create a trigram (pg_trgm) GIN index on it. The searches of a
+    value in any of the columns use this index to obtain the candidate rows
+    (see get_search_condition). If the extension is not available, the
+    index is not created.
+
+    :param table_name: Table name
+    :param column_names: Columns in the table (not escaped)
+    :return: Boolean stating if the index has been created
+    """
+    if engine.dialect.name != 'postgresql':
+        return False
+
+    try:
+        with engine.begin() as db_connection:
+            db_connection.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except Exception:
+        logger.error('Unable to create the pg_trgm extension in the DB')
+        return False
+
+    with engine.begin() as db_connection:
+        db_connection.execute(
+            'ALTER TABLE "{0}" ADD COLUMN "{1}" TEXT'.format(
+                table_name,
+                search_column_name)
+        )
+        db_connection.execute('UPDATE "{0}" SET "{1}" = {2}'.format(
+            table_name,
+            search_column_name,
+            get_search_text_expression(
+                [fix_pctg_in_name(x) for x in column_names]))
+        )
+        db_connection.execute(
+            'CREATE INDEX "{0}" ON "{1}" USING gin ("{2}" gin_trgm_ops)'.format(
+                table_name + search_index_suffix,
+                table_name,
+                search_column_name)
+        )
+
+    return True
+
+
+def create_search_index(pk):
+    """
+    Create the search index for the table of the workflow (if not present).
+    The index is kept up to date when the table is modified.
+
+    :param pk: Workflow primary key to obtain table name
+    :return: Boolean stating if the table has the index
+    """
+    table_name = create_table_name(pk)
+    if has_search_index(table_name):
+        return True
+
+    return build_search_index(
+        table_name,
+        [x for x, _ in get_table_column_types(table_name)]
+    )
+
+
+def drop_search_index(pk):
+    """
+    Remove the search index (if any) from the table of the workflow
+
+    :param pk: Workflow primary key to obtain table name
+    :return: Nothing. Side effect in the DB
+    """
+    with engine.begin() as db_connection:
+        db_connection.execute(
+            'ALTER TABLE "{0}" DROP COLUMN IF EXISTS "{1}"'.format(
+                create_table_name(pk),
+                search_column_name)
+        )
+
+
+def update_search_text(pk, where_txt=None, where_fields=None):
+    """
+    Recalculate the text used by the search index after modifying the
+    table (if it has the index).
+
+    :param pk: Workflow primary key to obtain table name
+    :param where_txt: Optional condition to select the modified rows
+    :param where_fields: Parameters for the previous condition
+    :return: Nothing. Side effect in the DB
+    """
+    table_name = create_table_name(pk)
+    if not has_search_index(table_name):
+        return
+
+    query = 'UPDATE "{0}" SET "{1}" = {2}'.format(
+        table_name,
+        search_column_name,
+        get_search_text_expression(
+            [fix_pctg_in_name(x)
+             for x, _ in get_table_column_types(table_name)]
+        )
+    )
+    if where_txt:
+        query += ' WHERE ' + where_txt
+
+    cursor = connection.cursor()
+    cursor.execute(query, where_fields or [])
+
+
 def df_column_types_rename(table_name):
     """
     
@@ -362,6 +939,79 @@ def df_column_types_rename(table_name):
             get_table_column_types(table_name)]
 
 
+def materialize_virtual_column(pk, column_name):
+    """
+    Turn a virtual column (see get_virtual_columns) into a column of the
+    table storing the data frame with its current values. The reads of the
+    column are removed.
+
+    :param pk: Workflow primary key to obtain table name
+    :param column_name: Name of the virtual column
+    :return: Nothing. Side effect in the DB
+    """
+    table_name = create_table_name(pk)
+    __, track_id, key_name = next(x for x in get_virtual_columns(pk)
+                                  if x[0] == column_name)
+
+    cursor = connection.cursor()
+    cursor.execute(
+        'ALTER TABLE "{0}" ADD COLUMN "{1}" {2}'.format(
+            table_name,
+            fix_pctg_in_name(column_name),
+            ontask_sql_types['integer']),
+        [])
+    cursor.execute(
+        'UPDATE "{0}" SET "{1}" = COALESCE((SELECT "count" FROM "{2}" '
+        'WHERE "track_id" = %s AND "recipient" = CAST("{0}"."{3}" AS TEXT)), '
+        '0)'.format(table_name,
+                    fix_pctg_in_name(column_name),
+                    apps.get_model('action', 'EmailRead')._meta.db_table,
+                    fix_pctg_in_name(key_name)),
+        [track_id])
+    apps.get_model('action', 'EmailTrack').objects.filter(
+        id=track_id
+    ).delete()
+    update_search_text(pk)
+    increase_data_version(pk)
+
+
+def add_email_reads(pk, column_name, increments):
+    """
+    Record the reads of the emails of a tracked send in the table of reads
+    (see get_virtual_columns) with a single statement.
+
+    :param pk: Workflow primary key
+    :param column_name: Name of the virtual column of the send
+    :param increments: List of pairs (recipient, number of reads)
+    :return: Nothing. Side effect in the DB
+    """
+    track_id = next(x[1] for x in get_virtual_columns(pk)
+                    if x[0] == column_name)
+
+    # Add the amounts of the repeated recipients
+    amounts = OrderedDict()
+    for key, amount in increments:
+        key = unicode(key)
+        amounts[key] = amounts.get(key, 0) + amount
+
+    if not amounts:
+        return
+
+    query = 'INSERT INTO "{0}" ("track_id", "recipient", "count", ' \
+            '"first_seen", "last_seen") VALUES {1} ' \
+            'ON CONFLICT ("track_id", "recipient") DO UPDATE SET ' \
+            '"count" = "{0}"."count" + EXCLUDED."count", ' \
+            '"last_seen" = EXCLUDED."last_seen"'.format(
+                apps.get_model('action', 'EmailRead')._meta.db_table,
+                ', '.join(['(%s, %s, %s, now(), now())'] * len(amounts)))
+    parameters = [x for key, amount in amounts.items()
+                  for x in (track_id, key, amount)]
+
+    cursor = connection.cursor()
+    cursor.execute(query, parameters)
+    increase_data_version(pk)
+
+
 def df_drop_column(pk, column_name):
     """
     Drop a column from the DB table storing a data frame
@@ -370,12 +1020,131 @@ def df_drop_column(pk, column_name):
     :return: Drops the column from the corresponding DB table
     """
 
+    virtual_columns = get_virtual_columns(pk)
+    if column_name in [x[0] for x in virtual_columns]:
+        # Nothing in the table, the reads are removed with the column
+        increase_data_version(pk)
+        return
+
+    # The virtual columns using this one to identify the recipients keep
+    # their current values
+    for name, __, key_name in virtual_columns:
+        if key_name == column_name:
+            materialize_virtual_column(pk, name)
+
     query = 'ALTER TABLE "{0}" DROP COLUMN "{1}"'.format(
         create_table_name(pk),
         column_name
     )
     cursor = connection.cursor()
     cursor.execute(query)
+    update_search_text(pk)
+    increase_data_version(pk)
+
+
+def df_add_column(pk, column_name, data_type, initial_value=None):
+    """
+    Add a column to the DB table storing a data frame without rewriting
+    the table
+    :param pk: Workflow primary key to obtain table name
+    :param column_name: Column name
+    :param data_type: OnTask data type (string, integer, double, etc)
+    :param initial_value: Value for the column in all rows (None for NULL)
+    :return: Adds the column to the corresponding DB table
+    """
+
+    table_name = create_table_name(pk)
+    query = 'ALTER TABLE "{0}" ADD COLUMN "{1}" {2}'.format(
+        table_name,
+        fix_pctg_in_name(column_name),
+        ontask_sql_types[data_type]
+    )
+    fields = []
+    if initial_value is not None:
+        # The default populates the existing rows and it is then removed
+        query += ' DEFAULT %s'
+        fields = [initial_value]
+
+    cursor = connection.cursor()
+    cursor.execute(query, fields)
+    if initial_value is not None:
+        cursor.execute(
+            'ALTER TABLE "{0}" ALTER COLUMN "{1}" DROP DEFAULT'.format(
+                table_name,
+                fix_pctg_in_name(column_name)),
+            []
+        )
+        update_search_text(pk)
+    increase_data_version(pk)
+
+
+def df_rename_column(pk, old_name, new_name):
+    """
+    Rename a column in the DB table storing a data frame
+    :param pk: Workflow primary key to obtain table name
+    :param old_name: Current column name
+    :param new_name: New column name
+    :return: Renames the column in the corresponding DB table
+    """
+
+    # The virtual columns using this one to identify the recipients
+    apps.get_model('action', 'EmailTrack').objects.filter(
+        column__workflow__id=pk,
+        key_name=old_name
+    ).update(key_name=new_name)
+
+    if old_name in get_virtual_column_names(pk):
+        # Nothing to change in the table
+        increase_data_version(pk)
+        return
+
+    query = 'ALTER TABLE "{0}" RENAME COLUMN "{1}" TO "{2}"'.format(
+        create_table_name(pk),
+        old_name,
+        new_name
+    )
+    cursor = connection.cursor()
+    cursor.execute(query)
+    increase_data_version(pk)
+
+
+def df_copy_column(pk, from_name, to_name):
+    """
+    Copy the values of a column into another existing column in the DB
+    table storing a data frame. The values are cast to the SQL type of the
+    destination column (the source may have been stored with another type,
+    e.g. boolean columns stored as text).
+    :param pk: Workflow primary key to obtain table name
+    :param from_name: Column to copy the values from
+    :param to_name: Column to copy the values to
+    :return: Updates the corresponding DB table
+    """
+
+    table_name = create_table_name(pk)
+    query = 'UPDATE "{0}" SET "{1}" = CAST("{2}" AS {3})'.format(
+        table_name,
+        fix_pctg_in_name(to_name),
+        fix_pctg_in_name(from_name),
+        dict(get_table_column_types(table_name))[to_name]
+    )
+    fields = []
+    virtual = [x for x in get_virtual_columns(pk) if x[0] == from_name]
+    if virtual:
+        # Copy the number of reads of each recipient
+        __, track_id, key_name = virtual[0]
+        query = 'UPDATE "{0}" SET "{1}" = COALESCE((SELECT "count" ' \
+                'FROM "{2}" WHERE "track_id" = %s AND "recipient" = ' \
+                'CAST("{0}"."{3}" AS TEXT)), 0)'.format(
+                    table_name,
+                    fix_pctg_in_name(to_name),
+                    apps.get_model('action', 'EmailRead')._meta.db_table,
+                    fix_pctg_in_name(key_name))
+        fields = [track_id]
+
+    cursor = connection.cursor()
+    cursor.execute(query, fields)
+    update_search_text(pk)
+    increase_data_version(pk)
 
 
 def get_subframe(pk, cond_filter, column_names=None):
@@ -397,26 +1166,23 @@ def get_subframe(pk, cond_filter, column_names=None):
     return result
 
 
-def get_table_cursor(pk, cond_filter, column_names=None):
+def get_table_query(pk, cond_filter, column_names=None):
     """
-    Execute a select query in the database with an optional filter obtained
-    from the jquery QueryBuilder.
+    Create the select query to fetch the table rows with an optional filter
+    obtained from the jquery QueryBuilder.
 
     :param pk: Primary key of the workflow storing the data
     :param cond_filter: Condition object to filter the data (or None)
     :param column_names: optional list of columns to select
-    :return: ([list of column names], QuerySet with the data rows)
+    :return: (query text, list of parameters)
     """
 
     # Create the query
-    if column_names:
-        safe_column_names = [fix_pctg_in_name(x) for x in column_names]
-        query = 'SELECT "{0}" from "{1}"'.format(
-            '", "'.join(safe_column_names),
-            create_table_name(pk)
-        )
-    else:
-        query = 'SELECT * from "{0}"'.format(create_table_name(pk))
+    query = get_select_clause(pk, column_names)
+    query += ' FROM ' + get_table_source(
+        pk,
+        column_names or None,
+        [cond_filter.formula] if cond_filter is not None else None)
 
     # See if the action has a filter or not
     fields = []
@@ -426,6 +1192,22 @@ def get_table_cursor(pk, cond_filter, column_names=None):
             # The condition may be empty, in which case, nothing is needed.
             query += ' WHERE ' + cond_filter
 
+    return query, fields
+
+
+def get_table_cursor(pk, cond_filter, column_names=None):
+    """
+    Execute a select query in the database with an optional filter obtained
+    from the jquery QueryBuilder.
+
+    :param pk: Primary key of the workflow storing the data
+    :param cond_filter: Condition object to filter the data (or None)
+    :param column_names: optional list of columns to select
+    :return: ([list of column names], QuerySet with the data rows)
+    """
+
+    query, fields = get_table_query(pk, cond_filter, column_names)
+
     # Execute the query
     cursor = connection.cursor()
     cursor.execute(query, fields)
@@ -433,6 +1215,45 @@ def get_table_cursor(pk, cond_filter, column_names=None):
     return cursor
 
 
+def get_table_chunks(pk, cond_filter, column_names=None):
+    """
+    Generator to traverse the rows of the table in data frames of at most
+    stream_chunk_size rows. The rows are read through a server side cursor,
+    so only one chunk is in memory at any time. At least one data frame
+    (possibly empty) is produced.
+
+    :param pk: Primary key of the workflow storing the data
+    :param cond_filter: Condition object to filter the data (or None)
+    :param column_names: optional list of columns to select
+    :return: Generator of data frames with the rows of the table
+    """
+
+    query, fields = get_table_query(pk, cond_filter, column_names)
+
+    # Execute the query in a named (server side) cursor
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.execute(query, fields)
+
+        first_chunk = True
+        while True:
+            rows = cursor.fetchmany(stream_chunk_size)
+            if not rows and not first_chunk:
+                break
+
+            # Description is only available after the first fetch
+            yield pd.DataFrame.from_records(
+                rows,
+                columns=[c.name for c in cursor.description],
+                coerce_float=True)
+
+            first_chunk = False
+            if len(rows) < stream_chunk_size:
+                break
+    finally:
+        cursor.close()
+
+
 def get_table_data(pk, cond_filter, column_names=None):
     # Get first the cursor
     cursor = get_table_cursor(pk, cond_filter, column_names)
@@ -454,26 +1275,24 @@ def execute_select_on_table(pk, fields, values, column_names=None):
     """
 
     # Create the query
-    if column_names:
-        safe_column_names = ['"' + fix_pctg_in_name(x) + '"'
-                             for x in column_names]
-        query = 'SELECT {0}'.format(','.join(safe_column_names))
-    else:
-        query = 'SELECT *'
+    query = get_select_clause(pk, column_names)
 
     # Add the table
-    query += ' FROM "{0}"'.format(create_table_name(pk))
+    query += ' FROM ' + get_table_source(
+        pk,
+        column_names + fields if column_names else None)
 
     # See if the action has a filter or not
-    cursor = connection.cursor()
     if fields:
         query += ' WHERE ' + \
                  ' AND '.join(['"{0}" = %s'.format(fix_pctg_in_name(x))
                                for x in fields])
-        cursor.execute(query, values)
     else:
-        # Execute the query
-        cursor.execute(query)
+        values = []
+
+    # Execute the query
+    cursor = connection.cursor()
+    cursor.execute(query, values)
 
     # Get the data
     return cursor.fetchall()
@@ -528,8 +1347,9 @@ def update_row(pk, set_fields, set_values, where_fields, where_values):
     query += ' SET ' + ', '.join(['"{0}" = %s'.format(fix_pctg_in_name(x))
                                   for x in set_fields])
     # And finally add the WHERE clause
-    query += ' WHERE ' + ' AND '.join(['"{0}" = %s'.format(fix_pctg_in_name(x))
-                                       for x in where_fields])
+    where_txt = ' AND '.join(['"{0}" = %s'.format(fix_pctg_in_name(x))
+                              for x in where_fields])
+    query += ' WHERE ' + where_txt
 
     # Concatenate the values as parameters to the query
     parameters = set_values + where_values
@@ -537,7 +1357,67 @@ def update_row(pk, set_fields, set_values, where_fields, where_values):
     # Execute the query
     cursor = connection.cursor()
     cursor.execute(query, parameters)
+
+    # The row is now selected with the new values of the modified keys
+    new_values = dict(zip(set_fields, set_values))
+    update_search_text(pk,
+                       where_txt,
+                       [new_values.get(x, y)
+                        for x, y in zip(where_fields, where_values)])
     connection.commit()
+    increase_data_version(pk)
+
+
+def increase_row_integer(pk, set_field, where_field, increments):
+    """
+    Increase the values of an integer column in the rows selected by the
+    value in another column with a single statement:
+
+    UPDATE table SET set_field = set_field + amount
+    FROM (VALUES (key, amount), ...) WHERE where_field = key
+
+    The keys are compared as text, so they can be given for any column type.
+
+    :param pk: Primary key to detect workflow
+    :param set_field: Integer column to increase (NULL is taken as zero)
+    :param where_field: Column used to select the rows
+    :param increments: List of pairs (where_field value, amount). Repeated
+    values are added together.
+    :return: The table in the workflow pointed by PK is modified.
+    """
+    # Add the amounts of the repeated keys
+    amounts = OrderedDict()
+    for key, amount in increments:
+        key = unicode(key)
+        amounts[key] = amounts.get(key, 0) + amount
+
+    if not amounts:
+        return
+
+    query = 'UPDATE "{0}" SET "{1}" = COALESCE("{1}", 0) + increments.amount' \
+            ' FROM (VALUES {3}) AS increments(key, amount)' \
+            ' WHERE CAST("{2}" AS TEXT) = increments.key' \
+            ' RETURNING CAST("{2}" AS TEXT)'.format(
+                create_table_name(pk),
+                fix_pctg_in_name(set_field),
+                fix_pctg_in_name(where_field),
+                ', '.join(['(%s, %s)'] * len(amounts)))
+    parameters = [x for pair in amounts.items() for x in pair]
+
+    cursor = connection.cursor()
+    cursor.execute(query, parameters)
+
+    # Select the modified rows with the values after the update (the
+    # increased column may be the one selecting the rows)
+    keys = list(set([x[0] for x in cursor.fetchall()]))
+    if keys:
+        update_search_text(
+            pk,
+            'CAST("{0}" AS TEXT) IN ({1})'.format(
+                fix_pctg_in_name(where_field),
+                ', '.join(['%s'] * len(keys))),
+            keys)
+    increase_data_version(pk)
 
 
 def get_table_row_by_key(workflow, cond_filter, kv_pair, column_names=None):
@@ -554,14 +1434,13 @@ def get_table_row_by_key(workflow, cond_filter, kv_pair, column_names=None):
     """
 
     # Create the query
-    if column_names:
-        safe_column_names = [fix_pctg_in_name(x) for x in column_names]
-        query = 'SELECT "{0}"'.format('", "'.join(safe_column_names))
-    else:
-        query = 'SELECT *'
+    query = get_select_clause(workflow.id, column_names)
 
     # Add the table
-    query += ' FROM "{0}"'.format(create_table_name(workflow.id))
+    query += ' FROM ' + get_table_source(
+        workflow.id,
+        column_names + [kv_pair[0]] if column_names else None,
+        [cond_filter.formula] if cond_filter is not None else None)
 
     # Create the second part of the query setting key=value
     query += ' WHERE ("{0}" = %s)'.format(fix_pctg_in_name(kv_pair[0]))
@@ -588,8 +1467,9 @@ def get_table_row_by_key(workflow, cond_filter, kv_pair, column_names=None):
     # Get the only element
     qs = qs[0]
 
-    # ZIP the values to create a dictionary
-    return OrderedDict(zip(workflow.get_column_names(), qs))
+    # ZIP the values to create a dictionary (the column names are taken
+    # from the query as the table layout may differ from the column order)
+    return OrderedDict(zip([c.name for c in cursor.description], qs))
 
 
 def get_column_stats_from_df(df_column):
@@ -651,13 +1531,93 @@ def get_column_stats_from_df(df_column):
     return result
 
 
+def use_search_index(pk, cv_tuples=None):
+    """
+    Decide if a search can use the search index of the table. The text in
+    the index only contains the columns stored in the table, so the index
+    is not used when the search includes virtual columns (see
+    get_virtual_columns).
+
+    :param pk: Workflow primary key
+    :param cv_tuples: A column, value, type tuple to search the value in the
+    column
+    :return: Boolean
+    """
+    if not cv_tuples or not has_search_index(create_table_name(pk)):
+        return False
+
+    virtual_names = get_virtual_column_names(pk)
+    return not any(x[0] in virtual_names for x in cv_tuples)
+
+
+def get_search_condition(cv_tuples=None,
+                         any_join=True,
+                         pre_filter=None,
+                         use_index=False):
+    """
+    Create the condition to use in the WHERE clause when searching the rows
+    of a table. For every (column, value) pair, column contains value (as in
+    LIKE %value%), these are combined with OR if any_join is TRUE, or AND
+    otherwise. The pre_filter (if given) is combined with AND.
+
+    If use_index is true, the values are also searched in the text with all
+    the columns of the row (a necessary condition that the DB evaluates with
+    the search index), and the columns are only checked for those rows.
+
+    :param cv_tuples: A column, value, type tuple to search the value in the
+    column
+    :param any_join: Boolean encoding if values should be combined with OR (or
+    AND)
+    :param pre_filter: Optional filter condition to pre filter the query set.
+    :param use_index: The table has a search index (see create_search_index)
+    :return: (condition text (empty if none), list of parameters)
+    """
+
+    conditions = []
+    fields = []
+
+    # Calculate the first suffix to add to the query
+    if pre_filter:
+        filter_txt, filter_fields = evaluate_node_sql(pre_filter)
+        if filter_txt:
+            conditions.append(filter_txt)
+            fields.extend(filter_fields)
+
+    if cv_tuples and use_index:
+        values = list(OrderedDict.fromkeys([x[1] for x in cv_tuples]))
+        likes = ['("{0}" LIKE %s)'.format(search_column_name)] * len(values)
+        if any_join:
+            conditions.append('(' + ' OR '.join(likes) + ')')
+        else:
+            conditions.append('(' + ' AND '.join(likes) + ')')
+        fields.extend(['%' + x + '%' for x in values])
+
+    if cv_tuples:
+        likes = []
+        for name, value, data_type in cv_tuples:
+            # Make sure we escape the name and search as text
+            name = fix_pctg_in_name(name)
+            likes.append('(CAST("{0}" AS TEXT) LIKE %s)'.format(name))
+            fields.append('%' + value + '%')
+
+        # Combine the search subqueries
+        if any_join:
+            conditions.append('(' + ' OR '.join(likes) + ')')
+        else:
+            conditions.append('(' + ' AND '.join(likes) + ')')
+
+    return ' AND '.join(conditions), fields
+
+
 def search_table_rows(workflow_id,
                       cv_tuples=None,
                       any_join=True,
                       order_col_name=None,
                       order_asc=True,
                       column_names=None,
-                      pre_filter=None):
+                      pre_filter=None,
+                      offset=0,
+                      limit=None):
     """
     Select rows where for every (column, value) pair, column contains value (
     as in LIKE %value%, these are combined with OR if any is TRUE, or AND if
@@ -674,74 +1634,98 @@ def search_table_rows(workflow_id,
     :param column_names: Optional list of column names to select
     :param pre_filter: Optional filter condition to pre filter the query set.
            the query is built with these terms as requirement AND the cv_tuples.
+    :param offset: Number of rows to skip (paging is done in the DB)
+    :param limit: Maximum number of rows to return (None for all of them)
     :return: The resulting query set
     """
 
     # Create the query
-    if column_names:
-        safe_column_names = [fix_pctg_in_name(x) for x in column_names]
-        query = 'SELECT "{0}"'.format('", "'.join(safe_column_names))
-    else:
-        query = 'SELECT *'
+    query = get_select_clause(workflow_id, column_names)
 
     # Add the table
-    query += ' FROM "{0}"'.format(create_table_name(workflow_id))
-
-    # Calculate the first suffix to add to the query
-    filter_txt = ''
-    filter_fields = []
-    if pre_filter:
-        filter_txt, filter_fields = evaluate_node_sql(pre_filter)
+    used_names = None
+    if column_names:
+        used_names = column_names + [x[0] for x in cv_tuples or []] + \
+                     [order_col_name]
+    query += ' FROM ' + get_table_source(workflow_id,
+                                         used_names,
+                                         [pre_filter])
+
+    # Add the filter and/or the cv_tuples
+    where_txt, fields = get_search_condition(
+        cv_tuples,
+        any_join,
+        pre_filter,
+        use_search_index(workflow_id, cv_tuples)
+    )
+    if where_txt:
+        query += ' WHERE ' + where_txt
 
-    if cv_tuples:
-        likes = []
-        tuple_fields = []
-        for name, value, data_type in cv_tuples:
-            # Make sure we escape the name and search as text
-            name = fix_pctg_in_name(name)
-            mod_name = '(CAST("{0}" AS TEXT) LIKE %s)'.format(name)
+    # Add the order if needed. The key column is always the last term, so
+    # the order is total and the pages do not repeat or skip rows
+    order_terms = []
+    if order_col_name:
+        order_terms.append('"{0}"{1}'.format(
+            fix_pctg_in_name(order_col_name),
+            '' if order_asc else ' DESC'))
+    key_name = get_workflow_key_name(workflow_id)
+    if key_name and key_name != order_col_name:
+        order_terms.append('"{0}"'.format(fix_pctg_in_name(key_name)))
+    if order_terms:
+        query += ' ORDER BY ' + ', '.join(order_terms)
+
+    # Push the page limits to the DB
+    if limit is not None and limit >= 0:
+        query += ' LIMIT %s'
+        fields.append(limit)
+    if offset:
+        query += ' OFFSET %s'
+        fields.append(offset)
 
-            # Create the second part of the query setting column LIKE '%value%'
-            likes.append(mod_name)
-            tuple_fields.append('%' + value + '%')
+    # Execute the query
+    cursor = connection.cursor()
+    cursor.execute(query, fields)
 
-        # Combine the search subqueries
-        if any_join:
-            tuple_txt = '(' + ' OR '.join(likes) + ')'
-        else:
-            tuple_txt = '(' + ' AND '.join(likes) + ')'
+    # Get the data
+    return cursor.fetchall()
 
-    # Build the query so far appending the filter and/or the cv_tuples
-    if filter_txt or cv_tuples:
-        query += ' WHERE '
 
-    fields = []
-    # If there has been a suffix from the filter, add it.
-    if filter_txt and filter_fields:
-        query += filter_txt
-        fields.extend(filter_fields)
+def search_table_rows_count(workflow_id,
+                            cv_tuples=None,
+                            any_join=True,
+                            pre_filter=None):
+    """
+    Number of rows that would be returned by search_table_rows with the same
+    parameters (without paging). The count is calculated in the DB.
 
-    # If there is a pre-filter, the suffix needs to be "AND" with the ones
-    # just calculated
-    if filter_txt and cv_tuples:
-        query += ' AND '
+    :param workflow_id: workflow object to get to the table
+    :param cv_tuples: A column, value, type tuple to search the value in the
+    column
+    :param any_join: Boolean encoding if values should be combined with OR (or
+    AND)
+    :param pre_filter: Optional filter condition to pre filter the query set.
+    :return: Number of rows
+    """
 
-    if cv_tuples:
-        query += tuple_txt
-        fields.extend(tuple_fields)
+    query = 'SELECT count(*) FROM ' + get_table_source(
+        workflow_id,
+        [x[0] for x in cv_tuples or []],
+        [pre_filter])
 
-    # Add the order if needed
-    if order_col_name:
-        query += ' ORDER BY "{0}"'.format(fix_pctg_in_name(order_col_name))
-    if not order_asc:
-        query += ' DESC'
+    where_txt, fields = get_search_condition(
+        cv_tuples,
+        any_join,
+        pre_filter,
+        use_search_index(workflow_id, cv_tuples)
+    )
+    if where_txt:
+        query += ' WHERE ' + where_txt
 
     # Execute the query
     cursor = connection.cursor()
     cursor.execute(query, fields)
 
-    # Get the data
-    return cursor.fetchall()
+    return cursor.fetchone()[0]
 
 
 def delete_table_row_by_key(workflow_id, kv_pair):
@@ -765,6 +1749,7 @@ def delete_table_row_by_key(workflow_id, kv_pair):
     # Execute the query
     cursor = connection.cursor()
     cursor.execute(query, fields)
+    increase_data_version(workflow_id)
 
 
 def num_rows(pk, cond_filter=None):
@@ -774,7 +1759,17 @@ def num_rows(pk, cond_filter=None):
     :param cond_filter: Condition element to filter the query
     :return:
     """
-    return num_rows_by_name(create_table_name(pk), cond_filter)
+    source = get_table_source(pk, [], [cond_filter])
+
+    query = 'SELECT count(*) FROM ' + source
+    fields = []
+    if cond_filter is not None:
+        cond_filter, fields = evaluate_node_sql(cond_filter)
+        query += ' WHERE ' + cond_filter
+
+    cursor = connection.cursor()
+    cursor.execute(query, fields)
+    return cursor.fetchone()[0]
 
 
 def num_rows_by_name(table_name, cond_filter=None):
@@ -798,6 +1793,45 @@ def num_rows_by_name(table_name, cond_filter=None):
     return cursor.fetchone()[0]
 
 
+def num_rows_by_formulas(pk, formula_lists):
+    """
+    Obtain in a single query the number of rows of the table storing the
+    workflow with the given pk that satisfy each of the given conjunctions
+    of formulas (one count(*) FILTER (WHERE ...) per conjunction)
+
+    :param pk: Primary key of the table storing the data frame
+    :param formula_lists: List of lists of formulas. Each list is counted as
+    the conjunction of its (non empty) formulas.
+    :return: List of integers (one per conjunction)
+    """
+    if not formula_lists:
+        return []
+
+    counts = []
+    fields = []
+    for formulas in formula_lists:
+        # Translate the formulas and combine the non empty ones with AND
+        sql_pairs = [evaluate_node_sql(x) for x in formulas if x]
+        sql_pairs = [(x, y) for x, y in sql_pairs if x]
+        if not sql_pairs:
+            counts.append('count(*)')
+            continue
+
+        counts.append('count(*) FILTER (WHERE {0})'.format(
+            ' AND '.join(['(' + x + ')' for x, _ in sql_pairs])
+        ))
+        for _, sql_fields in sql_pairs:
+            fields.extend(sql_fields)
+
+    query = 'SELECT {0} FROM {1}'.format(
+        ', '.join(counts),
+        get_table_source(pk, [], [x for y in formula_lists for x in y]))
+
+    cursor = connection.cursor()
+    cursor.execute(query, fields)
+    return list(cursor.fetchone())
+
+
 def check_wf_df(workflow):
     """
     Check the consistency between the information stored in the workflow
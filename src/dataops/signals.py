@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from action.models import Action
+from . import ops
+
+
+@receiver([post_save, pre_delete], sender='action.Condition')
+def condition_changed_handler(sender, instance, **kwargs):
+    # The formula may have changed, discard the column dependencies (the
+    # action may not be present yet when loading fixtures)
+    workflow_id = Action.objects.filter(
+        pk=instance.action_id
+    ).values_list('workflow_id', flat=True).first()
+    if workflow_id is not None:
+        ops.invalidate_column_dependencies(workflow_id)
+
+
+@receiver([post_save, pre_delete], sender='table.View')
+def view_changed_handler(sender, instance, **kwargs):
+    # The formula may have changed, discard the column dependencies
+    ops.invalidate_column_dependencies(instance.workflow_id)
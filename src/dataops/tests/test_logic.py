@@ -1,13 +1,29 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import os
 import StringIO
 
+import mock
 import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.test import override_settings
 
 import test
 from dataops import pandas_db
-from dataops.ops import perform_dataframe_upload_merge
+from action.models import Action, Condition, EmailTrack
+from action.ops import add_track_column
+from dataops.models import PendingRecount
+from dataops.ops import (
+    enqueue_n_rows_selected,
+    get_column_dependencies,
+    perform_dataframe_upload_merge,
+    process_pending_recounts,
+    store_dataframe_in_db,
+    workflow_update_n_rows_selected)
+from workflow.models import Workflow
+from workflow.ops import clone_column
 
 
 class DataopsMatrixManipulation(test.OntaskTestCase):
@@ -100,4 +116,608 @@ class DataopsMatrixManipulation(test.OntaskTestCase):
             np.testing.assert_array_equal(
                 np.array(df_source[x], dtype=unicode),
                 np.array(df_dst[x], dtype=unicode)
-            )
\ No newline at end of file
+            )
+
+class DataopsTableCache(test.OntaskTransactionTestCase):
+    # The cache is not used within a transaction, so the changes in these
+    # tests are committed
+    fixtures = ['simple_workflow_export']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'workflow',
+        'fixtures',
+        'simple_workflow_export_df.sql'
+    )
+
+    def setUp(self):
+        super(DataopsTableCache, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsTableCache, self).tearDown()
+
+    @override_settings(
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        DATAOPS_DF_CACHE='default')
+    def test_cache_hit_and_invalidation(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        df1 = pandas_db.load_from_db(workflow.id)
+
+        with mock.patch.object(pd, 'read_sql', wraps=pd.read_sql) as read_sql:
+            # The second load is served from the cache
+            df2 = pandas_db.load_from_db(workflow.id)
+            self.assertEqual(read_sql.call_count, 0)
+            self.assertTrue(df1.equals(df2))
+
+            # A new data version discards the cached copy
+            pandas_db.increase_data_version(workflow.id)
+            pandas_db.load_from_db(workflow.id)
+            self.assertEqual(read_sql.call_count, 1)
+
+            # And the new copy is cached again
+            pandas_db.load_from_db(workflow.id)
+            self.assertEqual(read_sql.call_count, 1)
+
+    @override_settings(
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        DATAOPS_DF_CACHE='default')
+    def test_cache_invalidated_on_write(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        df = pandas_db.load_from_db(workflow.id)
+        sid = df['sid'][0]
+
+        # Modify one row, the new value must be loaded
+        pandas_db.update_row(workflow.id,
+                             ['first_name'],
+                             ['new'],
+                             ['sid'],
+                             [sid])
+        df = pandas_db.load_from_db(workflow.id)
+        self.assertEqual(df.loc[df['sid'] == sid, 'first_name'].values[0],
+                         'new')
+
+        # Delete a row
+        nrows = df.shape[0]
+        pandas_db.delete_table_row_by_key(workflow.id, ('sid', sid))
+        self.assertEqual(pandas_db.load_from_db(workflow.id).shape[0],
+                         nrows - 1)
+
+        # Drop a column
+        pandas_db.df_drop_column(workflow.id, 'video_3')
+        self.assertNotIn('video_3',
+                         pandas_db.load_from_db(workflow.id).columns)
+
+
+class DataopsNullColumnTypes(test.OntaskTestCase):
+
+    pk = '998'
+
+    csv = """key,text1,double1
+1,d1,1.0
+2,d2,2.0
+3,d3,3.0"""
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsNullColumnTypes, self).tearDown()
+
+    def test_null_column_types(self):
+        df_source = pandas_db.load_df_from_csvfile(
+            StringIO.StringIO(self.csv),
+            0,
+            0)
+
+        # Columns without values keep their numeric or datetime type
+        df_source['double2'] = np.nan
+        df_source['date2'] = pd.NaT
+        pandas_db.store_table(df_source, pandas_db.create_table_name(self.pk))
+
+        self.assertEqual(
+            pandas_db.df_column_types_rename(
+                pandas_db.create_table_name(self.pk)),
+            ['integer', 'string', 'double', 'double', 'datetime'])
+
+
+class DataopsStoreTable(test.OntaskTestCase):
+
+    pk = '996'
+
+    csv1 = """key,text1
+1,d1
+2,d2"""
+
+    csv2 = """key,text1
+1,e1
+2,e2
+3,e3"""
+
+    def setUp(self):
+        super(DataopsStoreTable, self).setUp()
+        self.table_name = pandas_db.create_table_name(self.pk)
+        pandas_db.store_table(
+            pandas_db.load_df_from_csvfile(StringIO.StringIO(self.csv1), 0, 0),
+            self.table_name)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsStoreTable, self).tearDown()
+
+    def get_staging_tables(self):
+        prefix = self.table_name + pandas_db.staging_table_suffix.format('')
+        return [x for x in pandas_db.connection.introspection.table_names()
+                if x.startswith(prefix)]
+
+    def test_store_through_staging(self):
+        df_source = pandas_db.load_df_from_csvfile(
+            StringIO.StringIO(self.csv2),
+            0,
+            0)
+        with mock.patch.object(pandas_db,
+                               'swap_table',
+                               wraps=pandas_db.swap_table) as swap_table:
+            pandas_db.store_table(df_source, self.table_name)
+
+        # The content is written in a staging table and then swapped
+        swap_table.assert_called_once()
+        staging_table_name, table_name = swap_table.call_args[0]
+        self.assertEqual(table_name, self.table_name)
+        self.assertNotEqual(staging_table_name, self.table_name)
+
+        # The new data replaces the old one and no staging table is left
+        df_dst = pandas_db.load_table(self.table_name)
+        self.assertEqual(list(df_dst['text1']), ['e1', 'e2', 'e3'])
+        self.assertEqual(self.get_staging_tables(), [])
+
+    def test_staging_dropped_on_copy_error(self):
+        df_source = pandas_db.load_df_from_csvfile(
+            StringIO.StringIO(self.csv2),
+            0,
+            0)
+
+        # Create the text column as bigint, so that COPY fails
+        with mock.patch.object(pandas_db,
+                               'get_df_sql_types',
+                               return_value=['bigint', 'bigint']):
+            self.assertRaises(Exception,
+                              pandas_db.store_table,
+                              df_source,
+                              self.table_name)
+
+        # The staging table is removed and the old data is still there
+        self.assertEqual(self.get_staging_tables(), [])
+        df_dst = pandas_db.load_table(self.table_name)
+        self.assertEqual(list(df_dst['text1']), ['d1', 'd2'])
+
+    def test_failed_swap_keeps_table(self):
+        # The rename of a missing staging table fails after the drop
+        self.assertRaises(Exception,
+                          pandas_db.swap_table,
+                          pandas_db.create_staging_table_name(self.table_name),
+                          self.table_name)
+
+        # The drop is rolled back
+        self.assertTrue(pandas_db.is_table_in_db(self.table_name))
+        df_dst = pandas_db.load_table(self.table_name)
+        self.assertEqual(list(df_dst['text1']), ['d1', 'd2'])
+
+
+class DataopsLoadTable(test.OntaskTestCase):
+    fixtures = ['simple_workflow_export']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'workflow',
+        'fixtures',
+        'simple_workflow_export_df.sql'
+    )
+
+    formula = {u'not': False, u'rules': [
+        {u'value': u'female', u'field': u'gender', u'operator': u'equal',
+         u'input': u'text', u'type': u'string', u'id': u'gender'}],
+               u'valid': True, u'condition': u'AND'}
+
+    def setUp(self):
+        super(DataopsLoadTable, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsLoadTable, self).tearDown()
+
+    def test_projected_load(self):
+        workflow = Workflow.objects.get(name='wflow1')
+
+        # Only the requested columns, in the order of their position
+        df = pandas_db.load_from_db(workflow.id, ['gender', 'email', 'sid'])
+        self.assertEqual(list(df.columns), ['email', 'sid', 'gender'])
+        self.assertEqual(df.shape[0], pandas_db.num_rows(workflow.id))
+
+    def test_filtered_load(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        df_all = pandas_db.load_from_db(workflow.id)
+
+        with mock.patch.object(pd,
+                               'read_sql_query',
+                               wraps=pd.read_sql_query) as read_sql_query:
+            df = pandas_db.load_from_db(workflow.id,
+                                        ['email', 'gender'],
+                                        self.formula)
+
+        # The rows are selected in the query
+        read_sql_query.assert_called_once()
+        self.assertIn(' WHERE ', read_sql_query.call_args[0][0])
+        self.assertEqual(
+            sorted(df['email']),
+            sorted(df_all.loc[df_all['gender'] == 'female', 'email']))
+
+
+class DataopsColumnOps(test.OntaskTransactionTestCase):
+    # The table is modified with the connection of Django and read with the
+    # engine, so the changes in these tests are committed
+    fixtures = ['simple_workflow_export']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'workflow',
+        'fixtures',
+        'simple_workflow_export_df.sql'
+    )
+
+    def setUp(self):
+        super(DataopsColumnOps, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+        self.workflow = Workflow.objects.get(name='wflow1')
+        self.table_name = pandas_db.create_table_name(self.workflow.id)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsColumnOps, self).tearDown()
+
+    def get_column_types(self):
+        return dict(pandas_db.get_table_column_types(self.table_name))
+
+    def count_rows(self, where):
+        cursor = pandas_db.connection.cursor()
+        cursor.execute(
+            'SELECT COUNT(*) FROM "{0}" WHERE {1}'.format(self.table_name,
+                                                          where))
+        return cursor.fetchone()[0]
+
+    def test_add_column(self):
+        with mock.patch.object(pandas_db, 'store_table') as store_table:
+            pandas_db.df_add_column(self.workflow.id, 'new_col', 'integer', 3)
+
+        # The column is added with ALTER TABLE, the table is not rewritten
+        store_table.assert_not_called()
+        self.assertEqual(self.get_column_types()['new_col'], 'bigint')
+        self.assertEqual(self.count_rows('"new_col" IS DISTINCT FROM 3'), 0)
+
+    def test_rename_column(self):
+        with mock.patch.object(pandas_db, 'store_table') as store_table:
+            pandas_db.df_rename_column(self.workflow.id, 'gender', 'sex')
+
+        store_table.assert_not_called()
+        column_types = self.get_column_types()
+        self.assertNotIn('gender', column_types)
+        self.assertEqual(column_types['sex'], 'text')
+
+    def test_rename_column_pctg(self):
+        pandas_db.df_rename_column(self.workflow.id, 'gender', 'gen%der')
+        self.assertIn('gen%der', self.get_column_types())
+
+        # The new name is escaped in the queries with parameters
+        pandas_db.df_add_column(self.workflow.id, 'gender2', 'string')
+        pandas_db.df_copy_column(self.workflow.id, 'gen%der', 'gender2')
+        self.assertEqual(
+            self.count_rows('"gender2" IS DISTINCT FROM "gen%der"'), 0)
+
+    def test_rename_virtual_column(self):
+        action = Action.objects.filter(workflow=self.workflow).first()
+        add_track_column(action, 'EmailRead_1', 'email')
+        column_types = self.get_column_types()
+
+        # The virtual column is not in the table, nothing changes
+        pandas_db.df_rename_column(self.workflow.id, 'EmailRead_1', 'Reads')
+        self.assertEqual(self.get_column_types(), column_types)
+
+        # Renaming the recipients column updates the track
+        pandas_db.df_rename_column(self.workflow.id, 'email', 'mail')
+        self.assertEqual(
+            EmailTrack.objects.get(column__workflow=self.workflow).key_name,
+            'mail')
+        self.assertIn('mail', self.get_column_types())
+
+    def test_clone_column(self):
+        column = self.workflow.columns.get(name='gender')
+        with mock.patch.object(pandas_db, 'store_table') as store_table:
+            clone_column(column, new_name='gender2')
+
+        store_table.assert_not_called()
+        self.assertEqual(self.get_column_types()['gender2'], 'text')
+        self.assertEqual(
+            self.count_rows('"gender2" IS DISTINCT FROM "gender"'), 0)
+
+    def test_clone_text_boolean_column(self):
+        # Boolean columns of older workflows may be stored as text
+        cursor = pandas_db.connection.cursor()
+        cursor.execute(
+            'ALTER TABLE "{0}" ALTER COLUMN "induction" TYPE text'.format(
+                self.table_name))
+
+        column = self.workflow.columns.get(name='induction')
+        clone_column(column, new_name='induction2')
+
+        self.assertEqual(self.get_column_types()['induction2'], 'boolean')
+        self.assertEqual(
+            self.count_rows(
+                '"induction2" IS DISTINCT FROM CAST("induction" AS boolean)'),
+            0)
+
+
+class DataopsTableSearch(test.OntaskTestCase):
+
+    pk = '997'
+
+    csv = """key,text1,double1
+1,d1,1.0
+2,d2,2.0
+3,d3,3.0
+4,e4,4.0
+5,d5,5.0"""
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsTableSearch, self).tearDown()
+
+    def test_search_paging(self):
+        df_source = pandas_db.load_df_from_csvfile(
+            StringIO.StringIO(self.csv),
+            0,
+            0)
+        pandas_db.store_table(df_source, pandas_db.create_table_name(self.pk))
+
+        cv_tuples = [('text1', 'd', 'string')]
+
+        # Only the requested page is returned
+        qs = pandas_db.search_table_rows(self.pk,
+                                         cv_tuples,
+                                         order_col_name='key',
+                                         order_asc=False,
+                                         column_names=['key'],
+                                         offset=1,
+                                         limit=2)
+        self.assertEqual([x[0] for x in qs], [3, 2])
+
+        # The count considers all the rows satisfying the search
+        self.assertEqual(
+            pandas_db.search_table_rows_count(self.pk, cv_tuples), 4)
+        self.assertEqual(pandas_db.search_table_rows_count(self.pk), 5)
+
+    def test_table_chunks(self):
+        df_source = pandas_db.load_df_from_csvfile(
+            StringIO.StringIO(self.csv),
+            0,
+            0)
+        pandas_db.store_table(df_source, pandas_db.create_table_name(self.pk))
+
+        chunk_size = pandas_db.stream_chunk_size
+        pandas_db.stream_chunk_size = 2
+        try:
+            chunks = list(pandas_db.get_table_chunks(self.pk, None, ['key']))
+        finally:
+            pandas_db.stream_chunk_size = chunk_size
+
+        self.assertEqual([x.shape[0] for x in chunks], [2, 2, 1])
+        self.assertEqual(
+            sorted(sum([list(x['key']) for x in chunks], [])),
+            [1, 2, 3, 4, 5])
+
+    def test_search_index(self):
+        df_source = pandas_db.load_df_from_csvfile(
+            StringIO.StringIO(self.csv),
+            0,
+            0)
+        pandas_db.store_table(df_source, pandas_db.create_table_name(self.pk))
+        pandas_db.create_search_index(self.pk)
+
+        # The text in the index is not part of the data
+        self.assertEqual(list(pandas_db.load_from_db(self.pk).columns),
+                         ['key', 'text1', 'double1'])
+
+        cv_tuples = [('text1', 'e', 'string')]
+        qs = pandas_db.search_table_rows(self.pk,
+                                         cv_tuples,
+                                         order_col_name='key',
+                                         column_names=['key'])
+        self.assertEqual([x[0] for x in qs], [4])
+
+        # Modified rows are found with the new values
+        pandas_db.update_row(self.pk, ['text1'], ['e2'], ['key'], [2])
+        qs = pandas_db.search_table_rows(self.pk,
+                                         cv_tuples,
+                                         order_col_name='key',
+                                         column_names=['key'])
+        self.assertEqual([x[0] for x in qs], [2, 4])
+
+        # Rows with a modified key are found with the new values
+        pandas_db.update_row(self.pk, ['key', 'text1'], [20, 'f20'],
+                             ['key'], [2])
+        qs = pandas_db.search_table_rows(self.pk,
+                                         [('text1', 'f', 'string')],
+                                         column_names=['key'])
+        self.assertEqual([x[0] for x in qs], [20])
+
+        pandas_db.increase_row_integer(self.pk, 'key', 'key', [(20, 1)])
+        qs = pandas_db.search_table_rows(self.pk,
+                                         [('key', '21', 'integer')],
+                                         column_names=['key'])
+        self.assertEqual([x[0] for x in qs], [21])
+
+        # Search restricted to other columns
+        qs = pandas_db.search_table_rows(self.pk,
+                                         [('double1', 'e', 'double')],
+                                         column_names=['key'])
+        self.assertEqual(len(qs), 0)
+
+    def test_search_index_pctg_name(self):
+        df_source = pandas_db.load_df_from_csvfile(
+            StringIO.StringIO(self.csv),
+            0,
+            0)
+        df_source.rename(columns={'text1': 'text%1'}, inplace=True)
+
+        # The index is created when storing the table
+        with override_settings(DATAOPS_SEARCH_INDEX_MIN_ROWS=1):
+            pandas_db.store_table(df_source,
+                                  pandas_db.create_table_name(self.pk))
+        self.assertTrue(pandas_db.has_search_index(
+            pandas_db.create_table_name(self.pk)))
+
+        qs = pandas_db.search_table_rows(self.pk,
+                                         [('text%1', 'e', 'string')],
+                                         column_names=['key'])
+        self.assertEqual([x[0] for x in qs], [4])
+
+
+class DataopsDataVersion(test.OntaskTestCase):
+    fixtures = ['simple_workflow_export']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'workflow',
+        'fixtures',
+        'simple_workflow_export_df.sql'
+    )
+
+    def setUp(self):
+        super(DataopsDataVersion, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsDataVersion, self).tearDown()
+
+    def test_data_version_increases(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        version = workflow.get_data_version()
+
+        # Saving the workflow does not change the data version
+        workflow.session_key = ''
+        workflow.save()
+        self.assertEqual(workflow.get_data_version(), version)
+
+        # Storing the data frame does
+        df = pandas_db.load_from_db(workflow.id)
+        store_dataframe_in_db(df, workflow.id)
+        self.assertEqual(workflow.get_data_version(), version + 1)
+
+        # And so does deleting a row
+        key = next(c.name for c in workflow.columns.all() if c.is_key)
+        pandas_db.delete_table_row_by_key(workflow.id, (key, df[key][0]))
+        self.assertEqual(workflow.get_data_version(), version + 2)
+
+    def test_search_pages_key_order(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        key = next(c.name for c in workflow.columns.all() if c.is_key)
+        nrows = pandas_db.num_rows(workflow.id)
+
+        # The pages (without an order column) contain every row once
+        keys = []
+        for offset in range(nrows):
+            keys.extend([x[0] for x in pandas_db.search_table_rows(
+                workflow.id,
+                column_names=[key],
+                offset=offset,
+                limit=1)])
+        self.assertEqual(len(keys), nrows)
+        self.assertEqual(len(set(keys)), nrows)
+
+    def test_save_deleted_workflow(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        Workflow.objects.filter(pk=workflow.pk).delete()
+
+        # The workflow is inserted again
+        workflow.save()
+        self.assertTrue(Workflow.objects.filter(pk=workflow.pk).exists())
+
+
+class DataopsConditionCount(test.OntaskTestCase):
+    fixtures = ['simple_workflow_export']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'workflow',
+        'fixtures',
+        'simple_workflow_export_df.sql'
+    )
+
+    def setUp(self):
+        super(DataopsConditionCount, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(DataopsConditionCount, self).tearDown()
+
+    def test_workflow_update_n_rows_selected(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        conditions = Condition.objects.filter(action__workflow=workflow)
+        self.assertTrue(conditions.exists())
+
+        # Counts obtained condition by condition
+        for action in workflow.actions.all():
+            action.update_n_rows_selected()
+        expected = dict([(x.id, x.n_rows_selected) for x in conditions])
+
+        # Counts obtained with a single query
+        conditions.update(n_rows_selected=-1)
+        workflow_update_n_rows_selected(workflow.id)
+        self.assertEqual(
+            dict([(x.id, x.n_rows_selected) for x in conditions.all()]),
+            expected)
+
+    def test_column_dependencies(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        dependencies = get_column_dependencies(workflow.id)
+
+        # Every condition appears under the columns in its formula
+        for condition in Condition.objects.filter(action__workflow=workflow):
+            kind = 'filters' if condition.is_filter else 'conditions'
+            for column in condition.columns.all():
+                self.assertIn(condition.id, dependencies[column.name][kind])
+
+        # Modifying a condition discards the map
+        condition = Condition.objects.filter(action__workflow=workflow,
+                                             is_filter=False).first()
+        condition.formula = {}
+        condition.save()
+        self.assertFalse(any([condition.id in x['conditions']
+                              for x in get_column_dependencies(
+                                  workflow.id).values()]))
+
+    @override_settings(DATAOPS_DEFERRED_RECOUNT=True)
+    def test_deferred_recount(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        conditions = Condition.objects.filter(action__workflow=workflow)
+        workflow_update_n_rows_selected(workflow.id)
+        expected = dict([(x.id, x.n_rows_selected) for x in conditions])
+        conditions.update(n_rows_selected=-1)
+
+        # Several requests are coalesced
+        enqueue_n_rows_selected(workflow.id, ['age'])
+        enqueue_n_rows_selected(workflow.id, ['email'])
+        self.assertEqual(
+            PendingRecount.objects.get(workflow=workflow).column_names,
+            ['age', 'email'])
+        enqueue_n_rows_selected(workflow.id)
+        self.assertEqual(PendingRecount.objects.count(), 1)
+        self.assertIsNone(
+            PendingRecount.objects.get(workflow=workflow).column_names)
+
+        # Nothing changes until the queue is processed
+        self.assertTrue(all([x.n_rows_selected == -1
+                             for x in conditions.all()]))
+        self.assertEqual(process_pending_recounts(), 1)
+        self.assertFalse(PendingRecount.objects.exists())
+        self.assertEqual(
+            dict([(x.id, x.n_rows_selected) for x in conditions.all()]),
+            expected)
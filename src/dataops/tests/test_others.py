@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import mock
+import numpy as np
+import pandas as pd
 from django.test import TestCase
 
 from dataops import formula_evaluation
@@ -63,3 +66,70 @@ class HasVariableTest(TestCase):
                 self.formula1, {'UOS_Code_a': 'df', 'ANOTHER': 'v2'}
             )
         )
+
+    def test_compile_formula(self):
+
+        values = [{'UOS_Code_a': 'df', 'ANOTHER': 'v2'},
+                  {'UOS_Code_a': 'df', 'ANOTHER': 'v3'},
+                  {'UOS_Code_a': None, 'ANOTHER': 'v2'}]
+
+        # The compiled formula gives the same result as the evaluation
+        compiled = formula_evaluation.compile_formula(self.formula2)
+        for value in values:
+            self.assertEqual(
+                compiled(value),
+                formula_evaluation.evaluate_node(self.formula2, value))
+
+        # The compiled function is shared by identical formulas
+        self.assertIs(
+            compiled,
+            formula_evaluation.compile_formula(dict(self.formula2)))
+
+        # Or by the formulas with the same key (the hash is not used)
+        keyed = formula_evaluation.compile_formula(self.formula2, 'key1')
+        with mock.patch.object(formula_evaluation,
+                               'get_formula_key') as get_formula_key:
+            self.assertIs(
+                keyed,
+                formula_evaluation.compile_formula(self.formula2, 'key1'))
+        get_formula_key.assert_not_called()
+
+    def test_compile_not_begins_with(self):
+
+        formula = {u'not': False, u'rules': [
+            {u'value': u'd', u'field': u'UOS_Code_a',
+             u'operator': u'not_begins_with', u'input': u'text',
+             u'type': u'string', u'id': u'UOS_Code_a'}],
+                   u'valid': True, u'condition': u'AND'}
+        values = [{'UOS_Code_a': 'df'},
+                  {'UOS_Code_a': 'v2'},
+                  {'UOS_Code_a': None}]
+
+        compiled = formula_evaluation.compile_formula(formula)
+        self.assertEqual([compiled(x) for x in values], [False, True, True])
+
+    def test_evaluate_formula_df(self):
+
+        data_frame = pd.DataFrame({'UOS_Code_a': ['df', 'df', None],
+                                   'ANOTHER': ['v2', 'v3', 'v2'],
+                                   'num': [1.0, np.nan, 3.0]})
+
+        self.assertEqual(
+            list(formula_evaluation.evaluate_node_df(self.formula2,
+                                                     data_frame)),
+            [True, False, False])
+
+        # Unknown values (comparison with NULL) are not negated
+        formula = {u'not': True, u'rules': [
+            {u'value': u'1', u'field': u'num', u'operator': u'greater',
+             u'input': u'text', u'type': u'double', u'id': u'num'}],
+                   u'valid': True, u'condition': u'AND'}
+        self.assertEqual(
+            list(formula_evaluation.evaluate_node_df(formula, data_frame)),
+            [True, False, False])
+
+        # Same result when evaluating each row
+        compiled = formula_evaluation.compile_formula(formula)
+        self.assertEqual(
+            [compiled(row) for _, row in data_frame.iterrows()],
+            [True, False, False])
@@ -210,8 +210,7 @@ def row_update(request):
                          [unique_value])
 
     # Recompute all the values of the conditions in each of the actions
-    for act in workflow.actions.all():
-        act.update_n_rows_selected()
+    ops.workflow_update_n_rows_selected(workflow.id)
 
     # Log the event
     logs.ops.put(request.user,
@@ -285,8 +284,7 @@ def row_create(request):
     ops.store_dataframe_in_db(df, workflow.id)
 
     # Recompute all the values of the conditions in each of the actions
-    for act in workflow.actions.all():
-        act.update_n_rows_selected()
+    ops.workflow_update_n_rows_selected(workflow.id)
 
     # Log the event
     log_payload = zip(column_names, [str(x) for x in row_vals])
@@ -362,21 +360,21 @@ def run(request, pk):
 
     # POST is correct proceed with execution
 
-    # Get the data frame and select the appropriate columns
-    try:
-        dst_df = pandas_db.load_from_db(workflow.id)
-    except Exception:
-        messages.error(request, 'Exception while retrieving the data frame')
-        return render(request, 'error.html', {})
-
     # Take the list of inputs from the form if empty list is given.
     if not plugin_instance.input_column_names:
         plugin_instance.input_column_names = \
             [c.name for c in form.cleaned_data['columns']]
 
-    # Get the proper subset of the data frame
-    sub_df = dst_df[[form.cleaned_data['merge_key']] +
-                    plugin_instance.input_column_names]
+    # Get the data frame with only the appropriate columns
+    try:
+        sub_df = pandas_db.load_from_db(
+            workflow.id,
+            [form.cleaned_data['merge_key']] +
+            plugin_instance.input_column_names
+        )
+    except Exception:
+        messages.error(request, 'Exception while retrieving the data frame')
+        return render(request, 'error.html', {})
 
     # Process the output columns
     for idx, output_cname in enumerate(plugin_instance.output_column_names):
@@ -413,7 +411,7 @@ def run(request, pk):
 
     # Additional checks
     # Result has the same number of rows
-    if result_df.shape[0] != dst_df.shape[0]:
+    if result_df.shape[0] != sub_df.shape[0]:
         status = 'Incorrect number of rows in result data frame.'
         context['exec_status'] = status
 
@@ -448,8 +446,9 @@ def run(request, pk):
                       'dataops/plugin_execution_report.html',
                       context)
 
-    # Proceed with the merge
+    # Proceed with the merge (the whole data frame is needed)
     try:
+        dst_df = pandas_db.load_from_db(workflow.id)
         result = ops.perform_dataframe_upload_merge(
             workflow.id,
             dst_df,
@@ -7,3 +7,6 @@ from django.apps import AppConfig
 class LogsConfig(AppConfig):
     name = 'logs'
     verbose_name = 'Event Logs'
+
+    def ready(self):
+        from . import signals  # noqa
@@ -1,8 +1,27 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import atexit
+import logging
+import threading
+
+from django.db import connection
+from django.utils.six.moves import queue
+
+from . import settings
 from .models import Log
 
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+# Events waiting to be written, one list per thread
+buffered = threading.local()
+
+# Queue and thread writing the events when ASYNC_FLUSH is True
+writer_queue = queue.Queue()
+writer_thread = None
+writer_lock = threading.Lock()
+
 log_types = {
     'workflow_create': 'Workflow created',
     'workflow_update': 'Workflow updated',
@@ -63,9 +82,140 @@ def put(user, name, workflow, payload):
     if name not in log_types.keys():
         raise Exception('Event', name, 'not allowed.')
 
+    # Keep the events in order (the buffered ones are written first)
+    flush(wait=True)
+
     event = Log()
     event.user = user
     event.name = name
     event.workflow = workflow
     event.set_payload(payload)
     event.save()
+
+
+def put_buffered(user, name, workflow, payload):
+    """
+    Append an event to the buffer of the current thread. The events are
+    written together (see flush) when the buffer reaches BUFFER_SIZE, at the
+    end of the request, or when calling flush or put. The payload is
+    serialized when written, so it must not be modified afterwards.
+
+    :param user: User object
+    :param name: Event name (in log_types)
+    :param workflow: Workflow object or None
+    :param payload: Dictionary with the information of the event
+    :return: Nothing
+    """
+    if name not in log_types:
+        raise Exception('Event', name, 'not allowed.')
+
+    events = get_buffer()
+    events.append((user, name, workflow, payload))
+    if len(events) >= settings.BUFFER_SIZE:
+        flush()
+
+
+def get_buffer():
+    """
+    :return: List with the events buffered in the current thread
+    """
+    events = getattr(buffered, 'events', None)
+    if events is None:
+        events = buffered.events = []
+    return events
+
+
+def flush(wait=False):
+    """
+    Write the events buffered in the current thread with a single bulk
+    insert (in a separate thread if ASYNC_FLUSH is True).
+
+    :param wait: When writing in a separate thread, wait until the events
+    are stored
+    :return: Number of events flushed
+    """
+    events = get_buffer()
+    if not events:
+        return 0
+
+    buffered.events = []
+    if settings.ASYNC_FLUSH:
+        start_writer()
+        done = threading.Event()
+        writer_queue.put((events, done))
+        if wait:
+            done.wait()
+    else:
+        write_events(events)
+
+    return len(events)
+
+
+def write_events(events):
+    """
+    Store the given events in the DB
+
+    :param events: List of tuples (user, name, workflow, payload)
+    :return: Nothing
+    """
+    logs = []
+    for user, name, workflow, payload in events:
+        event = Log(user=user, name=name, workflow=workflow)
+        event.set_payload(payload)
+        logs.append(event)
+
+    Log.objects.bulk_create(logs, batch_size=settings.BUFFER_SIZE)
+
+
+def write_events_loop():
+    """
+    Body of the thread writing the events until receiving None. The DB
+    connection of the thread is closed after each write.
+    """
+    while True:
+        item = writer_queue.get()
+        if item is None:
+            break
+
+        events, done = item
+        try:
+            write_events(events)
+        except Exception as e:
+            logger.error('Unable to write {0} log events: {1}'.format(
+                len(events),
+                str(e))
+            )
+        finally:
+            connection.close()
+            done.set()
+
+
+def start_writer():
+    """
+    Start the thread writing the events (if not running yet)
+    """
+    global writer_thread
+
+    with writer_lock:
+        if writer_thread is not None:
+            return
+
+        writer_thread = threading.Thread(target=write_events_loop)
+        writer_thread.daemon = True
+        writer_thread.start()
+
+
+@atexit.register
+def stop_writer():
+    """
+    Write the pending events and stop the thread (if running)
+    """
+    global writer_thread
+
+    with writer_lock:
+        if writer_thread is None:
+            return
+
+        writer_queue.put(None)
+        writer_thread.join()
+        writer_thread = None
@@ -6,6 +6,12 @@ from django.db import models
 
 MAX_LIST_SIZE = getattr(settings, 'LOGS_MAX_LIST_SIZE', 200)
 
+# Number of buffered events (see ops.put_buffered) that triggers a write
+BUFFER_SIZE = getattr(settings, 'LOGS_BUFFER_SIZE', 500)
+
+# Write the buffered events in a separate thread
+ASYNC_FLUSH = getattr(settings, 'LOGS_ASYNC_FLUSH', False)
+
 if 'siteprefs' in settings.INSTALLED_APPS:
     # Respect those users who doesn't have siteprefs installed.
     from siteprefs.toolbox import patch_locals, register_prefs, pref
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, print_function
+
+from django.core.signals import request_finished
+from django.dispatch import receiver
+
+from . import ops
+
+
+@receiver(request_finished)
+def request_finished_handler(sender, **kwargs):
+    # Write the events buffered while serving the request
+    ops.flush()
@@ -309,6 +309,27 @@ SUMMERNOTE_CONFIG = {
 DATAOPS_CONTENT_TYPES = '["text/csv", "application/json", "application/gzip", "application/x-gzip", "application/vnd.ms-excel"]'
 DATAOPS_MAX_UPLOAD_SIZE = 209715200  # 200 MB
 
+# Cache alias (in CACHES) used to keep a copy of the workflow data frames
+# (empty to disable) and time to live of each copy
+DATAOPS_DF_CACHE = 'default'
+DATAOPS_DF_CACHE_TIMEOUT = CACHE_TTL
+
+# Workflow tables with at least these many rows are stored with a trigram
+# search index (None to create them only on demand)
+DATAOPS_SEARCH_INDEX_MIN_ROWS = 10000
+
+# Queue the recount of the conditions triggered by the learners (action in
+# submissions, email tracking) to be executed by scripts/recount_script.py
+DATAOPS_DEFERRED_RECOUNT = False
+
+# Store the increments of the email read tracking columns to be applied in
+# bulk by scripts/recount_script.py instead of updating the table in each
+# request
+DATAOPS_DEFERRED_INCREMENT = False
+
+# Number of failures after which a deferred increment is no longer tried
+DATAOPS_INCREMENT_MAX_ATTEMPTS = 5
+
 # Raise because default of 1000 is too short
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
 
@@ -346,6 +367,18 @@ EMAIL_ACTION_NOTIFICATION_SUBJECT = "OnTask: Action executed"
 EMAIL_ACTION_NOTIFICATION_SENDER = 'ontask@ontasklearning.org'
 EMAIL_ACTION_PIXEL = 'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR4nGP6zwAAAgcBApocMXEAAAAASUVORK5CYII='
 
+# Write the buffered log events (emails sent, read and actions served) in
+# a separate thread instead of at the end of the request or batch
+LOGS_ASYNC_FLUSH = False
+
+# Store the emails of the actions in the outbox to be sent by
+# scripts/outbox_script.py instead of sending them within the request
+EMAIL_ACTION_OUTBOX = False
+
+# Processes used to render the messages of an action (0 to render them in
+# the process serving the request)
+ACTION_RENDER_POOL_SIZE = 0
+
 LOGS_MAX_LIST_SIZE = 200
 
 SHORT_DATETIME_FORMAT = 'r'
@@ -32,6 +32,14 @@ if not TESTING:
         # '...
     }
 
+if TESTING:
+    # Keep the copies of the data frames in local memory while testing
+    CACHES['dataframes'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ontask-dataframes',
+    }
+    DATAOPS_DF_CACHE = 'dataframes'
+
 if DEBUG:
     print('BASE_DIR: ' + BASE_DIR())
     print('STATICFILES_DIRS: ' + ', '.join(STATICFILES_DIRS))
@@ -13,7 +13,7 @@ from django.views.decorators.csrf import csrf_exempt
 import logs.ops
 from action import settings
 from action.models import Action
-from dataops import pandas_db, ops
+from dataops import ops
 from django_auth_lti.decorators import lti_role_required
 from ontask.permissions import UserIsInstructor
 
@@ -80,27 +80,16 @@ def trck(request):
     column_dst = track_id.get('column_dst', '')
 
     if column_dst:
-        # Load the dataframe
-        data_frame = pandas_db.load_from_db(action.workflow.id)
-
-        # Extract the relevant fields from the track_id
-        column_to = track_id['column_to']
-        msg_to = track_id['to']
-        track_col_name = track_id['column_dst']
-        # New val in DF: df.loc[df['a']==1,'b'] = VAL
-        data_frame.loc[data_frame[column_to] == msg_to, track_col_name] += 1
-
-        # Save DF
-        ops.store_dataframe_in_db(data_frame, action.workflow.id)
-
-        # Get the tracking column and update all the conditions in the
-        # actions that have this column as part of their formulas
-        track_col = action.workflow.columns.get(name=track_col_name)
-        for action in action.workflow.actions.all():
-            action.update_n_rows_selected(track_col)
-
-    # Record the event
-    logs.ops.put(
+        # Increase the value in the row of the recipient (column_to equal to
+        # the email) and update the conditions that have the tracking column
+        # as part of their formulas (possibly deferred)
+        ops.enqueue_increment(action.workflow.id,
+                              column_dst,
+                              track_id['column_to'],
+                              track_id['to'])
+
+    # Record the event (written at the end of the request)
+    logs.ops.put_buffered(
         user,
         'action_email_read',
         action.workflow,
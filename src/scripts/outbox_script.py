@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Script to send the emails stored in the outbox when the setting
+EMAIL_ACTION_OUTBOX is true. The messages of each request are rendered,
+stored and then sent recording their status, so the script can be stopped
+and executed again without sending any message twice. It can be executed
+periodically (crontab or similar), or continuously with the option -l
+processing the outbox at the given interval (in seconds). Only one instance
+of the script processes the outbox at any time (the others finish right
+away)."""
+from __future__ import unicode_literals, print_function
+
+import getopt
+import logging
+import shlex
+import sys
+import time
+
+from action.outbox import lock_outboxes, process_outboxes, recover_outboxes
+
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+
+def run(*script_args):
+    """
+    Script to send the emails in the outbox. Example of its use
+
+    python manage.py runscript outbox_script --script-args "-d -l 5"
+
+    :param script_args: Arguments given to the script.
+            -d Turns on debug
+            -l seconds Keep running and process the outbox every given seconds
+    :return: Changes reflected in the db
+    """
+
+    # Parse the arguments
+    argv = shlex.split(script_args[0]) if script_args else []
+
+    # Default values for the arguments
+    debug = False
+    interval = None
+
+    # Parse options
+    try:
+        opts, args = getopt.getopt(argv, "dl:")
+    except getopt.GetoptError as e:
+        print(e.msg)
+        print(run.__doc__)
+        sys.exit(2)
+
+    # Store option values
+    for optstr, value in opts:
+        if optstr == "-d":
+            debug = True
+        if optstr == "-l":
+            try:
+                interval = float(value)
+            except ValueError:
+                print(run.__doc__)
+                sys.exit(2)
+
+    # Starting execution
+    if debug:
+        logger.info('Starting execution')
+
+    # Make sure no other instance is sending the messages
+    if not lock_outboxes():
+        logger.info('The outbox is being processed by another instance')
+        return
+
+    # Resume the work interrupted in a previous execution
+    recover_outboxes()
+
+    while True:
+        processed = process_outboxes()
+        if debug and processed:
+            logger.info('{0} outbox requests processed'.format(processed))
+
+        if interval is None:
+            break
+
+        time.sleep(interval)
+
+    # Finishing execution
+    if debug:
+        logger.info('Finished execution')
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Script to apply the increments of the email tracking columns that have been
+queued when the setting DATAOPS_DEFERRED_INCREMENT is true, and to execute
+the recounts of the conditions (number of rows selected) that have been
+queued when the setting DATAOPS_DEFERRED_RECOUNT is true. It can be executed
+periodically (crontab or similar), or continuously with the option -l
+processing the queues at the given interval (in seconds)."""
+from __future__ import unicode_literals, print_function
+
+import getopt
+import logging
+import shlex
+import sys
+import time
+
+from dataops.ops import process_pending_increments, process_pending_recounts
+
+# Get the logger object
+logger = logging.getLogger(__name__)
+
+
+def run(*script_args):
+    """
+    Script to apply the pending increments and execute the pending recounts.
+    Example of its use
+
+    python manage.py runscript recount_script --script-args "-d -l 5"
+
+    :param script_args: Arguments given to the script.
+            -d Turns on debug
+            -l seconds Keep running and process the queue every given seconds
+    :return: Changes reflected in the db
+    """
+
+    # Parse the arguments
+    argv = shlex.split(script_args[0]) if script_args else []
+
+    # Default values for the arguments
+    debug = False
+    interval = None
+
+    # Parse options
+    try:
+        opts, args = getopt.getopt(argv, "dl:")
+    except getopt.GetoptError as e:
+        print(e.msg)
+        print(run.__doc__)
+        sys.exit(2)
+
+    # Store option values
+    for optstr, value in opts:
+        if optstr == "-d":
+            debug = True
+        if optstr == "-l":
+            try:
+                interval = float(value)
+            except ValueError:
+                print(run.__doc__)
+                sys.exit(2)
+
+    # Starting execution
+    if debug:
+        logger.info('Starting execution')
+
+    while True:
+        processed = process_pending_increments()
+        if debug and processed:
+            logger.info('{0} increments applied'.format(processed))
+
+        processed = process_pending_recounts()
+        if debug and processed:
+            logger.info('{0} recounts executed'.format(processed))
+
+        if interval is None:
+            break
+
+        time.sleep(interval)
+
+    # Finishing execution
+    if debug:
+        logger.info('Finished execution')
@@ -18,7 +18,9 @@ import pytz
 from django.conf import settings as ontask_settings
 
 import logs
+from action import settings as action_settings
 from action.ops import send_messages
+from action.outbox import enqueue_messages
 from core import settings as core_settings
 from scheduler.models import ScheduledEmailAction
 
@@ -96,13 +98,24 @@ def execute_email_actions(debug):
                           'send_confirmation': item.send_confirmation,
                           'track_read': item.track_read})
 
-            result = send_messages(item.user,
-                                   item.action,
-                                   item.subject,
-                                   item.email_column.name,
-                                   item.user.email,
-                                   item.send_confirmation,
-                                   item.track_read)
+            if action_settings.EMAIL_OUTBOX:
+                # The messages are sent by the outbox script
+                enqueue_messages(item.user,
+                                 item.action,
+                                 item.subject,
+                                 item.email_column.name,
+                                 item.user.email,
+                                 item.send_confirmation,
+                                 item.track_read)
+                result = None
+            else:
+                result = send_messages(item.user,
+                                       item.action,
+                                       item.subject,
+                                       item.email_column.name,
+                                       item.user.email,
+                                       item.send_confirmation,
+                                       item.track_read)
             # If the result has some sort of message, push it to the log
             if result:
                 msg = 'Incorrect execution message: ' + str(result)
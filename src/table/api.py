@@ -58,8 +58,7 @@ class TableBasicOps(APIView):
             ops.store_dataframe_in_db(df, pk)
 
             # Update all the counters in the conditions
-            for action in wflow.actions.all():
-                action.update_n_rows_selected()
+            ops.workflow_update_n_rows_selected(wflow.id)
 
             return Response(None,
                             status=status.HTTP_201_CREATED)
@@ -89,9 +89,6 @@ def get_row_visualisations(request, view_id=None):
         return render(request, 'error.html',
                       {'message': 'Unable to update table row'})
 
-    # Get the dataframe
-    df = pandas_db.load_from_db(workflow.id)
-
     # If a view is given, filter the columns.
     if view_id:
         try:
@@ -105,6 +102,9 @@ def get_row_visualisations(request, view_id=None):
         columns_to_view = workflow.columns.all()
         column_names = None
 
+    # Get the dataframe (only the columns to view)
+    df = pandas_db.load_from_db(workflow.id, column_names)
+
     # Get the rows from the table
     row = pandas_db.execute_select_on_table(workflow.id,
                                             [update_key],
@@ -181,8 +181,8 @@ def stat_column(request, pk):
     except ObjectDoesNotExist:
         return redirect('workflow:index')
 
-    # Get the dataframe
-    df = pandas_db.load_from_db(workflow.id)
+    # Get the dataframe (only the column to show)
+    df = pandas_db.load_from_db(workflow.id, [column.name])
 
     # Extract the data to show at the top of the page
     stat_data = pandas_db.get_column_stats_from_df(df[column.name])
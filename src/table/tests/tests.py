@@ -1,6 +1,35 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
 
+import numpy as np
+import pandas as pd
 from django.test import TestCase
 
-# Create your tests here.
+from table.views import csv_stream
+
+
+class TableCsvStream(TestCase):
+
+    def test_csv_stream_types(self):
+        chunks = [
+            pd.DataFrame({'key': [1, 2],
+                          'flag': [True, False],
+                          'value': [1.5, 2.0]},
+                         columns=['key', 'flag', 'value']),
+            pd.DataFrame({'key': [3.0, np.nan],
+                          'flag': [None, True],
+                          'value': [np.nan, 4.0]},
+                         columns=['key', 'flag', 'value'])
+        ]
+        data_types = {'key': 'integer',
+                      'flag': 'boolean',
+                      'value': 'double'}
+
+        # The integers are written without decimals in both chunks
+        self.assertEqual(
+            ''.join(csv_stream(chunks, data_types)),
+            'key,flag,value\n'
+            '1,True,1.5\n'
+            '2,False,2.0\n'
+            '3,,\n'
+            ',True,4.0\n')
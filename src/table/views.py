@@ -7,12 +7,13 @@ from __future__ import unicode_literals, print_function
 from datetime import datetime
 
 import django_tables2 as tables
+import pandas as pd
 from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import IntegrityError
 from django.db.models import Q
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, reverse, render
 from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
@@ -189,6 +190,7 @@ def render_table_display_data(request, workflow, columns, formula,
             [(c.name, search_value, c.data_type) for c in columns]
         )
 
+    # Fetch only the requested page (length is -1 when showing all rows)
     qs = pandas_db.search_table_rows(
         workflow.id,
         cv_tuples,
@@ -196,14 +198,25 @@ def render_table_display_data(request, workflow, columns, formula,
         order_col_name,
         order_dir == 'asc',
         column_names,
-        formula
+        formula,
+        start,
+        length if length >= 0 else None
     )
 
+    # Count the rows satisfying the search only if there is one
+    if cv_tuples or formula:
+        records_filtered = pandas_db.search_table_rows_count(
+            workflow.id,
+            cv_tuples,
+            True,
+            formula
+        )
+    else:
+        records_filtered = workflow.nrows
+
     # Post processing + adding operation columns and performing the search
     final_qs = []
-    items = 0  # For counting the number of elements in the result
-    for row in qs[start:start + length]:
-        items += 1
+    for row in qs:
         if view_id:
             stat_url = reverse('table:stat_row_view', kwargs={'pk': view_id})
         else:
@@ -231,15 +244,11 @@ def render_table_display_data(request, workflow, columns, formula,
         # Create the list of elements to display and add it ot the final QS
         final_qs.append(new_element)
 
-        if items == length:
-            # We reached the number or requested elements, abandon.
-            break
-
     # Result to return as Ajax response
     data = {
         'draw': draw,
         'recordsTotal': workflow.nrows,
-        'recordsFiltered': len(qs),
+        'recordsFiltered': records_filtered,
         'data': final_qs
     }
 
@@ -397,8 +406,7 @@ def row_delete(request):
         workflow.save()
 
         # Update the value of all the conditions in the actions
-        for action in workflow.actions.all():
-            action.update_n_rows_selected()
+        ops.workflow_update_n_rows_selected(workflow.id)
 
         return JsonResponse(data)
 
@@ -674,18 +682,54 @@ def csvdownload(request, pk=None):
             return redirect(reverse('workflow:detail',
                                     kwargs={'pk': workflow.id}))
 
-    # Fetch the data frame
-    data_frame = pandas_db.get_subframe(
+    # Traverse the table in chunks
+    chunks = pandas_db.get_table_chunks(
         workflow.id,
         view,
         [x.name for x in view.columns.all()] if view is not None else None)
 
-    # Create the response object
-    response = HttpResponse(content_type='text/csv')
+    # Create the response object streaming the chunks as CSV
+    response = StreamingHttpResponse(
+        csv_stream(chunks,
+                   dict(workflow.columns.values_list('name', 'data_type'))),
+        content_type='text/csv')
     response['Content-Disposition'] = \
         'attachment; filename="ontask_table.csv"'
 
-    # Dump the data frame as the content of the response object
-    data_frame.to_csv(path_or_buf=response, sep=str(','), index=False)
-
     return response
+
+
+def csv_stream(chunks, data_types):
+    """
+    Generator to produce the CSV text for a sequence of data frames. The
+    header is only included in the first one. Integer and boolean columns
+    are written as objects, so that their values are written in the same
+    way in all the chunks (a chunk with NULL values would otherwise turn
+    integers into floats, e.g. 3.0 instead of 3).
+
+    :param chunks: Iterable with data frames with the same columns
+    :param data_types: Dictionary with the data type of each column
+    :return: Generator of strings with CSV text
+    """
+    header = True
+    for data_frame in chunks:
+        for cname in data_frame.columns:
+            data_type = data_types.get(cname)
+            if data_type == 'integer':
+                data_frame[cname] = pd.Series(
+                    [None if pd.isnull(x) else int(x)
+                     for x in data_frame[cname]],
+                    index=data_frame.index,
+                    dtype=object)
+            elif data_type == 'boolean':
+                data_frame[cname] = pd.Series(
+                    [None if pd.isnull(x) else bool(x)
+                     for x in data_frame[cname]],
+                    index=data_frame.index,
+                    dtype=object)
+
+        yield data_frame.to_csv(None,
+                                sep=str(','),
+                                index=False,
+                                header=header)
+        header = False
@@ -19,10 +19,11 @@ from .forms import (ColumnRenameForm,
 from .models import Column
 from .ops import (
     get_workflow,
+    workflow_add_column,
     workflow_delete_column,
     clone_column,
     reposition_columns,
-    reposition_column_and_update_df)
+    move_column)
 
 # These are the column operands offered through the GUI. They have immediate
 # translations onto Pandas operators over dataframes.
@@ -92,24 +93,23 @@ def column_add(request):
     column.workflow = workflow
     column.is_key = False
 
-    # Update the data frame, which must be stored in the form because
-    # it was loaded when validating it.
-    df = pandas_db.load_from_db(workflow.id)
-
-    # Add the column with the initial value
-    df = ops.data_frame_add_column(df, column, column_initial_value)
-
-    # Update the column type with the value extracted from the data frame
-    column.data_type = \
-        pandas_db.pandas_datatype_names[df[column.name].dtype.name]
+    # Empty strings are used as initial value for string columns
+    if column_initial_value is None and column.data_type == 'string':
+        column_initial_value = ''
 
-    # Update the positions of the appropriate columns
-    reposition_columns(workflow, workflow.ncols + 1, column.position)
+    # Integer and boolean columns without initial value (NULL) are stored
+    # as double, as the data frames represent these NULL values with NaN
+    if column_initial_value is None and \
+            column.data_type in ('integer', 'boolean'):
+        column.data_type = 'double'
 
-    column.save()
+    # Integer columns with a non integer initial value are stored as double
+    if column.data_type == 'integer' and \
+            isinstance(column_initial_value, float):
+        column.data_type = 'double'
 
-    # Store the df to DB
-    ops.store_dataframe_in_db(df, workflow.id)
+    # Add the column to the workflow and the table with the initial value
+    workflow_add_column(workflow, column, column_initial_value)
 
     # Log the event
     logs.ops.put(request.user,
@@ -308,17 +308,9 @@ def column_edit(request, pk):
         # no commit as we need to propagate the info to the df
         column = form.save(commit=False)
 
-        # Get the data frame from the form (should be
-        # loaded)
-        df = form.data_frame
-
-        # If there is a new name, rename the data frame columns
+        # If there is a new name, rename the column in the table
         if 'name' in form.changed_data:
-            # Rename the column in the data frame
-            df = ops.rename_df_column(df,
-                                      workflow,
-                                      old_name,
-                                      column.name)
+            ops.rename_column(workflow, old_name, column.name)
 
         if 'position' in form.changed_data:
             # Update the positions of the appropriate columns
@@ -333,9 +325,6 @@ def column_edit(request, pk):
         # Save the workflow
         workflow.save()
 
-        # And save the DF in the DB
-        ops.store_dataframe_in_db(df, workflow.id)
-
     data['form_is_valid'] = True
     data['html_redirect'] = ''
 
@@ -538,7 +527,7 @@ def column_move_prev(request, pk):
 
     # The workflow and column objects have been correctly obtained
     if column.position > 1:
-        reposition_column_and_update_df(workflow, column, column.position - 1)
+        move_column(workflow, column, column.position - 1)
 
     return JsonResponse({})
 
@@ -568,7 +557,7 @@ def column_move_next(request, pk):
 
     # The workflow and column objects have been correctly obtained
     if column.position < workflow.ncols:
-        reposition_column_and_update_df(workflow, column, column.position + 1)
+        move_column(workflow, column, column.position + 1)
 
     return JsonResponse({})
 
@@ -598,7 +587,7 @@ def column_move_top(request, pk):
 
     # The workflow and column objects have been correctly obtained
     if column.position > 1:
-        reposition_column_and_update_df(workflow, column, 1)
+        move_column(workflow, column, 1)
 
     return JsonResponse({})
 
@@ -628,6 +617,6 @@ def column_move_bottom(request, pk):
 
     # The workflow and column objects have been correctly obtained
     if column.position < workflow.ncols:
-        reposition_column_and_update_df(workflow, column, workflow.ncols)
+        move_column(workflow, column, workflow.ncols)
 
     return JsonResponse({})
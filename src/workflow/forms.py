@@ -95,14 +95,24 @@ class ColumnBasicForm(forms.ModelForm):
 
         self.fields['data_type'].choices = self.data_type_choices
 
+    def get_column_values(self):
+        """
+        Values of the column being edited. Only this column is loaded from
+        the DB (once), and it is left in the form for future use.
+
+        :return: Pandas series
+        """
+        if self.data_frame is None:
+            self.data_frame = pandas_db.load_from_db(
+                self.workflow.id,
+                column_names=[self.instance.name])
+
+        return self.data_frame[self.instance.name]
+
     def clean(self):
 
         data = super(ColumnBasicForm, self).clean()
 
-        # Load the data frame from the DB for various checks and leave it in
-        # the form for future use
-        self.data_frame = pandas_db.load_from_db(self.workflow.id)
-
         # Column name must be a legal variable name
         if 'name' in self.changed_data:
             # Name is legal
@@ -143,7 +153,7 @@ class ColumnBasicForm(forms.ModelForm):
                 # these categories (only if the column is being edited, though
                 if self.instance.name and \
                         not all([x in valid_values
-                                 for x in self.data_frame[self.instance.name]
+                                 for x in self.get_column_values()
                                  if x and not pd.isnull(x)]):
                     self.add_error(
                         'raw_categories',
@@ -270,8 +280,7 @@ class ColumnRenameForm(ColumnBasicForm):
 
             # Case 2: False -> True Unique values must be verified
             if not self.instance.is_key and \
-                    not ops.is_unique_column(self.data_frame[
-                                                 self.instance.name]):
+                    not ops.is_unique_column(self.get_column_values()):
                 self.add_error(
                     'is_key',
                     'The column does not have unique values for each row.'
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0022_auto_20180510_1157'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflow',
+            name='data_version',
+            field=models.IntegerField(blank=True, default=0, verbose_name='Table data version'),
+        ),
+    ]
@@ -58,6 +58,15 @@ class Workflow(models.Model):
                                   blank=True,
                                   null=True)
 
+    # Counter increased every time the data in the table changes. Unlike
+    # modified, it is not affected by other saves (lock, unlock, etc.) and
+    # is the key of the cached data frames (see pandas_db.load_table). It
+    # is only updated atomically through pandas_db.increase_data_version.
+    data_version = models.IntegerField(verbose_name='Table data version',
+                                       default=0,
+                                       null=False,
+                                       blank=True)
+
     # Name of the table storing the data frame
     data_frame_table_name = models.CharField(max_length=1024,
                                              default='',
@@ -76,6 +85,38 @@ class Workflow(models.Model):
     shared = models.ManyToManyField(settings.AUTH_USER_MODEL,
                                     related_name='shared_workflows')
 
+    def save(self, *args, **kwargs):
+        """
+        Save the workflow without overwriting data_version, as the value in
+        the object may be stale with respect to the one in the DB. The value
+        in the object is refreshed instead. If the workflow is not in the DB,
+        it is saved as usual.
+        """
+        if self.pk and not self._state.adding \
+                and not kwargs.get('force_insert', False) \
+                and kwargs.get('update_fields') is None:
+            data_version = Workflow.objects.filter(
+                pk=self.pk
+            ).values_list('data_version', flat=True).first()
+            if data_version is not None:
+                self.data_version = data_version
+                kwargs['update_fields'] = [
+                    x.name for x in self._meta.concrete_fields
+                    if not x.primary_key and x.name != 'data_version'
+                ]
+
+        super(Workflow, self).save(*args, **kwargs)
+
+    def get_data_version(self):
+        """
+        Function to access the current version of the data in the table.
+        The value is refreshed from the DB.
+
+        :return: Integer with the data version
+        """
+        self.refresh_from_db(fields=['data_version'])
+        return self.data_version
+
     def get_columns(self):
         """
         Function to access the Columns
@@ -8,7 +8,7 @@ from io import BytesIO
 from django.contrib.auth import get_user_model
 from django.contrib.sessions.models import Session
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
+from django.db.models import F, Q
 from django.http import HttpResponse
 from django.utils import timezone
 from rest_framework import serializers
@@ -389,6 +389,33 @@ def workflow_delete_column(workflow, column, cond_to_delete=None):
     return
 
 
+def workflow_add_column(workflow, column, initial_value=None):
+    """
+    Given a workflow and a new column (not saved yet), add it to the
+    workflow in the given position and to the table storing the data.
+    :param workflow: Workflow object
+    :param column: Column object to add
+    :param initial_value: Initial value for the column in all rows
+    :return: Nothing. Effect reflected in the database
+    """
+
+    # Update the positions of the appropriate columns
+    reposition_columns(workflow, workflow.ncols + 1, column.position)
+
+    column.save()
+
+    # Add the column to the DB table
+    pandas_db.df_add_column(workflow.id,
+                            column.name,
+                            column.data_type,
+                            initial_value)
+
+    # Update the information in the workflow
+    workflow.ncols = workflow.ncols + 1
+    workflow.set_query_builder_ops()
+    workflow.save()
+
+
 def clone_column(column, new_workflow=None, new_name=None):
     """
     Function that given a column clones it and changes workflow and name
@@ -427,10 +454,15 @@ def clone_column(column, new_workflow=None, new_name=None):
     column.position = old_position + 1
     column.save()
 
-    # Add the column to the table and update it.
-    data_frame = pandas_db.load_from_db(column.workflow.id)
-    data_frame[new_name] = data_frame[old_name]
-    ops.store_dataframe_in_db(data_frame, column.workflow.id)
+    # Add the column to the table and copy the values
+    pandas_db.df_add_column(column.workflow.id,
+                            column.name,
+                            column.data_type)
+    pandas_db.df_copy_column(column.workflow.id, old_name, column.name)
+
+    # Changes in the columns require rebuilding the query_builder_ops
+    column.workflow.set_query_builder_ops()
+    column.workflow.save()
 
     return column
 
@@ -462,14 +494,15 @@ def reposition_columns(workflow, from_idx, to_idx):
                                      position__lt=from_idx)
         step = 1
 
-    # Update the positions of the appropriate columns
-    for col in cols:
-        col.position = col.position + step
-        col.save()
+    # Update the positions of the appropriate columns in a single statement
+    cols.update(position=F('position') + step)
 
 
-def reposition_column_and_update_df(workflow, column, to_idx):
+def move_column(workflow, column, to_idx):
     """
+    Move a column to a new position. Only the position fields change, the
+    table in the DB stays untouched because the queries always select the
+    columns in the order given by their position.
 
     :param workflow: Workflow object for which the repositioning is done
     :param column: column object to relocate
@@ -477,8 +510,6 @@ def reposition_column_and_update_df(workflow, column, to_idx):
     :return: Content reflected in the DB
     """
 
-    df = pandas_db.load_from_db(workflow.id)
     reposition_columns(workflow, column.position, to_idx)
     column.position = to_idx
     column.save()
-    ops.store_dataframe_in_db(df, workflow.id)
@@ -208,7 +208,7 @@ class WorkflowExportSerializer(serializers.ModelSerializer):
         #           'query_builder_ops', 'columns', 'data_frame', 'actions')
 
         exclude = ('id', 'user', 'created', 'modified', 'data_frame_table_name',
-                   'session_key', 'shared')
+                   'session_key', 'shared', 'data_version')
 
 
 class WorkflowImportSerializer(WorkflowExportSerializer):
@@ -4,6 +4,7 @@ from __future__ import unicode_literals, print_function
 import gzip
 import os
 
+import mock
 from django.conf import settings
 from django.urls import reverse
 from django.utils.six import BytesIO
@@ -15,7 +16,7 @@ from selenium.webdriver.support.wait import WebDriverWait
 import test
 from dataops import pandas_db
 from workflow.models import Workflow
-from workflow.ops import do_export_workflow
+from workflow.ops import do_export_workflow, move_column, reposition_columns
 
 
 class WorkflowImportExport(test.OntaskTestCase):
@@ -59,6 +60,65 @@ class WorkflowImportExport(test.OntaskTestCase):
         self.assertEqual(workflow.query_builder_ops, data['query_builder_ops'])
 
 
+class WorkflowMoveColumn(test.OntaskTestCase):
+    fixtures = ['simple_workflow_export']
+    filename = os.path.join(
+        settings.BASE_DIR(),
+        'workflow',
+        'fixtures',
+        'simple_workflow_export_df.sql'
+    )
+
+    def setUp(self):
+        super(WorkflowMoveColumn, self).setUp()
+        pandas_db.pg_restore_table(self.filename)
+
+    def tearDown(self):
+        pandas_db.delete_all_tables()
+        super(WorkflowMoveColumn, self).tearDown()
+
+    def get_positions(self, workflow):
+        return list(workflow.columns.order_by('position').values_list(
+            'name', 'position'))
+
+    def test_move_column(self):
+        workflow = Workflow.objects.get(name='wflow1')
+        table_name = pandas_db.create_table_name(workflow.id)
+        names = [x for x, __ in self.get_positions(workflow)]
+        table_types = pandas_db.get_table_column_types(table_name)
+        version = workflow.get_data_version()
+
+        # Move the second column to the end
+        column = workflow.columns.get(position=2)
+        with mock.patch.object(pandas_db, 'store_table') as store_table:
+            move_column(workflow, column, workflow.ncols)
+
+        # Every position is updated
+        names = names[:1] + names[2:] + names[1:2]
+        self.assertEqual(self.get_positions(workflow),
+                         [(x, idx + 1) for idx, x in enumerate(names)])
+
+        # The table stored in the DB is untouched
+        store_table.assert_not_called()
+        self.assertEqual(pandas_db.get_table_column_types(table_name),
+                         table_types)
+        self.assertEqual(workflow.get_data_version(), version)
+
+        # And move it back
+        column = workflow.columns.get(position=workflow.ncols)
+        move_column(workflow, column, 2)
+        names = names[:1] + names[-1:] + names[1:-1]
+        self.assertEqual(self.get_positions(workflow),
+                         [(x, idx + 1) for idx, x in enumerate(names)])
+
+    def test_reposition_single_update(self):
+        workflow = Workflow.objects.get(name='wflow1')
+
+        # The positions are shifted with a single UPDATE
+        with self.assertNumQueries(1):
+            reposition_columns(workflow, 2, workflow.ncols)
+
+
 class WorkflowImport(test.OntaskLiveTestCase):
     fixtures = ['simple_workflow_export']
     filename = os.path.join(